@@ -0,0 +1,321 @@
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.services.outbox import get_outbox
+from app.services.rate_limiter import TokenBucketRegistry
+from app.services.send_ledger import get_send_ledger
+
+
+class Broadcast:
+    """A single message sent to a list of recipients, with live progress counters"""
+
+    MAX_ERRORS = 50
+
+    def __init__(self, session_name, recipients, message):
+        self.id = str(uuid.uuid4())
+        self.session_name = session_name
+        self.message = message
+        self.total = len(recipients)
+        self.pending = deque(recipients)
+        self.status = 'queued'
+        self.sent = 0
+        self.failed = 0
+        self.errors = deque(maxlen=self.MAX_ERRORS)
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.in_flight = 0
+        self.app = None
+        self.lock = threading.Lock()
+
+    def take(self, bucket):
+        """
+        (recipient, live): the next recipient if `bucket` has a token for it
+        right now, and whether the broadcast still has sends to hand out.
+        """
+        with self.lock:
+            if self.status != 'running' or not self.pending:
+                return None, False
+            if not bucket.try_acquire():
+                return None, True
+            self.in_flight += 1
+            return self.pending.popleft(), True
+
+    def record(self, recipient, success, error=None):
+        with self.lock:
+            if success:
+                self.sent += 1
+            else:
+                self.failed += 1
+                self.errors.append({'recipient': recipient, 'error': error})
+
+    def to_dict(self):
+        with self.lock:
+            end = self.finished_at or datetime.now()
+            elapsed = (end - self.started_at).total_seconds() if self.started_at else 0
+            return {
+                'id': self.id,
+                'session': self.session_name,
+                'status': self.status,
+                'total': self.total,
+                'queued': len(self.pending),
+                'sent': self.sent,
+                'failed': self.failed,
+                'throughput': round((self.sent + self.failed) / elapsed, 3) if elapsed > 0 else 0.0,
+                'created_at': self.created_at.isoformat(),
+                'started_at': self.started_at.isoformat() if self.started_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+                'errors': list(self.errors)
+            }
+
+
+class BroadcastManager:
+    """
+    Runs broadcasts at their WAHA session's pace. A single pacer thread goes
+    round the running broadcasts and hands out one send whenever that
+    broadcast's session bucket has a token, so all broadcasts on one session
+    share a pace and nothing ever blocks on a bucket.
+
+    With an outbox each send is enqueued there, so it gets the outbox's
+    retries, per-session fair share and durability, and the send ledger keeps
+    a recipient from getting the broadcast twice. At most `workers` sends are
+    queued or in flight at a time. Without one, sends run on a pool of
+    `workers` threads. Finished broadcasts are forgotten after `retention`
+    seconds.
+    """
+
+    def __init__(self, workers=8, rate=1.0, burst=5, outbox=None, retention=86400):
+        self.workers = workers
+        self.buckets = TokenBucketRegistry(rate, burst)
+        self.broadcasts = {}
+        self.outbox = outbox
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='broadcast')
+        self._lock = threading.Lock()
+        self._running = deque()
+        self._in_flight = 0
+        self._wake = threading.Condition()
+        self._pacer = None
+
+    def create(self, app, session_name, recipients, message, rate=None, burst=None):
+        if rate is not None or burst is not None:
+            self.buckets.get(session_name).configure(rate=rate, burst=burst)
+
+        broadcast = Broadcast(session_name, recipients, message)
+        with self._lock:
+            self._prune()
+            self.broadcasts[broadcast.id] = broadcast
+        self._start(app, broadcast)
+        return broadcast
+
+    def get(self, broadcast_id):
+        return self.broadcasts.get(broadcast_id)
+
+    def list(self):
+        with self._lock:
+            self._prune()
+            broadcasts = list(self.broadcasts.values())
+        return [broadcast.to_dict() for broadcast in broadcasts]
+
+    def _prune(self):
+        """Drop broadcasts that finished more than `retention` seconds ago; callers hold self._lock"""
+        cutoff = datetime.now() - timedelta(seconds=self.retention)
+        for broadcast_id, broadcast in list(self.broadcasts.items()):
+            with broadcast.lock:
+                expired = broadcast.finished_at is not None and broadcast.finished_at < cutoff \
+                    and broadcast.in_flight == 0
+            if expired:
+                del self.broadcasts[broadcast_id]
+
+    def pause(self, broadcast_id):
+        broadcast = self.get(broadcast_id)
+        if not broadcast:
+            return None
+        with broadcast.lock:
+            if broadcast.status in ('queued', 'running'):
+                broadcast.status = 'paused'
+        return broadcast
+
+    def resume(self, app, broadcast_id):
+        broadcast = self.get(broadcast_id)
+        if broadcast and broadcast.status == 'paused':
+            self._start(app, broadcast)
+        return broadcast
+
+    def cancel(self, broadcast_id):
+        broadcast = self.get(broadcast_id)
+        if not broadcast:
+            return None
+        with broadcast.lock:
+            if broadcast.status not in ('completed', 'cancelled'):
+                broadcast.status = 'cancelled'
+                broadcast.finished_at = datetime.now()
+        return broadcast
+
+    def _start(self, app, broadcast):
+        with broadcast.lock:
+            broadcast.status = 'running'
+            broadcast.started_at = broadcast.started_at or datetime.now()
+            broadcast.app = app
+        with self._wake:
+            if broadcast not in self._running:
+                self._running.append(broadcast)
+            if self._pacer is None or not self._pacer.is_alive():
+                self._pacer = threading.Thread(target=self._pace, name='broadcast-pacer', daemon=True)
+                self._pacer.start()
+            self._wake.notify()
+
+    def _pace(self):
+        while True:
+            with self._wake:
+                timeout = None
+                for _ in range(len(self._running)):
+                    if self._in_flight >= self.workers:
+                        # Every thread is busy; the next one to finish wakes us
+                        timeout = None
+                        break
+                    broadcast = self._running.popleft()
+                    bucket = self.buckets.get(broadcast.session_name)
+                    recipient, live = broadcast.take(bucket)
+                    if not live:
+                        # Paused, cancelled or handed out; resume puts it back
+                        self._finish_if_done(broadcast)
+                        continue
+                    self._running.append(broadcast)
+                    if recipient is None:
+                        wait = max(bucket.time_until(), 0.001)
+                        timeout = wait if timeout is None else min(timeout, wait)
+                        continue
+                    self._in_flight += 1
+                    self._dispatch(broadcast, recipient)
+                    timeout = 0
+                if timeout != 0:
+                    self._wake.wait(timeout)
+
+    def _dispatch(self, broadcast, recipient):
+        payload = broadcast_payload(broadcast, recipient)
+        if self.outbox is None:
+            self._executor.submit(self._send, broadcast, payload)
+            return
+        try:
+            self.outbox.enqueue('broadcast', payload, session=broadcast.session_name, job_id=broadcast.id,
+                                fire_time=payload['created_at'])
+        except Exception as e:
+            broadcast.app.logger.error(f"Could not queue broadcast {broadcast.id} for {recipient}: {str(e)}")
+            self.settle(broadcast, recipient, False, str(e))
+
+    def _send(self, broadcast, payload):
+        with broadcast.app.app_context():
+            try:
+                send_broadcast_message(payload)
+            except Exception as e:
+                current_app.logger.error(f"Broadcast {broadcast.id} failed for {payload['recipient']}: {str(e)}")
+                self.settle(broadcast, payload['recipient'], False, str(e))
+            else:
+                self.settle(broadcast, payload['recipient'], True)
+
+    def settle(self, broadcast, recipient, success=None, error=None):
+        """
+        Count a send that is over, freeing its slot. success=None means it was
+        dropped (the broadcast was cancelled) and counts as neither.
+        """
+        if success is not None:
+            broadcast.record(recipient, success, error)
+        with broadcast.lock:
+            broadcast.in_flight -= 1
+        with self._wake:
+            self._in_flight -= 1
+            self._wake.notify()
+        self._finish_if_done(broadcast)
+
+    @staticmethod
+    def _finish_if_done(broadcast):
+        with broadcast.lock:
+            if broadcast.status == 'running' and not broadcast.pending and broadcast.in_flight == 0:
+                broadcast.status = 'completed'
+                broadcast.finished_at = datetime.now()
+
+
+def broadcast_payload(broadcast, recipient):
+    """The outbox payload for sending `broadcast` to one recipient"""
+    return {
+        'broadcast_id': broadcast.id,
+        'session': broadcast.session_name,
+        'recipient': recipient,
+        'message': broadcast.message,
+        # Part of the ledger key, so a redelivery is recognised as the same send
+        'created_at': broadcast.created_at.isoformat()
+    }
+
+
+def send_broadcast_message(payload):
+    """Send one broadcast recipient its message, unless the send ledger shows it already went"""
+    from app.controllers.scheduler import _send_once
+    from app.controllers.whatsapp import WhatsAppController
+
+    return _send_once(
+        get_send_ledger(), payload['broadcast_id'], payload['created_at'], payload['recipient'],
+        lambda: WhatsAppController.send_message(payload['recipient'], payload['message'], payload['session'])
+    )
+
+
+def deliver_broadcast_message(payload):
+    """Outbox handler for broadcasts; a failure is retried by the outbox and counted once it gives up"""
+    manager = broadcast_manager
+    broadcast = manager.get(payload['broadcast_id']) if manager else None
+    if broadcast is not None and broadcast.status == 'cancelled':
+        manager.settle(broadcast, payload['recipient'])
+        return {'skipped': True, 'reason': 'broadcast cancelled'}
+    # A broadcast this process no longer tracks (e.g. after a restart) still goes out
+    result = send_broadcast_message(payload)
+    if broadcast is not None:
+        manager.settle(broadcast, payload['recipient'], True)
+    return result
+
+
+def broadcast_send_failed(payload, error):
+    """Outbox failure handler: count the recipient as failed once the outbox gives up"""
+    manager = broadcast_manager
+    broadcast = manager.get(payload['broadcast_id']) if manager else None
+    current_app.logger.error(f"Broadcast {payload['broadcast_id']} failed for {payload['recipient']}: {str(error)}")
+    if broadcast is not None:
+        manager.settle(broadcast, payload['recipient'], False, str(error))
+
+
+broadcast_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_broadcast_manager():
+    """Get the process-wide broadcast manager, configured from the app config"""
+    global broadcast_manager
+    with _manager_lock:
+        if broadcast_manager is None:
+            config = current_app.config
+            broadcast_manager = BroadcastManager(
+                workers=config.get('BROADCAST_WORKERS', 8),
+                rate=config.get('BROADCAST_RATE', 1.0),
+                burst=config.get('BROADCAST_BURST', 5),
+                outbox=get_outbox(),
+                retention=config.get('BROADCAST_RETENTION', 86400)
+            )
+        return broadcast_manager
+
+
+def parse_recipients(recipients):
+    """Accept a list or a comma/newline separated string of phone numbers"""
+    if isinstance(recipients, str):
+        recipients = recipients.replace('\n', ',').split(',')
+    seen = set()
+    cleaned = []
+    for recipient in recipients or []:
+        recipient = str(recipient).strip()
+        if recipient and recipient not in seen:
+            seen.add(recipient)
+            cleaned.append(recipient)
+    return cleaned
@@ -1,68 +1,274 @@
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_ADDED, EVENT_JOB_MODIFIED, EVENT_JOB_REMOVED
 from app.services.whatsapp_api import WhatsAppAPI
 import pytz
 from flask import current_app
-from datetime import datetime
+from datetime import datetime, timedelta
+import os
 import uuid
 from pytz import timezone
 from app.services.image_generator import ImageGenerator
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.job import Job
+from apscheduler.jobstores.base import JobLookupError
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from app.services.pocketbase import get_collection
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.job_store import SQLiteJobStore
+from app.services.batch_dispatch import BatchDispatcher
+from app.services.recurrence import RRuleTrigger, first_time_of_day
+from app.services.schedule_index import schedule_index
+from app.services.catchup import catchup
+from app.services.coordination import FiringExecutor, _run_firings, coordinator, current_firing, init_coordination
+from app.services.outbox import RetryLater, get_outbox, init_outbox
+from app.services.send_ledger import get_send_ledger, waha_message_id
+from app.services.metrics import SEND_DURATION, SENDS
+from app.utils.bulk_input import PayloadTooLarge
 
 # Create scheduler with proper timezone and settings
+JOB_DEFAULTS = {
+    'coalesce': False,
+    'max_instances': 1,
+    'misfire_grace_time': None
+}
+
+# Every firing is claimed through a lease first, so a job copied onto
+# several instances is still only sent once
 scheduler = BackgroundScheduler(
     timezone=timezone('Asia/Kuala_Lumpur'),
-    job_defaults={
-        'coalesce': False,
-        'max_instances': 1,
-        'misfire_grace_time': None
-    }
+    executors={'default': FiringExecutor()},
+    job_defaults=JOB_DEFAULTS
 )
 
 # Make sure scheduler is started when the application starts
 scheduler.start()
 
-def create_message_sender(app):
-    def send_message(phone, message, session_id=None, session_name=None, type="text", target="Chat", recurrence=None):
-        from app.controllers.whatsapp import WhatsAppController
-        from app.services.image_generator import ImageGenerator
+# Message jobs are persisted, so they reference module-level functions and
+# reach the Flask app through this global instead of closing over it
+_app = None
+_job_store = None
+_replicator = None
+# Set when SCHEDULER_DISPATCH_MODE is 'bucketed'
+_dispatcher = None
+
+# Progress of the startup restore from PocketBase, for the readiness endpoint
+restore_status = {
+    'state': 'idle',
+    'total': 0,
+    'restored': 0,
+    'failed': 0,
+    'pages': 0,
+    'started_at': None,
+    'finished_at': None,
+    'error': None
+}
+_restore_lock = threading.Lock()
+_rebalance_lock = threading.Lock()
+
+def send_scheduled_message(phone, message, session_id=None, session_name=None, type="text", target="Chat", recurrence=None,
+                           firing=None):
+    """
+    Job function for every scheduled message. A deferred retry carries the
+    original [job_id, fire time] in `firing`, so the send ledger sees it as
+    the same send.
+    """
+    kwargs = {
+        'session_id': session_id, 'session_name': session_name,
+        'type': type, 'target': target, 'recurrence': recurrence
+    }
+    if firing:
+        job_id, fire_time = firing[0], datetime.fromisoformat(firing[1])
+    else:
+        job_id, fire_time = current_firing() or (None, None)
+    with _app.app_context():
+        # Firing only records the send; outbox workers deliver it to WAHA
+        outbox = get_outbox()
+        if outbox is not None:
+            message_id = outbox.enqueue('scheduled', dict(
+                kwargs, phone=phone, message=message,
+                job_id=job_id, fire_time=fire_time.isoformat() if fire_time else None
+            ), session=session_name, job_id=job_id, fire_time=fire_time)
+            return {'queued': message_id}
+
+        # While WAHA or this session is known to be down, push the send back
+        # instead of tying up an executor thread on a request that will fail
+        retry = dict(kwargs, firing=[job_id, fire_time.isoformat()] if job_id and fire_time else None)
+        available, retry_after = WhatsAppAPI.is_available(session_name)
+        if not available:
+            defer_scheduled_send(send_scheduled_message, retry_after, [phone, message], retry)
+            return None
+
+        try:
+            return _deliver_message(phone, message, job_id=job_id, fire_time=fire_time, **kwargs)
+        except CircuitOpenError as e:
+            defer_scheduled_send(send_scheduled_message, e.retry_after, [phone, message], retry)
+            return None
+        except RetryLater as e:
+            # Another worker holds this send; try again once its claim would have gone stale
+            defer_scheduled_send(send_scheduled_message, e.retry_after, [phone, message], retry, reason=str(e))
+            return None
+
+def deliver_scheduled_message(payload):
+    """Outbox handler for scheduled messages; runs in an app context on an outbox worker"""
+    available, retry_after = WhatsAppAPI.is_available(payload.get('session_name'))
+    if not available:
+        raise RetryLater(retry_after, f"WAHA unavailable for session {payload.get('session_name')}")
+    return _deliver_message(**payload)
+
+def _send_once(ledger, job_id, fire_time, recipient, send):
+    """
+    Run send() unless the ledger shows this firing already reached `recipient`.
+    Without a firing identity (job_id and fire time) it just sends.
+    """
+    if ledger is None:
+        return send()
+    key = ledger.key(job_id, fire_time, recipient)
+    state = ledger.claim(key)
+    if state == ledger.SENT:
+        current_app.logger.info(f"{job_id} at {fire_time} already sent to {recipient}, skipping")
+        return {'skipped': True, 'id': ledger.lookup(key)[1]}
+    if state == ledger.BUSY:
+        raise RetryLater(ledger.stale_after, f"{job_id} at {fire_time} to {recipient} is being sent elsewhere")
+    try:
+        result = send()
+    except BaseException:
+        ledger.release(key)
+        raise
+    ledger.mark_sent(key, waha_message_id(result))
+    return result
+
+def _send_bulk_once(ledger, job_id, fire_time, phones, message, session_name):
+    """send_bulk_message to the recipients this firing has not reached yet, raising if any are left over"""
+    from app.controllers.whatsapp import WhatsAppController
+
+    if ledger is None:
+        return WhatsAppController.send_bulk_message(phones, message, session_name)
+
+    keys = {phone: ledger.key(job_id, fire_time, phone) for phone in phones}
+    states = {phone: ledger.claim(key) for phone, key in keys.items()}
+    pending = [phone for phone, state in states.items() if state == ledger.CLAIMED]
+    busy = [phone for phone, state in states.items() if state == ledger.BUSY]
+    try:
+        results = WhatsAppController.send_bulk_message(pending, message, session_name) if pending else []
+    except BaseException:
+        for phone in pending:
+            ledger.release(keys[phone])
+        raise
+
+    for result in results:
+        if result['success']:
+            ledger.mark_sent(keys[result['recipient']], waha_message_id(result.get('response')))
+        else:
+            ledger.release(keys[result['recipient']])
+    failed = sum(1 for result in results if not result['success'])
+    if failed or busy:
+        # A retry of this firing only goes to the recipients still missing
+        raise Exception(f"{failed} of {len(phones)} recipients failed, {len(busy)} being sent elsewhere")
+    return results
+
+def _deliver_message(phone, message, session_id=None, session_name=None, type="text", target="Chat",
+                     recurrence=None, job_id=None, fire_time=None):
+    """Send a scheduled message to WAHA now, once per recipient per firing, raising on failure"""
+    from app.controllers.whatsapp import WhatsAppController
+    from app.services.image_generator import ImageGenerator
+
+    current_app.logger.info(
+        f"Sending scheduled message {job_id} (session {session_name}/{session_id}, type {type}, "
+        f"target {target}, recurrence {recurrence})"
+    )
+
+    ledger = get_send_ledger() if job_id and fire_time else None
+    labels = {'session': session_name or session_id or 'none', 'target': target}
+    started = time.monotonic()
+    
+    try:
+        if target == "Status":
+            # Generate and post gold price status
+            def post_status():
+                posted = ImageGenerator.generate_and_post_status(session_name)
+                if posted is None:
+                    raise Exception("Failed to generate and post status")
+                return posted
+            result = _send_once(ledger, job_id, fire_time, 'status', post_status)
+        elif isinstance(phone, (list, tuple)) or ',' in str(phone):
+            # Fan out to several recipients without blocking on each one
+            phones = phone if isinstance(phone, (list, tuple)) else [p.strip() for p in phone.split(',') if p.strip()]
+            result = _send_bulk_once(ledger, job_id, fire_time, phones, message, session_name)
+        else:
+            # Send regular chat message
+            result = _send_once(ledger, job_id, fire_time, phone,
+                                lambda: WhatsAppController.send_message(phone, message, session_name))
         
-        with app.app_context():
-            current_app.logger.info(f"Attempting to send scheduled message at {datetime.now()}")
-            current_app.logger.info(f"Session Name: {session_name}")
-            current_app.logger.info(f"Session ID: {session_id}")
-            current_app.logger.info(f"Type: {type}")
-            current_app.logger.info(f"Target: {target}")
-            current_app.logger.info(f"Recurrence: {recurrence}")
-            
-            try:
-                if target == "Status":
-                    # Generate and post gold price status
-                    result = ImageGenerator.generate_and_post_status(session_name)
-                    if result is None:
-                        raise Exception("Failed to generate and post status")
-                else:
-                    # Send regular chat message
-                    result = WhatsAppController.send_message(phone, message, session_name)
-                
-                current_app.logger.info(f"Message sent successfully")
-                current_app.logger.info(f"API Response: {result}")
-                return result
-                
-            except Exception as e:
-                current_app.logger.error(f"Error sending message: {str(e)}")
-                current_app.logger.exception("Full traceback:")
-                raise e
-    return send_message
+        SEND_DURATION.observe(time.monotonic() - started, **labels)
+        SENDS.inc(result='success', **labels)
+        current_app.logger.info(f"Message sent successfully")
+        current_app.logger.debug(f"API Response: {result}")
+        return result
+        
+    except (CircuitOpenError, RetryLater):
+        SENDS.inc(result='deferred', **labels)
+        raise
+    except Exception as e:
+        SENDS.inc(result='failure', **labels)
+        current_app.logger.error(f"Error sending message: {str(e)}")
+        current_app.logger.exception("Full traceback:")
+        raise e
 
-def add_scheduled_message(session_id, session_name, hour, minute, phone, message, type="text", target="Chat", start_date=None, recurrence=None):
+def deliver_text_message(payload):
+    """Outbox handler for /api/message/send"""
+    from app.controllers.whatsapp import WhatsAppController
+
+    return WhatsAppController.send_message(payload['phone'], payload['message'], payload.get('session'))
+
+def compact_send_ledger(app=None):
+    """Drop send ledger entries older than SEND_LEDGER_TTL"""
+    app = app or _app
+    with app.app_context():
+        return get_send_ledger().compact(app.config.get('SEND_LEDGER_TTL', 604800))
+
+def create_message_sender(app):
+    """Bind the scheduler's jobs to `app` and return the picklable send function"""
+    global _app
+    _app = app
+    return send_scheduled_message
+
+def defer_scheduled_send(func, delay, args, kwargs, reason=None):
+    """Run a send again once the circuit breaker (or whatever held it up) is expected to let it through"""
+    run_date = datetime.now(scheduler.timezone) + timedelta(seconds=max(delay, 1))
+    scheduler.add_job(
+        func,
+        'date',
+        run_date=run_date,
+        id=f"deferred-{uuid.uuid4()}",
+        args=args,
+        kwargs=kwargs,
+        misfire_grace_time=None
+    )
+    current_app.logger.warning(
+        f"{reason or 'WAHA unavailable for session ' + str(kwargs.get('session_name'))}, deferring send to {run_date}"
+    )
+
+# Triggers of user schedules, as opposed to one-off retries
+SCHEDULE_TRIGGERS = (CronTrigger, RRuleTrigger)
+
+def _message_executor():
+    """Executor for message jobs: the minute-bucket dispatcher when enabled, else the scheduler's pool"""
+    return _job_store.batch_executor if _dispatcher is not None else 'default'
+
+def _is_message_job(job):
+    """Whether a job is a user's scheduled message (not housekeeping or a deferred retry)"""
+    return 'session_id' in job.kwargs and not job.id.startswith('deferred-')
+
+def add_scheduled_message(session_id, session_name, hour, minute, phone, message, type="text", target="Chat", start_date=None, recurrence=None, job_id=None):
     """Add a new scheduled message with optional recurrence"""
     try:
         app = current_app._get_current_object()
         message_sender = create_message_sender(app)
         
-        job_id = str(uuid.uuid4())
+        job_id = job_id or str(uuid.uuid4())
         
         # Convert start_date from ISO string to datetime if provided
         if start_date:
@@ -91,7 +297,8 @@ def add_scheduled_message(session_id, session_name, hour, minute, phone, message
                         'recurrence': recurrence
                     },
                     replace_existing=True,
-                    misfire_grace_time=None
+                    misfire_grace_time=None,
+                    executor=_message_executor()
                 )
             except Exception as e:
                 current_app.logger.error(f"Error creating recurring job: {str(e)}")
@@ -120,6 +327,7 @@ def add_scheduled_message(session_id, session_name, hour, minute, phone, message
                 },
                 replace_existing=True,
                 misfire_grace_time=None,
+                executor=_message_executor(),
                 **trigger_kwargs
             )
         
@@ -133,12 +341,142 @@ def add_scheduled_message(session_id, session_name, hour, minute, phone, message
         current_app.logger.error(f"Error in add_scheduled_message: {str(e)}")
         raise Exception(f"Failed to schedule message: {str(e)}")
 
+def _message_job(job_id, trigger, args, kwargs, next_run_time):
+    """
+    A send_scheduled_message job, built from its state the way the job store
+    loads jobs. Job() would re-inspect the function's signature for every job
+    of a batch, though it is always the same function.
+    """
+    job = Job.__new__(Job)
+    job.__setstate__({
+        'version': 1,
+        'id': job_id,
+        'func': 'app.controllers.scheduler:send_scheduled_message',
+        'trigger': trigger,
+        'executor': _message_executor(),
+        'args': tuple(args),
+        'kwargs': kwargs,
+        'name': 'send_scheduled_message',
+        'next_run_time': next_run_time,
+        **JOB_DEFAULTS
+    })
+    job._scheduler = scheduler
+    return job
+
+def _schedule_trigger(hour, minute, start_date, recurrence, now, triggers):
+    """(trigger, first fire time) for a schedule, shared through `triggers` by rows with the same schedule"""
+    key = (hour, minute, start_date, recurrence)
+    if key not in triggers:
+        if start_date:
+            parsed = datetime.fromisoformat(str(start_date).replace('Z', '+00:00'))
+            start_date = parsed.astimezone(scheduler.timezone) if parsed.tzinfo else scheduler.timezone.localize(parsed)
+        if recurrence:
+            trigger = create_trigger_from_recurrence(recurrence, hour, minute, start_date)
+        else:
+            trigger = CronTrigger(hour=hour, minute=minute, start_date=start_date, timezone=scheduler.timezone)
+        triggers[key] = (trigger, trigger.get_next_fire_time(None, now))
+    return triggers[key]
+
+def _build_message_job(row, now, triggers, session_id=None, session_name=None):
+    """Validate one bulk row and build (without scheduling) its job. Raises on an invalid row."""
+    session_id = row.get('session_id') or row.get('session') or session_id
+    if not session_id:
+        raise ValueError("session_id is required")
+    target = row.get('target') or 'Chat'
+    if target not in ('Chat', 'Status'):
+        raise ValueError(f"Unknown target: {target}")
+    phone, message = row.get('phone'), row.get('message')
+    if target == 'Chat' and not (phone and message):
+        raise ValueError("phone and message are required")
+    try:
+        hour, minute = int(row.get('hour')), int(row.get('minute'))
+    except (TypeError, ValueError):
+        raise ValueError("hour and minute must be integers")
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError("hour or minute out of range")
+
+    recurrence = row.get('recurrence') or None
+    trigger, next_run_time = _schedule_trigger(hour, minute, row.get('start_date') or None, recurrence, now, triggers)
+    if next_run_time is None:
+        raise ValueError("Schedule has no future occurrences")
+
+    return _message_job(
+        str(row.get('id') or uuid.uuid4()),
+        trigger,
+        [phone, message],
+        {
+            'session_id': session_id,
+            'session_name': row.get('session_name') or session_name,
+            'type': row.get('type') or 'text',
+            'target': target,
+            'recurrence': recurrence
+        },
+        next_run_time
+    )
+
+def add_scheduled_messages(rows, session_id=None, session_name=None, atomic=True):
+    """
+    Schedule many messages at once. `rows` is an iterable of (row, parse error)
+    and may be a stream. Every row is validated first; the valid jobs are then
+    registered in one write, holding the scheduler's job store lock once for
+    the whole batch. With `atomic`, nothing is registered unless every row is valid.
+    Raises PayloadTooLarge if the batch has more than BULK_SCHEDULE_MAX_ROWS
+    rows, and ValueError if a streamed body cannot be read.
+    """
+    max_rows = current_app.config.get('BULK_SCHEDULE_MAX_ROWS', 100000)
+    now = datetime.now(scheduler.timezone)
+    jobs = []
+    results = []
+    seen = set()
+    triggers = {}
+    for index, (row, error) in enumerate(rows):
+        if index >= max_rows:
+            raise PayloadTooLarge(f"Batch is larger than {max_rows} rows")
+        if error is None:
+            try:
+                job = _build_message_job(row, now, triggers, session_id, session_name)
+                if job.id in seen:
+                    raise ValueError(f"Duplicate id {job.id}")
+                seen.add(job.id)
+                jobs.append(job)
+                results.append({'index': index, 'status': 'valid', 'id': job.id})
+                continue
+            except Exception as e:
+                error = str(e)
+        results.append({'index': index, 'status': 'error', 'message': error})
+
+    failed = len(results) - len(jobs)
+    committed = bool(jobs) and not (atomic and failed)
+    if committed:
+        with scheduler._jobstores_lock:
+            _register_jobs(jobs)
+        # Bulk writes raise no job events, so queue replication here
+        if _replicator is not None:
+            for job in jobs:
+                _replicator.mark_dirty(job.id)
+            _schedule_replication()
+    for result in results:
+        if result['status'] == 'valid':
+            result['status'] = 'success' if committed else 'skipped'
+
+    current_app.logger.info(
+        f"Bulk schedule: {len(results)} rows, {len(jobs) if committed else 0} scheduled, {failed} invalid"
+    )
+    return {
+        'total': len(results),
+        'created': len(jobs) if committed else 0,
+        'failed': failed,
+        'committed': committed,
+        'results': results
+    }
+
 def create_trigger_from_recurrence(recurrence_rule, hour, minute, start_date=None):
-    """Convert recurrence rule to APScheduler trigger"""
+    """Convert recurrence rule to APScheduler trigger; RRULEs get a full RFC 5545 trigger"""
     try:
         trigger_kwargs = {
             'hour': int(hour),
-            'minute': int(minute)
+            'minute': int(minute),
+            'timezone': scheduler.timezone
         }
         
         if start_date:
@@ -157,27 +495,12 @@ def create_trigger_from_recurrence(recurrence_rule, hour, minute, start_date=Non
                 trigger_kwargs['minute'] = int(cron_match.group(2))
                 return CronTrigger(**trigger_kwargs)
             
-        # Handle RRULE format
+        # Handle RRULE format (INTERVAL, COUNT, UNTIL, BYSETPOS, EXDATE...);
+        # the rule starts on start_date, or today, at hour:minute
         if 'FREQ=' in recurrence_rule:
-            if 'FREQ=DAILY' in recurrence_rule:
-                # For daily, we just need hour and minute which are already set
-                pass
-                
-            elif 'FREQ=WEEKLY' in recurrence_rule:
-                # Extract day of week
-                days = re.search(r'BYDAY=([^;]+)', recurrence_rule)
-                if days:
-                    # Convert from RRULE day format (MO,TU,etc) to cron format (0-6)
-                    day_map = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
-                    day_list = days.group(1).split(',')
-                    cron_days = [str(day_map[day]) for day in day_list]
-                    trigger_kwargs['day_of_week'] = ','.join(cron_days)
-                    
-            elif 'FREQ=MONTHLY' in recurrence_rule:
-                # Extract day of month
-                day = re.search(r'BYMONTHDAY=([^;]+)', recurrence_rule)
-                if day:
-                    trigger_kwargs['day'] = day.group(1)
+            dtstart = start_date or datetime.now(scheduler.timezone)
+            dtstart = dtstart.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+            return RRuleTrigger(recurrence_rule, dtstart, scheduler.timezone)
         
         # Create and return the trigger
         return CronTrigger(**trigger_kwargs)
@@ -188,58 +511,136 @@ def create_trigger_from_recurrence(recurrence_rule, hour, minute, start_date=Non
         current_app.logger.error(f"Trigger kwargs: {trigger_kwargs}")
         raise Exception(f"Invalid recurrence pattern: {str(e)}")
 
-def get_all_scheduled_messages(session_id=None):
-    """Get all scheduled messages, optionally filtered by session_id"""
-    jobs = scheduler.get_jobs()
+# Fields a scheduled message listing can be projected to
+MESSAGE_FIELDS = ('id', 'session_id', 'enabled', 'status', 'hour', 'minute', 'time', 'next_run',
+                  'phone', 'message', 'type', 'target', 'recurrence')
+
+def list_scheduled_messages(session_id=None, target=None, type=None, status=None, sort='next_run',
+                            cursor=None, limit=None, fields=None):
+    """
+    Scheduled messages from the schedule index, filtered, ordered by next run
+    ('next_run' or '-next_run') and projected to `fields`.
+    Returns: tuple (list, str) - (messages, next_cursor or None)
+    """
+    if sort not in ('next_run', '-next_run'):
+        raise ValueError(f"Cannot sort by {sort}")
+    fields = [field for field in (fields or MESSAGE_FIELDS) if field in MESSAGE_FIELDS] or list(MESSAGE_FIELDS)
+
+    rows, next_cursor = schedule_index.query(
+        {'session_id': session_id, 'target': target, 'type': type, 'status': status},
+        descending=sort.startswith('-'),
+        cursor=cursor,
+        limit=limit,
+        now=datetime.now(scheduler.timezone)
+    )
+
+    # Format the date and time
+    current_date = datetime.now().strftime("%d/%m/%Y")
     scheduled_messages = []
-    
-    for job in jobs:
-        # Skip jobs that don't match the session_id if specified
-        job_session = job.kwargs.get('session_id')  # Changed from session_name to session_id
-        if session_id and job_session != session_id:
-            continue
-            
-        trigger = job.trigger
-        
-        # Get the hour and minute from the trigger
-        hour = trigger.fields[5].expressions[0].first
-        minute = trigger.fields[6].expressions[0].first
-        
-        # Get phone and message from job args
-        phone, message = job.args if len(job.args) >= 2 else ('none', 'none')
-        
-        # Format the date and time
-        current_date = datetime.now()
-        formatted_time = current_date.strftime(f"%d/%m/%Y {hour:02}:{minute:02}")
-        
-        scheduled_messages.append({
-            'id': job.id,
-            'session_id': job_session,  # Changed from session_name to session_id
-            'enabled': True,
+    for next_run, entry in rows:
+        hour, minute = entry['hour'] or 0, entry['minute'] or 0
+        message = {
+            'id': entry['id'],
+            'session_id': entry['session_id'],
+            'enabled': entry['status'] != 'paused',
+            'status': entry['status'],
             'hour': hour,
             'minute': minute,
-            'time': formatted_time,
-            'phone': phone,
-            'message': message,
-            'type': job.kwargs.get('type', 'text'),
-            'target': job.kwargs.get('target', 'Chat'),
-            'recurrence': job.kwargs.get('recurrence', 'none'),
-        })
-    
+            'time': f"{current_date} {hour:02}:{minute:02}",
+            'next_run': next_run.isoformat() if next_run else None,
+            'phone': entry['phone'],
+            'message': entry['message'],
+            'type': entry['type'],
+            'target': entry['target'],
+            'recurrence': entry['recurrence'],
+        }
+        scheduled_messages.append({field: message[field] for field in fields})
+    return scheduled_messages, next_cursor
+
+def get_all_scheduled_messages(session_id=None):
+    """Get all scheduled messages, optionally filtered by session_id"""
+    scheduled_messages, _ = list_scheduled_messages(session_id=session_id)
     return scheduled_messages
 
+def _calendar_bound(value, default):
+    """An ISO date or datetime query parameter as an aware datetime in the scheduler's timezone"""
+    if not value:
+        return default
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        return scheduler.timezone.localize(parsed)
+    return parsed.astimezone(scheduler.timezone)
+
+def get_calendar(start=None, end=None, session_id=None, limit=None):
+    """
+    Every concrete occurrence of the scheduled messages in [start, end)
+    (ISO strings; by default the current month), in time order.
+    Raises ValueError for an unreadable or oversized window.
+    """
+    config = current_app.config
+    today = datetime.now(scheduler.timezone).replace(hour=0, minute=0, second=0, microsecond=0)
+    month_start = today.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    start = _calendar_bound(start, month_start)
+    end = _calendar_bound(end, scheduler.timezone.localize(next_month.replace(tzinfo=None)))
+    if end <= start:
+        raise ValueError("'to' must be after 'from'")
+    max_days = config.get('CALENDAR_MAX_DAYS', 92)
+    if end - start > timedelta(days=max_days):
+        raise ValueError(f"Window is longer than {max_days} days")
+    limit = min(int(limit or config.get('CALENDAR_MAX_OCCURRENCES', 20000)),
+                config.get('CALENDAR_MAX_OCCURRENCES', 20000))
+
+    occurrences, truncated = schedule_index.occurrences(start, end, session_id, limit)
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'occurrences': [
+            {
+                'id': entry['id'],
+                'session_id': entry['session_id'],
+                'time': fire_time,
+                'phone': entry['phone'],
+                'message': entry['message'],
+                'type': entry['type'],
+                'target': entry['target'],
+                'recurrence': entry['recurrence']
+            }
+            for fire_time, entry in occurrences
+        ],
+        'truncated': truncated
+    }
+
 def remove_scheduled_message(job_id):
     try:
         scheduler.remove_job(job_id)
         print(f"Removed scheduled message: ID={job_id}")
         return True
+    except JobLookupError:
+        if not _shares_jobs():
+            print(f"Error removing job {job_id}: no such job")
+            return False
     except Exception as e:
         print(f"Error removing job {job_id}: {e}")
         return False
 
-def check_waha_health():
-    """Scheduled task to check WAHA API health"""
-    app = current_app._get_current_object()
+    # Held by another instance: delete its record, and the instances holding
+    # the job drop it on their next sync with PocketBase
+    from app.services.job_replication import get_job_replicator
+    try:
+        removed = get_job_replicator().delete_remote(job_id)
+    except Exception as e:
+        print(f"Error removing job {job_id} from PocketBase: {e}")
+        return False
+    if not removed:
+        print(f"Error removing job {job_id}: no such job")
+        return False
+    print(f"Removed scheduled message from PocketBase: ID={job_id}")
+    return True
+
+def check_waha_health(app=None):
+    """Scheduled task to check WAHA API health, which also feeds the circuit breaker"""
+    app = app or current_app._get_current_object()
     with app.app_context():
         is_healthy, health_data = WhatsAppAPI.check_waha_health()
         WhatsAppAPI.log_health_status(is_healthy, health_data)
@@ -266,138 +667,530 @@ def check_session_status():
     
     print("Scheduler initialized with health and session checks")
 
-def backup_jobs_to_pocketbase():
-    """Backup all scheduler jobs to PocketBase"""
-    from app.services.pocketbase import create_record, update_record, get_first_record
-    
+def _job_record(job):
+    """The PocketBase record for a message job, or None for jobs that are not backed up"""
+    # One-off sends have no hour/minute to record
+    if not _is_message_job(job) or not isinstance(job.trigger, SCHEDULE_TRIGGERS):
+        return None
+
+    trigger = job.trigger
+    hour, minute = first_time_of_day(trigger)
+    if isinstance(trigger, RRuleTrigger):
+        recurrence = trigger.rule
+    else:
+        recurrence = str(trigger) if 'cron' in str(trigger).lower() else 'none'
+    phone, message = job.args if len(job.args) >= 2 else ('none', 'none')
+
+    return {
+        'job_id': job.id,
+        'session': job.kwargs.get('session_id'),  # Changed from session_name to session_id
+        'platform': 'Whatsapp',
+        'target': job.kwargs.get('target', 'Chat'),
+        'phone': phone,
+        'message': message,
+        'type': job.kwargs.get('type', 'text'),
+        'start_date': trigger.start_date.isoformat() if getattr(trigger, 'start_date', None) else None,
+        'recurrence': recurrence,
+        'status': 'pending',
+        'enabled': True,
+        'last_run': None,
+        'next_run': job.next_run_time.isoformat() if job.next_run_time else None,
+        'hour': hour,
+        'minute': minute
+    }
+
+def backup_jobs_to_pocketbase(full=True):
+    """
+    Replicate scheduler jobs to PocketBase, writing only what changed since the
+    last sync. A full backup also reconciles against a scan of the collection.
+    """
+    from app.services.job_replication import get_job_replicator
+
     try:
-        jobs = scheduler.get_jobs()
-        backed_up_count = 0
-        
-        for job in jobs:
-            # Extract job details
-            trigger = job.trigger
-            hour = trigger.fields[5].expressions[0].first
-            minute = trigger.fields[6].expressions[0].first
-            phone, message = job.args if len(job.args) >= 2 else ('none', 'none')
-            
-            # Create job data
-            job_data = {
-                'job_id': job.id,
-                'session': job.kwargs.get('session_id'),  # Changed from session_name to session_id
-                'platform': 'Whatsapp',
-                'target': job.kwargs.get('target', 'Chat'),
-                'phone': phone,
-                'message': message,
-                'type': job.kwargs.get('type', 'text'),
-                'start_date': job.trigger.start_date.isoformat() if hasattr(job.trigger, 'start_date') else None,
-                'recurrence': str(job.trigger) if 'cron' in str(job.trigger).lower() else 'none',
-                'status': 'pending',
-                'enabled': True,
-                'last_run': None,
-                'next_run': job.next_run_time.isoformat() if job.next_run_time else None,
-                'hour': hour,
-                'minute': minute
-            }
-            
-            try:
-                # Try to find existing job
-                existing_job = get_first_record('whatsappku_scheduled_messages', f'job_id = "{job.id}"')
-                if existing_job:
-                    # Update existing job
-                    update_record('whatsappku_scheduled_messages', existing_job.id, job_data)
-                else:
-                    # Create new job
-                    create_record('whatsappku_scheduled_messages', job_data)
-                backed_up_count += 1
-                
-            except Exception as e:
-                current_app.logger.error(f"Error backing up job {job.id}: {str(e)}")
-                
-        current_app.logger.info(f"Successfully backed up {backed_up_count} jobs to PocketBase")
-        return True
+        records = {}
+        for job in scheduler.get_jobs(jobstore='default'):
+            record = _job_record(job)
+            if record:
+                records[job.id] = record
+
+        stats = get_job_replicator().sync(records, full=full)
+        current_app.logger.info(
+            f"Backed up {len(records)} jobs to PocketBase: {stats['created']} created, "
+            f"{stats['updated']} updated, {stats['deleted']} deleted, {stats['failed']} failed "
+            f"in {stats['duration']}s (lag {stats['lag_seconds']}s)"
+        )
+        return stats['failed'] == 0
     except Exception as e:
         current_app.logger.error(f"Error backing up jobs to PocketBase: {str(e)}")
         return False
 
+def _job_from_record(record, session_mapping, now):
+    """Build (without scheduling) the job for one backed up PocketBase record"""
+    expanded = (getattr(record, 'expand', None) or {}).get('session')
+    # Get session name from the expanded relation or mapping, fallback to session ID if not found
+    session_name = getattr(expanded, 'name', None) or session_mapping.get(record.session, record.session)
+
+    # Parse the start_date to get hour and minute
+    start_date = record.start_date
+    if isinstance(start_date, str):
+        start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+    start_date = start_date.astimezone(pytz.timezone('Asia/Kuala_Lumpur'))
+
+    # Convert recurrence string back to proper format
+    recurrence = None
+    if record.recurrence and record.recurrence != 'none':
+        recurrence = record.recurrence
+
+    if recurrence:
+        trigger = create_trigger_from_recurrence(recurrence, start_date.hour, start_date.minute, start_date)
+    else:
+        trigger = CronTrigger(hour=start_date.hour, minute=start_date.minute, start_date=start_date,
+                              timezone=scheduler.timezone)
+
+    return _message_job(
+        record.job_id or str(uuid.uuid4()),
+        trigger,
+        [record.phone, record.message],
+        {
+            'session_id': record.session,
+            'session_name': session_name,
+            'type': record.target.lower() if record.target else "text",
+            'target': record.target if record.target else "Chat",
+            'recurrence': recurrence
+        },
+        trigger.get_next_fire_time(None, now)
+    )
+
+def _register_jobs(jobs):
+    """
+    Add built jobs in one write when the local store supports it. Callers
+    hold scheduler._jobstores_lock, as the scheduler does for its own writes.
+    """
+    if hasattr(_job_store, 'add_jobs'):
+        _job_store.add_jobs(jobs)
+        scheduler.wakeup()
+        # Bulk writes raise no job events, so the calendar index hears about them here
+        for job in jobs:
+            schedule_index.upsert(job)
+        return
+    for job in jobs:
+        scheduler.add_job(job.func, trigger=job.trigger, id=job.id, args=job.args, kwargs=job.kwargs,
+                          replace_existing=True, misfire_grace_time=None, executor=job.executor)
+
+def _session_mapping():
+    """Session IDs to session names, read in one pass over every page"""
+    from app.services.pocketbase import get_collection
+
+    return {session.id: session.name for session in get_collection('whatsappku_lov').get_full_list(batch=500)}
+
+def _fetch_record_pages():
+    """
+    Yield every page of enabled job records from PocketBase: the first page
+    on its own (to learn the page count), the rest fetched in parallel.
+    """
+    from app.services.pocketbase import get_collection
+
+    config = current_app.config
+    per_page = config.get('RESTORE_PAGE_SIZE', 200)
+    query = {'filter': 'enabled = true', 'expand': 'session', 'sort': 'created'}
+    collection = get_collection('whatsappku_scheduled_messages')
+
+    first = collection.get_list(1, per_page, query)
+    yield first
+    remaining = range(2, first.total_pages + 1)
+    if remaining:
+        with ThreadPoolExecutor(max_workers=config.get('RESTORE_CONCURRENCY', 4)) as pool:
+            yield from pool.map(lambda page: collection.get_list(page, per_page, query), remaining)
+
+def _load_records(records, session_mapping):
+    """Register jobs for PocketBase records in bulk. Returns (loaded, failed)."""
+    from app.services.job_replication import get_job_replicator
+
+    now = datetime.now(scheduler.timezone)
+    jobs = []
+    synced = []
+    failed = 0
+    for record in records:
+        try:
+            job = _job_from_record(record, session_mapping, now)
+            jobs.append(job)
+            synced.append((job.id, record.id, _job_record(job)))
+        except Exception as e:
+            failed += 1
+            current_app.logger.error(f"Error restoring job {getattr(record, 'job_id', record.id)}: {str(e)}")
+    if jobs:
+        with scheduler._jobstores_lock:
+            _register_jobs(jobs)
+        # Loaded jobs already match their records, so the next backup skips them
+        get_job_replicator().seed([entry for entry in synced if entry[2]])
+    return len(jobs), failed
+
 def restore_jobs_from_pocketbase():
-    """Restore scheduler jobs from PocketBase backup"""
-    from app.services.pocketbase import list_records, fetch_lov
-    from datetime import datetime
-    import pytz
-    
+    """
+    Restore scheduler jobs from PocketBase backup. Pages are fetched in
+    parallel and each page is registered in bulk as soon as it arrives.
+    With sharding on, only this node's sessions are restored.
+    """
+    with _restore_lock:
+        if restore_status['state'] == 'running':
+            return False
+        restore_status.update({
+            'state': 'running', 'total': 0, 'restored': 0, 'failed': 0, 'pages': 0,
+            'started_at': datetime.now().isoformat(), 'finished_at': None, 'error': None
+        })
+
     try:
-        # Get all backed up jobs
-        result1 = list_records('whatsappku_scheduled_messages', filter_str='enabled = true')
-        result2 = fetch_lov('whatsappku_lov')
-        
-        # Create a mapping of session IDs to session names
-        session_mapping = {}
-        for session in result2:
-            session_mapping[session.id] = session.name
-        
-        restored_count = 0
-        
-        for job in result1.items:
-            if not job.enabled:
-                continue
-                
-            try:
-                # Get session name from mapping, fallback to session ID if not found
-                session_name = session_mapping.get(job.session, job.session)
-                
-                # Parse the start_date to get hour and minute
-                start_date = datetime.fromisoformat(job.start_date.replace('Z', '+00:00')).astimezone(pytz.timezone('Asia/Kuala_Lumpur'))
-                hour = start_date.hour
-                minute = start_date.minute
-                
-                # Convert recurrence string back to proper format
-                recurrence = None
-                if job.recurrence and job.recurrence != 'none':
-                    recurrence = job.recurrence
-                
-                # Add job back to scheduler
-                add_scheduled_message(
-                    session_id=job.session,
-                    session_name=session_name,  # Use mapped session name
-                    hour=hour,
-                    minute=minute,
-                    phone=job.phone,
-                    message=job.message,
-                    type=job.target.lower() if job.target else "text",
-                    target=job.target if job.target else "Chat",
-                    start_date=job.start_date,
-                    recurrence=recurrence
-                )
-                restored_count += 1
-                
-            except Exception as e:
-                current_app.logger.error(f"Error restoring job {job.job_id}: {str(e)}")
-                current_app.logger.exception("Full traceback:")  # Add full traceback for debugging
-                
-        current_app.logger.info(f"Successfully restored {restored_count} jobs from PocketBase")
-        return True
+        session_mapping = _session_mapping()
+        for page in _fetch_record_pages():
+            restore_status['total'] = page.total_items
+            records = [record for record in page.items if coordinator.owns(record.session, grace=False)]
+            loaded, failed = _load_records(records, session_mapping)
+            restore_status['restored'] += loaded
+            restore_status['failed'] += failed
+            restore_status['pages'] += 1
+
+        restore_status['state'] = 'done'
+        current_app.logger.info(
+            f"Successfully restored {restore_status['restored']} of {restore_status['total']} jobs "
+            f"from PocketBase in {restore_status['pages']} pages"
+        )
+        return restore_status['failed'] == 0
     except Exception as e:
+        restore_status.update({'state': 'failed', 'error': str(e)})
         current_app.logger.error(f"Error restoring jobs from PocketBase: {str(e)}")
         current_app.logger.exception("Full traceback:")  # Add full traceback for debugging
         return False
+    finally:
+        restore_status['finished_at'] = datetime.now().isoformat()
+
+def _shard_key(job):
+    """Session a job is sharded by; None for jobs that are not replicated and so cannot move"""
+    if not _is_message_job(job) or not isinstance(job.trigger, SCHEDULE_TRIGGERS):
+        return None
+    return job.kwargs.get('session_id')
+
+def _shares_jobs():
+    """Whether other instances also change jobs, so this one has to keep pulling them from PocketBase"""
+    return coordinator.sharding or (_app is not None and _app.config.get('SCHEDULER_INSTANCES', 1) > 1)
+
+def rebalance_shard(app=None):
+    """
+    Bring this node's jobs in line with PocketBase and its shard. Every
+    instance has its own job store, so changes made on the others only
+    arrive through here: jobs deleted in PocketBase are dropped, jobs whose
+    record changed are replaced, and jobs this node owns but lacks are
+    loaded. With sharding on, jobs of sessions it no longer owns are also
+    handed off once PocketBase has them.
+    """
+    from app.services.job_replication import get_job_replicator
+
+    if not _shares_jobs():
+        return None
+    app = app or _app
+    with app.app_context(), _rebalance_lock:
+        replicator = get_job_replicator()
+        local = {job.id: job for job in scheduler.get_jobs(jobstore='default') if _shard_key(job) is not None}
+
+        handed_off = []
+        for job in local.values():
+            if coordinator.owns(_shard_key(job), grace=False):
+                continue
+            record = _job_record(job)
+            if replicator.is_synced(job.id, record):
+                # Straight to the store: a scheduler removal would replicate as a delete
+                try:
+                    with scheduler._jobstores_lock:
+                        _job_store.remove_job(job.id)
+                except JobLookupError:
+                    # Removed by a request since we listed it
+                    pass
+                schedule_index.remove(job.id)
+                handed_off.append(job.id)
+        replicator.forget(handed_off)
+
+        try:
+            session_mapping = _session_mapping()
+            records = {}
+            for page in _fetch_record_pages():
+                for record in page.items:
+                    if record.job_id:
+                        records[record.job_id] = record
+        except Exception as e:
+            # Only a complete listing can tell a deleted job from one not fetched
+            current_app.logger.error(f"Error loading jobs from PocketBase: {str(e)}")
+            return {'handed_off': len(handed_off), 'removed': 0, 'replaced': 0, 'loaded': 0, 'failed': 0,
+                    'error': str(e)}
+
+        now = datetime.now(scheduler.timezone)
+        remote = {}
+        for job_id, record in records.items():
+            try:
+                remote[job_id] = _job_record(_job_from_record(record, session_mapping, now))
+            except Exception:
+                remote[job_id] = None
+        # Listed after the fetch, so requests made meanwhile are seen as local changes
+        current = {job.id: _job_record(job) for job in scheduler.get_jobs(jobstore='default')
+                   if _shard_key(job) is not None and job.id not in handed_off}
+        remove, replace, load = replicator.reconcile(current, remote)
+        load = [job_id for job_id in load if coordinator.owns(records[job_id].session, grace=False)]
+
+        removed = []
+        for job_id in remove:
+            try:
+                with scheduler._jobstores_lock:
+                    _job_store.remove_job(job_id)
+            except JobLookupError:
+                continue
+            schedule_index.remove(job_id)
+            removed.append(job_id)
+        replicator.forget(removed)
+        loaded, failed = _load_records([records[job_id] for job_id in replace + load], session_mapping)
+
+        current_app.logger.info(
+            f"Jobs synced with PocketBase on {coordinator.node_id}: {len(handed_off)} handed off, "
+            f"{len(removed)} removed, {len(replace)} replaced, {len(load)} loaded, {failed} failed"
+        )
+        return {'handed_off': len(handed_off), 'removed': len(removed), 'replaced': len(replace),
+                'loaded': len(load), 'failed': failed}
+
+def restore_jobs_in_background(app):
+    """Restore from PocketBase on a separate thread so startup does not wait on the network"""
+    def run():
+        with app.app_context():
+            restore_jobs_from_pocketbase()
+
+    with _restore_lock:
+        restore_status['state'] = 'pending'
+    threading.Thread(target=run, name='restore-jobs', daemon=True).start()
+
+def is_ready():
+    """Whether startup is complete: the scheduler runs and no restore is pending"""
+    return scheduler.running and restore_status['state'] not in ('pending', 'running')
+
+def replicate_jobs_to_pocketbase(app=None, full=False):
+    """Push the local job store to the PocketBase replica from a scheduler thread"""
+    # Incremental syncs carry this node's own changes; the full reconcile is the leader's job
+    if full and not coordinator.is_leader():
+        return None
+    app = app or _app
+    with app.app_context():
+        return backup_jobs_to_pocketbase(full=full)
+
+def _on_job_change(event):
+    """Keep the calendar index current and replicate job changes to PocketBase shortly after, batching bursts"""
+    if event.jobstore != 'default' or _app is None:
+        return
+    if schedule_index.built:
+        job = None if event.code == EVENT_JOB_REMOVED else scheduler.get_job(event.job_id, jobstore='default')
+        if job is not None and _is_message_job(job):
+            schedule_index.upsert(job)
+        else:
+            schedule_index.remove(event.job_id)
+    _replicator.mark_dirty(event.job_id)
+    _schedule_replication()
+
+def _schedule_replication():
+    """Replicate to PocketBase after JOB_REPLICATION_DELAY, unless a run is already pending"""
+    if scheduler.get_job('replicate_jobs', jobstore='memory'):
+        return
+    scheduler.add_job(
+        replicate_jobs_to_pocketbase,
+        'date',
+        run_date=datetime.now(scheduler.timezone) + timedelta(seconds=_app.config.get('JOB_REPLICATION_DELAY', 30)),
+        id='replicate_jobs',
+        jobstore='memory',
+        args=[_app],
+        replace_existing=True
+    )
+
+def dispatch_due_messages():
+    """Minute tick of the bucketed dispatch mode"""
+    return _dispatcher.tick() if _dispatcher is not None else 0
+
+def use_batch_dispatch(app):
+    """
+    Switch message jobs to minute-bucketed dispatch if SCHEDULER_DISPATCH_MODE
+    asks for it (or back to one scheduler job each if not), rewriting the
+    executor of jobs stored under the other mode in one write.
+    """
+    global _dispatcher
+    config = app.config
+    if config.get('SCHEDULER_DISPATCH_MODE', 'jobs') == 'bucketed' and _dispatcher is None:
+        _dispatcher = BatchDispatcher(
+            scheduler,
+            _job_store,
+            max_workers=config.get('BATCH_DISPATCH_WORKERS', 8),
+            chunk_size=config.get('BATCH_DISPATCH_CHUNK', 50)
+        )
+
+    executor = _message_executor()
+    switched = []
+    for job in scheduler.get_jobs(jobstore='default'):
+        if _is_message_job(job) and isinstance(job.trigger, SCHEDULE_TRIGGERS) and job.executor != executor:
+            job._modify(executor=executor)
+            switched.append(job)
+    if switched:
+        with scheduler._jobstores_lock:
+            _job_store.add_jobs(switched)
+        scheduler.wakeup()
+        app.logger.info(f"Moved {len(switched)} scheduled messages to the '{executor}' executor")
+
+    if _dispatcher is not None:
+        # One wakeup per minute however many messages share it
+        scheduler.add_job(
+            dispatch_due_messages,
+            'cron',
+            second=0,
+            id='dispatch_due_messages',
+            jobstore='memory',
+            coalesce=True,
+            replace_existing=True
+        )
+
+def _catchup_type(job):
+    """Job type the catch-up policies are keyed on: a message's target, e.g. 'chat' or 'status'"""
+    # Deferred retries carry the same kwargs, so they follow their message's policy
+    return job.kwargs.get('target', 'Chat')
+
+def init_catchup(app):
+    """
+    Apply CATCHUP_POLICIES to firings missed while down, before the job store
+    is attached and the scheduler starts running them.
+    """
+    config = app.config
+    catchup.configure(
+        lambda job, jobstore_alias, run_times, logger_name: _run_firings(
+            job, jobstore_alias, run_times, logger_name, catch_up=False),
+        scheduler._dispatch_event,
+        policies=config.get('CATCHUP_POLICIES', 'status=coalesce,default=replay'),
+        after=config.get('CATCHUP_AFTER', 60),
+        window=config.get('CATCHUP_WINDOW', 600),
+        rate=config.get('CATCHUP_RATE', 2),
+        job_type=_catchup_type
+    )
+    catchup.start()
+
+def use_local_job_store(app):
+    """
+    Move the scheduler onto the SQLite job store under DATA_DIR.
+    Returns True if the store is empty, i.e. there is nothing to reload locally.
+    """
+    from app.services.job_replication import get_job_replicator
+
+    global _app, _job_store, _replicator
+    _app = app
+    if _job_store is not None:
+        return False
+
+    _replicator = get_job_replicator()
+    _job_store = SQLiteJobStore(os.path.join(app.config['DATA_DIR'], 'scheduler.sqlite3'))
+    scheduler.remove_jobstore('default')
+    scheduler.add_jobstore(_job_store, 'default')
+    # Housekeeping jobs carry the app object and are re-added on every boot
+    scheduler.add_jobstore('memory', 'memory')
+    scheduler.add_listener(_on_job_change, EVENT_JOB_ADDED | EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED)
+    schedule_index.attach(
+        lambda: [job for job in scheduler.get_jobs(jobstore='default') if _is_message_job(job)]
+    )
+    return _job_store.count_jobs() == 0
 
 # Add backup/restore endpoints to routes.py
 def init_scheduler_with_backup():
-    """Initialize scheduler and restore jobs from backup"""
+    """Initialize scheduler on the local job store, restoring from PocketBase only when it is empty"""
+    app = current_app._get_current_object()
     if not scheduler.running:
         scheduler.start()
-        restore_jobs_from_pocketbase()
+
+    init_coordination(app)
+    init_catchup(app)
+    coordinator.shard_key = _shard_key
+    coordinator.on_rebalance = lambda: threading.Thread(
+        target=rebalance_shard, args=(app,), name='rebalance-shard', daemon=True
+    ).start()
+    empty = use_local_job_store(app)
+    use_batch_dispatch(app)
+    from app.controllers.broadcast import broadcast_send_failed, deliver_broadcast_message
+    outbox = init_outbox(
+        app,
+        {'scheduled': deliver_scheduled_message, 'text': deliver_text_message, 'broadcast': deliver_broadcast_message},
+        on_failed={'broadcast': broadcast_send_failed}
+    )
+    schedule_index.build_in_background()
+    if empty:
+        restore_jobs_in_background(app)
+    elif _shares_jobs():
+        coordinator.on_rebalance()
         
-    # Schedule periodic backup
+    # Probe WAHA periodically so an open breaker closes as soon as it recovers
     scheduler.add_job(
-        backup_jobs_to_pocketbase,
+        check_waha_health,
+        'interval',
+        seconds=app.config.get('WAHA_HEALTH_INTERVAL', 30),
+        id='waha_health_check',
+        jobstore='memory',
+        args=[app],
+        replace_existing=True
+    )
+
+    # Keep the local contact index in step with WAHA
+    from app.services.contact_index import sync_contacts
+    scheduler.add_job(
+        sync_contacts,
+        'interval',
+        seconds=app.config.get('CONTACT_SYNC_INTERVAL', 900),
+        id='sync_contacts',
+        jobstore='memory',
+        args=[app],
+        replace_existing=True
+    )
+
+    # Delivered outbox messages are only kept around for inspection
+    if outbox is not None:
+        scheduler.add_job(
+            outbox.compact,
+            'interval',
+            hours=1,
+            id='compact_outbox',
+            jobstore='memory',
+            args=[app.config.get('OUTBOX_RETENTION', 604800)],
+            replace_existing=True
+        )
+
+    # The send ledger only has to outlive any retry or re-fire of a firing
+    scheduler.add_job(
+        compact_send_ledger,
+        'interval',
+        hours=1,
+        id='compact_send_ledger',
+        jobstore='memory',
+        args=[app],
+        replace_existing=True
+    )
+
+    # Periodic full reconcile, on top of the replication that follows each change
+    scheduler.add_job(
+        replicate_jobs_to_pocketbase,
         'interval',
         hours=1,
         id='backup_scheduler_jobs',
+        jobstore='memory',
+        args=[app],
+        kwargs={'full': True},
         replace_existing=True
     )
 
+    # Pick up jobs other instances created, changed or deleted (in this node's shard)
+    if _shares_jobs():
+        scheduler.add_job(
+            rebalance_shard,
+            'interval',
+            seconds=app.config.get('SHARD_SYNC_INTERVAL', 60),
+            id='rebalance_shard',
+            jobstore='memory',
+            args=[app],
+            replace_existing=True
+        )
+
 # Add to your scheduler initialization
 # scheduler.add_job(
 #     ImageGenerator.cleanup_old_images,
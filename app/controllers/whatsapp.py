@@ -24,10 +24,28 @@ class WhatsAppController:
                 chat_id=phone,
                 text=message
             )
+            response.raise_for_status()
             return response.json()
         except Exception as e:
             current_app.logger.error(f"Error sending message: {str(e)}")
             raise e
+
+    @staticmethod
+    def send_bulk_message(phones, message, session_name=None, concurrency=None):
+        """Send one message to many phone numbers concurrently, returning per-recipient results"""
+        from app.services.whatsapp_async import get_async_client
+
+        client = get_async_client(current_app._get_current_object())
+        results = list(client.send_many(
+            phones,
+            concurrency=concurrency,
+            session=session_name,
+            text=message
+        ))
+        failed = sum(1 for result in results if not result['success'])
+        if failed:
+            current_app.logger.warning(f"Bulk send finished with {failed}/{len(results)} failures")
+        return results
     
     @staticmethod
     def get_contacts(contact_id=None):
@@ -1,4 +1,4 @@
-from flask import current_app, render_template, request, jsonify, make_response
+from flask import current_app, render_template, request, jsonify, make_response, Response, stream_with_context
 from app.controllers import scheduler, whatsapp
 from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -36,8 +36,39 @@ def register_routes(app):
     @app.route('/api/contacts', methods=['GET'])
     def fetch_contacts():
         contact_id = request.args.get("contactId")  # Optional parameter
-        contacts = whatsapp.WhatsAppController.get_contacts(contact_id=contact_id)
-        return jsonify(contacts)
+        if contact_id and contact_id != 'all':
+            contacts = whatsapp.WhatsAppController.get_contacts(contact_id=contact_id)
+            return jsonify(contacts)
+
+        # Contact lists are served from the local index, synced from WAHA in the background
+        from app.services.contact_index import get_contact_index, sync_contacts_in_background
+
+        session = request.args.get('session') or current_app.config['WAHA_DEFAULT_SESSION']
+        index = get_contact_index()
+        state = index.sync_state(session)
+        if state is None or request.args.get('refresh') == 'true':
+            sync_contacts_in_background(current_app._get_current_object(), session)
+
+        try:
+            limit = min(int(request.args.get('limit', 50)), 1000)
+            fields = request.args.get('fields')
+            contacts, next_cursor = index.search(
+                session,
+                query=request.args.get('q'),
+                mode=request.args.get('match', 'prefix'),
+                limit=limit,
+                cursor=request.args.get('cursor'),
+                fields=fields.split(',') if fields else None
+            )
+        except (ValueError, TypeError) as e:
+            return jsonify({'status': 'error', 'message': f'Invalid query: {str(e)}'}), 400
+
+        return jsonify({
+            'status': 'success',
+            'data': contacts,
+            'next_cursor': next_cursor,
+            'sync': index.sync_state(session)
+        })
 
     @app.route('/api/scheduler/morning-message', methods=['GET'])
     def get_scheduler_status():
@@ -65,12 +96,43 @@ def register_routes(app):
             "message": message
         })
 
+    # Query parameters that ask for a page of scheduled messages instead of the full list
+    MESSAGE_PAGE_ARGS = ('limit', 'cursor', 'fields', 'sort', 'target', 'type', 'status')
+
+    def scheduled_messages_page(session_id):
+        """One page of scheduled messages from the schedule index, per the request's query parameters"""
+        from app.controllers.scheduler import list_scheduled_messages
+
+        try:
+            limit = min(int(request.args.get('limit', 100)), 1000)
+            fields = request.args.get('fields')
+            messages, next_cursor = list_scheduled_messages(
+                session_id=session_id,
+                target=request.args.get('target'),
+                type=request.args.get('type'),
+                status=request.args.get('status'),
+                sort=request.args.get('sort', 'next_run'),
+                cursor=request.args.get('cursor'),
+                limit=limit,
+                fields=fields.split(',') if fields else None
+            )
+        except (ValueError, TypeError) as e:
+            return jsonify({'status': 'error', 'message': f'Invalid query: {str(e)}'}), 400
+
+        return jsonify({
+            'status': 'success',
+            'data': messages,
+            'next_cursor': next_cursor
+        })
+
     @app.route('/api/scheduled-messages', methods=['GET', 'POST', 'DELETE'])
     def manage_scheduled_messages():
         from app.controllers.scheduler import add_scheduled_message, get_all_scheduled_messages, remove_scheduled_message
         
         if request.method == 'GET':
             session_id = request.args.get('session_id')
+            if any(arg in request.args for arg in MESSAGE_PAGE_ARGS):
+                return scheduled_messages_page(session_id)
             messages = get_all_scheduled_messages(session_id)
             return jsonify(messages)
         
@@ -126,6 +188,9 @@ def register_routes(app):
         """Get all scheduled messages for a specific session"""
         from app.controllers.scheduler import get_all_scheduled_messages
         
+        if any(arg in request.args for arg in MESSAGE_PAGE_ARGS):
+            return scheduled_messages_page(session_id)
+
         try:
             messages = get_all_scheduled_messages(session_id)
             return jsonify({
@@ -138,41 +203,73 @@ def register_routes(app):
                 'message': str(e)
             }), 400
 
+    @app.route('/api/calendar', methods=['GET'])
+    def get_calendar():
+        """Every occurrence of the scheduled messages between `from` and `to` (default: this month)"""
+        from app.controllers.scheduler import get_calendar
+
+        try:
+            calendar = get_calendar(
+                start=request.args.get('from'),
+                end=request.args.get('to'),
+                session_id=request.args.get('session_id'),
+                limit=request.args.get('limit')
+            )
+        except (ValueError, TypeError) as e:
+            return jsonify({'status': 'error', 'message': f'Invalid query: {str(e)}'}), 400
+
+        return jsonify({'status': 'success', **calendar})
+
     @app.route('/api/scheduled-messages/bulk', methods=['POST'])
     def bulk_schedule_messages():
-        """Create multiple scheduled messages at once"""
-        from app.controllers.scheduler import add_scheduled_message
-        
-        data = request.json
-        session_id = data.get('session')
-        messages = data.get('messages', [])
-        
-        results = []
-        for msg in messages:
-            try:
-                job_id = add_scheduled_message(
-                    session_id=session_id,
-                    hour=msg.get('hour'),
-                    minute=msg.get('minute'),
-                    phone=msg.get('phone'),
-                    message=msg.get('message')
-                )
-                results.append({
-                    'status': 'success',
-                    'id': job_id,
-                    'message': msg
-                })
-            except Exception as e:
-                results.append({
-                    'status': 'error',
-                    'message': str(e),
-                    'data': msg
-                })
-        
+        """
+        Create multiple scheduled messages at once, all or nothing. Takes a JSON
+        body ({session, messages}) or a streamed CSV/NDJSON body with one message
+        per row and ?session= as the default session. ?atomic=false keeps the
+        valid rows of a batch with invalid ones.
+        """
+        from app.controllers.scheduler import add_scheduled_messages
+        from app.utils.bulk_input import PayloadTooLarge, is_streamed, iter_rows
+        from werkzeug.exceptions import RequestEntityTooLarge
+
+        atomic = request.args.get('atomic', 'true').lower() != 'false'
+        streamed = is_streamed(request.content_type)
+        if streamed:
+            messages = None
+            rows = iter_rows(request.stream, request.content_type)
+            session_id = request.args.get('session')
+            session_name = request.args.get('session_name')
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict) or not isinstance(data.get('messages', []), list):
+                return jsonify({'status': 'error', 'message': 'Body must be a JSON object with a messages list'}), 400
+            messages = data.get('messages', [])
+            rows = ((msg, None) if isinstance(msg, dict) else (None, 'Each message must be an object')
+                    for msg in messages)
+            session_id = data.get('session')
+            session_name = data.get('session_name')
+
+        try:
+            summary = add_scheduled_messages(rows, session_id, session_name, atomic=atomic)
+        except (PayloadTooLarge, RequestEntityTooLarge) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 413
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except Exception as e:
+            current_app.logger.error(f"Error in bulk_schedule_messages: {str(e)}")
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
+        if messages is not None:
+            # JSON callers get their messages echoed back as before
+            for result in summary['results']:
+                key = 'message' if result['status'] == 'success' else 'data'
+                result[key] = messages[result['index']]
+
+        failed_atomic = atomic and summary['failed'] > 0
         return jsonify({
-            'status': 'success',
-            'results': results
-        })
+            'status': 'error' if failed_atomic else 'success',
+            **summary
+        }), 400 if failed_atomic else 200
 
     @app.route('/api/scheduled-messages/session/<session_name>/clear', methods=['POST'])
     def clear_session_messages(session_name):
@@ -206,37 +303,161 @@ def register_routes(app):
         """Endpoint to manually check WAHA API health"""
         
         from app.services.whatsapp_api import WhatsAppAPI
+        from app.services.circuit_breaker import breakers
         is_healthy, health_data = whatsapp.WhatsAppAPI.check_waha_health()
         
         return jsonify({
             'healthy': is_healthy,
             'timestamp': datetime.now().isoformat(),
-            'details': health_data
+            'details': health_data,
+            'breakers': breakers.to_dict()
         }), 200 if is_healthy else 503
-        
+
+    @app.route('/api/ready', methods=['GET'])
+    def check_ready():
+        """Readiness probe: 503 until the scheduler is up and its startup restore has finished"""
+        from app.controllers.scheduler import is_ready, restore_status
+
+        ready = is_ready()
+        return jsonify({
+            'ready': ready,
+            'timestamp': datetime.now().isoformat(),
+            'restore': restore_status
+        }), 200 if ready else 503
+
+    @app.route('/api/health/transport', methods=['GET'])
+    def get_transport_stats():
+        """Connection pool statistics for the WAHA HTTP transport"""
+        from app.services.http_transport import get_transport_stats
+
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'transports': get_transport_stats()
+        }), 200
+
+    @app.route('/api/health/media-cache', methods=['GET'])
+    def get_media_cache_stats():
+        """Hit/miss statistics for the media handle cache"""
+        from app.services.media_cache import get_media_cache
+
+        cache = get_media_cache()
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'enabled': cache is not None,
+            'stats': cache.get_stats() if cache else None
+        }), 200
+
+    @app.route('/media/cache/<name>', methods=['GET'])
+    def get_cached_media(name):
+        """Serve a cached media file to WAHA, only through an unexpired signed URL"""
+        from flask import send_from_directory
+        from app.services.media_cache import get_media_cache
+
+        cache = get_media_cache()
+        if cache is None or not cache.verify(name, request.args.get('expires'), request.args.get('signature')):
+            return jsonify({'status': 'error', 'message': 'Invalid or expired media link'}), 403
+        return send_from_directory(cache.cache_dir, name)
+
+    @app.route('/api/health/cluster', methods=['GET'])
+    def get_cluster_status():
+        """This node's identity, leadership and firing claims"""
+        from app.services.coordination import coordinator
+
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'cluster': coordinator.to_dict()
+        }), 200
+
+    @app.route('/api/health/dispatch', methods=['GET'])
+    def get_dispatch_stats():
+        """Last tick of the minute-bucketed message dispatcher, if enabled"""
+        from app.controllers.scheduler import _dispatcher
+
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'mode': current_app.config.get('SCHEDULER_DISPATCH_MODE', 'jobs'),
+            'stats': _dispatcher.stats if _dispatcher else None
+        }), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """Scheduler and delivery metrics in the Prometheus text format"""
+        from app.services.metrics import registry
+
+        return Response(registry.render(), mimetype=registry.CONTENT_TYPE)
+
+    @app.route('/api/health/outbox', methods=['GET'])
+    def get_outbox_stats():
+        """Queue depth, delivery lag and retry counts of the send outbox, and duplicates the send ledger stopped"""
+        from app.services.outbox import get_outbox
+        from app.services.send_ledger import get_send_ledger
+
+        outbox = get_outbox()
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'enabled': outbox is not None,
+            'stats': outbox.get_stats() if outbox else None,
+            'ledger': get_send_ledger().get_stats()
+        }), 200
+
+    @app.route('/api/outbox/<int:message_id>', methods=['GET'])
+    def get_outbox_message(message_id):
+        """Delivery state of a queued send"""
+        from app.services.outbox import get_outbox
+
+        outbox = get_outbox()
+        message = outbox.get(message_id) if outbox else None
+        if message is None:
+            return jsonify({'status': 'error', 'message': 'Message not found'}), 404
+        return jsonify({'status': 'success', 'data': message}), 200
+
+    @app.route('/api/health/replication', methods=['GET'])
+    def get_replication_stats():
+        """Sync lag and write counts of the scheduler's PocketBase replica"""
+        from app.services.job_replication import get_job_replicator
+
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'stats': get_job_replicator().get_stats()
+        }), 200
+
+    def cached_session_response(key, loader):
+        """Serve session state from the registry, answering 304 when the ETag still matches"""
+        from app.services.session_registry import session_registry
+
+        entry = session_registry.lookup(key, loader)
+        if isinstance(entry, tuple):
+            # WAHA unreachable and nothing cached yet: report the error uncached
+            return jsonify({
+                'timestamp': datetime.now().isoformat(),
+                'details': entry
+            }), 200
+
+        response = make_response(jsonify({
+            'timestamp': entry['timestamp'],
+            'details': entry['data']
+        }))
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
     @app.route('/api/sessions', methods=['GET'])
     def check_sessions_status():
-        """Endpoint to manually check WAHA session status"""
+        """Endpoint to check WAHA session status, served from the session registry"""
         from app.services.whatsapp_api import WhatsAppAPI
+        from app.services.session_registry import SessionRegistry
         
-        session_data = WhatsAppAPI.check_sessions_status()
-        
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'details': session_data
-        }), 200
+        return cached_session_response(SessionRegistry.ALL, WhatsAppAPI.check_sessions_status)
 
     @app.route('/api/session/<session_name>', methods=['GET'])
     def check_session_status(session_name):
-        """Endpoint to manually check WAHA session status"""
+        """Endpoint to check one WAHA session, served from the session registry"""
         from app.services.whatsapp_api import WhatsAppAPI
         
-        session_data = WhatsAppAPI.check_session_status(session_name)
-        
-        return jsonify({
-            'timestamp': datetime.now().isoformat(),
-            'details': session_data
-        }), 200
+        return cached_session_response(
+            session_name,
+            lambda: WhatsAppAPI.check_session_status(session_name)
+        )
         
     @app.route('/api/session/me', methods=['GET'])
     def check_session_status_me():
@@ -255,38 +476,47 @@ def register_routes(app):
     def create_session():
         """Create a new session"""
         from app.services.whatsapp_api import WhatsAppAPI
+        from app.services.session_registry import session_registry
         data = request.json
         success, result = WhatsAppAPI.create_session(data)
+        session_registry.invalidate(data.get('name'))
         return jsonify(result), 201 if success else 400
 
     @app.route('/api/session/delete', methods=['POST'])
     def delete_session():
         """Delete a session"""
         from app.services.whatsapp_api import WhatsAppAPI
+        from app.services.session_registry import session_registry
         data = request.json
         success, result = WhatsAppAPI.delete_session(data.get('name'))
+        session_registry.invalidate(data.get('name'))
         return jsonify(result), 200 if success else 400
 
     @app.route('/api/session/start', methods=['POST'])
     def start_session():
         """Start the session"""
         from app.services.whatsapp_api import WhatsAppAPI
+        from app.services.session_registry import session_registry
         data = request.json
         success, result = WhatsAppAPI.start_session(data.get('name'))
+        session_registry.invalidate(data.get('name'))
         return jsonify(result), 200 if success else 400
 
     @app.route('/api/session/stop', methods=['POST'])
     def stop_session():
         """Stop the session"""
         from app.services.whatsapp_api import WhatsAppAPI
+        from app.services.session_registry import session_registry
         data = request.json
         success, result = WhatsAppAPI.stop_session(data.get('name'))
+        session_registry.invalidate(data.get('name'))
         return jsonify(result), 200 if success else 400
 
     @app.route('/api/session/restart', methods=['POST'])
     def restart_session():
         """Restart the session"""
         from app.services.whatsapp_api import WhatsAppAPI
+        from app.services.session_registry import session_registry
         
         data = request.get_json()  # Use `get_json()` to handle missing JSON body safely
         if not data or 'name' not in data:
@@ -294,6 +524,7 @@ def register_routes(app):
 
         session_name = data['name']
         success, result = WhatsAppAPI.restart_session(session_name)
+        session_registry.invalidate(session_name)
 
         return jsonify(result), 200 if success else 400
 
@@ -348,8 +579,9 @@ def register_routes(app):
             
             current_app.logger.info(f"Session {session_name} status changed to {status}")
             
-            # Emit status to all connected clients via WebSocket
-            emit_session_status(session_name, status)
+            # Dashboard polls read the registry, so they see the change immediately
+            from app.services.session_registry import session_registry
+            session_registry.update_status(session_name, status)
             
             return jsonify({
                 'status': 'success',
@@ -364,7 +596,8 @@ def register_routes(app):
     @app.route('/api/scheduler/jobs', methods=['GET'])
     def get_scheduler_jobs():
         jobs = []
-        for job in scheduler.get_jobs():
+        # `scheduler` here is the controller module; the APScheduler instance lives on it
+        for job in scheduler.scheduler.get_jobs():
             jobs.append({
                 'id': job.id,
                 'next_run_time': str(job.next_run_time),
@@ -376,8 +609,21 @@ def register_routes(app):
     @app.route('/api/message/send', methods=['POST'])
     def send_message():
         from app.services.whatsapp_api import WhatsAppAPI
+        from app.services.outbox import get_outbox
         data = request.json
         
+        outbox = get_outbox()
+        if outbox is not None:
+            try:
+                message_id = outbox.enqueue('text', {
+                    'phone': data['phone'],
+                    'message': data['message'],
+                    'session': data['session']
+                }, session=data['session'])
+            except KeyError as e:
+                return jsonify({'success': False, 'error': f"Missing field: {e.args[0]}"}), 400
+            return jsonify({'success': True, 'message': 'Message queued', 'id': message_id}), 202
+
         try:
             response = WhatsAppAPI.send_text(
                 chat_id=data['phone'],
@@ -388,6 +634,118 @@ def register_routes(app):
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 400
 
+    @app.route('/api/chats/<chat_id>/messages/export', methods=['GET'])
+    def export_chat_messages(chat_id):
+        """
+        Stream a chat's full history as NDJSON, one {"cursor", "message"} object
+        per line. Pass the last cursor received as ?cursor= to resume.
+        """
+        from app.services.whatsapp_api import WhatsAppAPI
+
+        session = request.args.get('session') or current_app.config['WAHA_DEFAULT_SESSION']
+        cursor = request.args.get('cursor')
+        try:
+            page_size = min(int(request.args.get('page_size', 100)), 1000)
+            # Checks the cursor's shape now, while an error can still be a 400
+            messages = WhatsAppAPI.iter_messages(chat_id, session=session, page_size=page_size, cursor=cursor)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        def generate():
+            last_cursor = cursor
+            try:
+                for message, last_cursor in messages:
+                    yield json.dumps({'cursor': last_cursor, 'message': message}) + '\n'
+            except Exception as e:
+                current_app.logger.error(f"Error exporting messages for {chat_id}: {str(e)}")
+                yield json.dumps({'cursor': last_cursor, 'error': str(e)}) + '\n'
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename="{secure_filename(chat_id)}.ndjson"'}
+        )
+
+    @app.route('/api/broadcasts', methods=['GET', 'POST'])
+    def manage_broadcasts():
+        """List broadcasts or start a new one"""
+        from app.controllers.broadcast import get_broadcast_manager, parse_recipients
+
+        manager = get_broadcast_manager()
+        if request.method == 'GET':
+            return jsonify({
+                'status': 'success',
+                'data': manager.list(),
+                'rate_limits': manager.buckets.to_dict()
+            })
+
+        data = request.json or {}
+        session_name = data.get('session')
+        message = data.get('message')
+        recipients = parse_recipients(data.get('recipients'))
+        if not session_name or not message or not recipients:
+            return jsonify({
+                'status': 'error',
+                'message': 'session, message and recipients are required'
+            }), 400
+
+        from app.services.rate_limiter import TokenBucket
+        rate, burst = data.get('rate'), data.get('burst')
+        if rate is not None or burst is not None:
+            try:
+                TokenBucket.validate(1 if rate is None else rate, 1 if burst is None else burst)
+            except ValueError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        try:
+            broadcast = manager.create(
+                current_app._get_current_object(),
+                session_name,
+                recipients,
+                message,
+                rate=rate,
+                burst=burst
+            )
+            return jsonify({
+                'status': 'success',
+                'data': broadcast.to_dict()
+            }), 201
+        except Exception as e:
+            current_app.logger.error(f"Error creating broadcast: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+
+    @app.route('/api/broadcasts/<broadcast_id>', methods=['GET'])
+    def get_broadcast(broadcast_id):
+        """Live progress of a broadcast"""
+        from app.controllers.broadcast import get_broadcast_manager
+
+        broadcast = get_broadcast_manager().get(broadcast_id)
+        if not broadcast:
+            return jsonify({'status': 'error', 'message': 'Broadcast not found'}), 404
+        return jsonify({'status': 'success', 'data': broadcast.to_dict()})
+
+    @app.route('/api/broadcasts/<broadcast_id>/<action>', methods=['POST'])
+    def control_broadcast(broadcast_id, action):
+        """Pause, resume or cancel a broadcast"""
+        from app.controllers.broadcast import get_broadcast_manager
+
+        manager = get_broadcast_manager()
+        if action == 'pause':
+            broadcast = manager.pause(broadcast_id)
+        elif action == 'resume':
+            broadcast = manager.resume(current_app._get_current_object(), broadcast_id)
+        elif action == 'cancel':
+            broadcast = manager.cancel(broadcast_id)
+        else:
+            return jsonify({'status': 'error', 'message': f'Unknown action: {action}'}), 400
+
+        if not broadcast:
+            return jsonify({'status': 'error', 'message': 'Broadcast not found'}), 404
+        return jsonify({'status': 'success', 'data': broadcast.to_dict()})
+
     @app.route('/api/media/template-config', methods=['GET', 'POST'])
     def handle_template_config():
         if request.method == 'POST':
@@ -480,6 +838,16 @@ def register_routes(app):
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/scheduler/catchup', methods=['GET'])
+    def get_catchup_report():
+        """Missed firings since startup: which were dropped, which replayed, and when the rest will go"""
+        from app.services.catchup import catchup
+
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'report': catchup.report()
+        }), 200
+
     @app.route('/api/scheduler/backup', methods=['POST'])
     def backup_scheduler():
         """Manually trigger a backup of scheduler jobs"""
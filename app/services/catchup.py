@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from app.services.metrics import MISFIRES, job_session
+
+
+class CatchUp:
+    """
+    Decides what happens to firings that were missed, e.g. while the process
+    was down, instead of letting every one of them go out the moment it
+    comes back. A firing counts as missed once it is more than `after`
+    seconds late. Each job type has a policy:
+
+      skip      drop every missed firing
+      coalesce  replay only the latest one (none if an on-time firing follows)
+      replay    replay all of them
+
+    Replays are gathered for a moment, then spread evenly over `window`
+    seconds, never faster than `rate` per second across all jobs, and run
+    one at a time from a single thread. Every decision goes into a report.
+    """
+
+    POLICIES = ('skip', 'coalesce', 'replay')
+    GATHER = 2
+
+    def __init__(self):
+        self.enabled = False
+        self.after = 60
+        self.window = 600
+        self.rate = 2.0
+        self.policies = {'default': 'replay'}
+        self.job_type = lambda job: None
+        self._runner = None
+        self._dispatch = None
+        self._heap = []
+        self._incoming = []
+        self._order = itertools.count()
+        self._tail = 0.0
+        self._lock = threading.Condition()
+        self._thread = None
+        self._logger = logging.getLogger('apscheduler.catchup')
+        self.counts = {'missed': 0, 'dropped': 0, 'replays_planned': 0, 'replayed': 0}
+        self.last_plan = None
+        self.recent = deque(maxlen=1000)
+
+    @staticmethod
+    def parse_policies(spec):
+        """'status=coalesce,default=replay' -> {'status': 'coalesce', 'default': 'replay'}"""
+        policies = {}
+        for item in (spec or '').split(','):
+            job_type, sep, policy = item.partition('=')
+            if not sep:
+                continue
+            policy = policy.strip().lower()
+            if policy not in CatchUp.POLICIES:
+                raise ValueError(f"Unknown catch-up policy '{policy}' for {job_type.strip()}")
+            policies[job_type.strip().lower()] = policy
+        policies.setdefault('default', 'replay')
+        return policies
+
+    def configure(self, runner, dispatch, policies=None, after=None, window=None, rate=None, job_type=None):
+        """
+        `runner(job, jobstore_alias, run_times, logger_name)` runs firings and
+        returns their events, which are handed to `dispatch(event)`.
+        """
+        self._runner = runner
+        self._dispatch = dispatch
+        self.policies = self.parse_policies(policies) if isinstance(policies, str) else (policies or self.policies)
+        self.after = self.after if after is None else after
+        self.window = self.window if window is None else window
+        self.rate = max(rate or self.rate, 0.001)
+        self.job_type = job_type or self.job_type
+        self.enabled = True
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='scheduler-catchup', daemon=True)
+        self._thread.start()
+
+    def policy_for(self, job):
+        return self.policies.get((self.job_type(job) or '').lower(), self.policies['default'])
+
+    def _note(self, job, run_time, action, policy, due=None):
+        self.counts['replays_planned' if action == 'replay' else 'dropped'] += 1
+        MISFIRES.inc(session=job_session(job), action=action)
+        self.recent.append({
+            'job_id': job.id,
+            'run_time': run_time.isoformat(),
+            'action': action,
+            'policy': policy,
+            'replay_at': datetime.fromtimestamp(due).isoformat() if due else None,
+            'decided_at': datetime.now().isoformat()
+        })
+
+    def filter(self, job, jobstore_alias, run_times, logger_name, now=None):
+        """
+        Split `run_times` into those on time, which are returned to run now,
+        and missed ones, which are dropped or queued for replay by policy.
+        """
+        if not self.enabled or not run_times:
+            return run_times
+        now = now or datetime.now(run_times[0].tzinfo)
+        on_time = [run_time for run_time in run_times if (now - run_time).total_seconds() <= self.after]
+        missed = [run_time for run_time in run_times if (now - run_time).total_seconds() > self.after]
+        if not missed:
+            return run_times
+
+        policy = self.policy_for(job)
+        self.counts['missed'] += len(missed)
+        replay = []
+        if policy == 'replay':
+            replay = missed
+        elif policy == 'coalesce' and not on_time:
+            replay = missed[-1:]
+        with self._lock:
+            for run_time in missed:
+                if run_time not in replay:
+                    self._note(job, run_time, 'drop', policy)
+            for run_time in replay:
+                self._incoming.append((job, jobstore_alias, run_time, logger_name, policy))
+            self._lock.notify()
+        return on_time
+
+    def _plan(self):
+        """Lay gathered replays out over the window, behind any still waiting, within the rate cap"""
+        incoming, self._incoming = self._incoming, []
+        incoming.sort(key=lambda item: item[2])
+        spacing = max(self.window / len(incoming), 1.0 / self.rate)
+        due = max(time.time(), self._tail + 1.0 / self.rate)
+        for job, jobstore_alias, run_time, logger_name, policy in incoming:
+            heapq.heappush(self._heap, (due, next(self._order), job, jobstore_alias, run_time, logger_name))
+            self._note(job, run_time, 'replay', policy, due)
+            self._tail = due
+            due += spacing
+        self.last_plan = {
+            'planned_at': datetime.now().isoformat(),
+            'replays': len(incoming),
+            'spacing_seconds': round(spacing, 3),
+            'finishes_at': datetime.fromtimestamp(self._tail).isoformat()
+        }
+        self._logger.warning(
+            f"Catching up {len(incoming)} missed firings, one every {spacing:.2f}s until {self.last_plan['finishes_at']}"
+        )
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._incoming:
+                    # Let the rest of a burst of misfires arrive before laying them out
+                    deadline = time.time() + self.GATHER
+                    while time.time() < deadline:
+                        self._lock.wait(deadline - time.time())
+                    self._plan()
+                timeout = self._heap[0][0] - time.time() if self._heap else None
+                if timeout is None or timeout > 0:
+                    self._lock.wait(timeout)
+                    continue
+                _, _, job, jobstore_alias, run_time, logger_name = heapq.heappop(self._heap)
+            try:
+                for event in self._runner(job, jobstore_alias, [run_time], logger_name):
+                    self._dispatch(event)
+                self.counts['replayed'] += 1
+            except Exception:
+                self._logger.exception(f"Replay of {job.id} at {run_time} failed")
+
+    def report(self):
+        with self._lock:
+            pending = heapq.nsmallest(100, self._heap)
+            return {
+                'enabled': self.enabled,
+                'policies': self.policies,
+                'missed_after_seconds': self.after,
+                'window_seconds': self.window,
+                'rate_per_second': self.rate,
+                'counts': dict(self.counts),
+                'waiting': len(self._heap) + len(self._incoming),
+                'last_plan': self.last_plan,
+                'next_replays': [{
+                    'job_id': job.id,
+                    'run_time': run_time.isoformat(),
+                    'replay_at': datetime.fromtimestamp(due).isoformat()
+                } for due, _, job, _, run_time, _ in pending],
+                'recent': list(self.recent)
+            }
+
+
+catchup = CatchUp()
@@ -0,0 +1,151 @@
+import random
+import threading
+import time
+
+import requests
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling WAHA while a breaker is open"""
+
+    def __init__(self, breaker):
+        self.breaker_name = breaker.name
+        self.retry_after = breaker.retry_after()
+        super().__init__(f"Circuit open for {breaker.name}, retry in {self.retry_after:.1f}s")
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker. Opens after `failure_threshold` consecutive
+    failures, fails fast for `recovery_timeout` seconds, then lets a limited
+    number of probe calls through to decide whether to close again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+        self.probe_started_at = None
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def _maybe_half_open(self, now):
+        if self.state == self.OPEN and now - self.opened_at >= self.recovery_timeout:
+            self.state = self.HALF_OPEN
+            self.half_open_calls = 0
+
+    def allow(self):
+        """Whether a call may go ahead now. Counts as a probe when half-open."""
+        with self._lock:
+            now = time.monotonic()
+            self._maybe_half_open(now)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN:
+                # A probe that never reported back must not wedge the breaker
+                if self.half_open_calls and now - self.probe_started_at >= self.recovery_timeout:
+                    self.half_open_calls = 0
+                if self.half_open_calls < self.half_open_max_calls:
+                    self.half_open_calls += 1
+                    self.probe_started_at = now
+                    return True
+            self.total_rejected += 1
+            return False
+
+    def is_open(self):
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self.state == self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.half_open_calls = 0
+            self.opened_at = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            self.last_error = str(error) if error else self.last_error
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_after(self):
+        """Seconds until the breaker lets a probe through (0 when not open)"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(self.recovery_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def to_dict(self):
+        retry_after = self.retry_after()
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'total_failures': self.total_failures,
+                'total_rejected': self.total_rejected,
+                'retry_after': round(retry_after, 3),
+                'last_error': self.last_error
+            }
+
+
+class BreakerRegistry:
+    """Breakers keyed by WAHA base URL, and by base URL plus session"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self.failure_threshold = 5
+        self.recovery_timeout = 30
+
+    def configure(self, failure_threshold=None, recovery_timeout=None):
+        if failure_threshold is not None:
+            self.failure_threshold = failure_threshold
+        if recovery_timeout is not None:
+            self.recovery_timeout = recovery_timeout
+
+    def get(self, host, session=None):
+        name = f"{host}#{session}" if session else host
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.failure_threshold, self.recovery_timeout)
+                self._breakers[name] = breaker
+            return breaker
+
+    def for_call(self, host, session=None):
+        """The breakers guarding one call: the host breaker, plus the session breaker if known"""
+        breakers = [self.get(host)]
+        if session:
+            breakers.append(self.get(host, session))
+        return breakers
+
+    def to_dict(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [breaker.to_dict() for breaker in breakers]
+
+
+breakers = BreakerRegistry()
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """Full-jitter exponential backoff for the given (0-based) retry attempt"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
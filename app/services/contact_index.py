@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+from app.utils.cursor import decode_cursor, encode_cursor
+
+
+class ContactIndex:
+    """
+    Local SQLite copy of each session's WAHA contact list. Synced page by page
+    in the background; searches, pagination and projection run locally.
+    """
+
+    FIELDS = ('id', 'number', 'name', 'pushname', 'short_name', 'is_business', 'is_my_contact')
+
+    # Far beyond any real contact list; past it WAHA's paging is not to be trusted
+    MAX_SYNC_OFFSET = 500000
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS contacts (
+            session TEXT NOT NULL,
+            id TEXT NOT NULL,
+            number TEXT,
+            name TEXT,
+            name_lc TEXT NOT NULL,
+            pushname TEXT,
+            short_name TEXT,
+            is_business INTEGER,
+            is_my_contact INTEGER,
+            digest TEXT NOT NULL,
+            sync_gen INTEGER NOT NULL,
+            PRIMARY KEY (session, id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS contacts_name ON contacts (session, name_lc, id);
+        CREATE INDEX IF NOT EXISTS contacts_number ON contacts (session, number);
+        CREATE TABLE IF NOT EXISTS contact_sync (
+            session TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0,
+            status TEXT,
+            total INTEGER DEFAULT 0,
+            changed INTEGER DEFAULT 0,
+            last_sync TEXT,
+            duration REAL,
+            error TEXT
+        );
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._syncing = set()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        """One connection per thread so readers never wait on a sync in progress (WAL)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(contact):
+        contact_id = contact.get('id') or ''
+        number = contact.get('number') or contact_id.split('@')[0]
+        name = contact.get('name') or contact.get('pushname') or contact.get('shortName') or ''
+        row = (
+            contact_id,
+            number,
+            contact.get('name'),
+            name.lower(),
+            contact.get('pushname'),
+            contact.get('shortName'),
+            int(bool(contact.get('isBusiness'))),
+            int(bool(contact.get('isMyContact')))
+        )
+        digest = hashlib.sha1(json.dumps(row).encode('utf-8')).hexdigest()
+        return row, digest
+
+    def _begin_sync(self, session):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT INTO contact_sync (session, status) VALUES (?, 'syncing') "
+                "ON CONFLICT(session) DO UPDATE SET status = 'syncing', error = NULL",
+                (session,)
+            )
+            return conn.execute("SELECT generation FROM contact_sync WHERE session = ?", (session,)).fetchone()[0] + 1
+
+    def _apply_page(self, session, contacts, generation):
+        """Upsert one page; unchanged contacts only get their generation bumped. Returns rows changed."""
+        conn = self._connect()
+        changed = 0
+        with self._write_lock, conn:
+            for contact in contacts:
+                row, digest = self._row(contact)
+                if not row[0]:
+                    continue
+                touched = conn.execute(
+                    "UPDATE contacts SET sync_gen = ? WHERE session = ? AND id = ? AND digest = ?",
+                    (generation, session, row[0], digest)
+                ).rowcount
+                if not touched:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO contacts (session, id, number, name, name_lc, pushname, "
+                        "short_name, is_business, is_my_contact, digest, sync_gen) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (session, *row, digest, generation)
+                    )
+                    changed += 1
+        return changed
+
+    def _finish_sync(self, session, generation, total, changed, duration, error=None):
+        conn = self._connect()
+        with self._write_lock, conn:
+            if error is None:
+                # Contacts not seen in this pass were deleted on the phone
+                changed += conn.execute(
+                    "DELETE FROM contacts WHERE session = ? AND sync_gen < ?", (session, generation)
+                ).rowcount
+            conn.execute(
+                "UPDATE contact_sync SET status = ?, generation = ?, total = ?, changed = ?, "
+                "last_sync = ?, duration = ?, error = ? WHERE session = ?",
+                (
+                    'error' if error else 'ready',
+                    generation if error is None else generation - 1,
+                    total,
+                    changed,
+                    datetime.now().isoformat(),
+                    round(duration, 3),
+                    error,
+                    session
+                )
+            )
+
+    def sync(self, session, fetch_page, page_size=1000):
+        """
+        Pull every contact for a session from WAHA through `fetch_page(limit, offset)`
+        and reconcile the index. Only one sync per session runs at a time.
+        """
+        with self._write_lock:
+            if session in self._syncing:
+                return False
+            self._syncing.add(session)
+        started = time.monotonic()
+        total = changed = 0
+        generation = self._begin_sync(session)
+        try:
+            offset = 0
+            seen = set()
+            while True:
+                page = fetch_page(page_size, offset)
+                ids = {contact.get('id') for contact in page} - {None, ''}
+                if page and not ids - seen:
+                    # Nothing new: WAHA ignored limit/offset and sent the same list again
+                    break
+                seen |= ids
+                changed += self._apply_page(session, page, generation)
+                total = len(seen)
+                offset += len(page)
+                # A short page ends the list; an oversized one means WAHA ignored paging
+                if len(page) != page_size:
+                    break
+                if offset >= self.MAX_SYNC_OFFSET:
+                    raise RuntimeError(f"Stopped contact sync at offset {offset}; WAHA kept returning full pages")
+            self._finish_sync(session, generation, total, changed, time.monotonic() - started)
+            return True
+        except Exception as e:
+            self._finish_sync(session, generation, total, changed, time.monotonic() - started, str(e))
+            raise
+        finally:
+            self._syncing.discard(session)
+
+    def known_sessions(self):
+        return [row[0] for row in self._connect().execute("SELECT session FROM contact_sync")]
+
+    def sync_state(self, session):
+        row = self._connect().execute("SELECT * FROM contact_sync WHERE session = ?", (session,)).fetchone()
+        return dict(row) if row else None
+
+    def search(self, session, query=None, mode='prefix', limit=50, cursor=None, fields=None):
+        """
+        Search contacts by name or number, ordered by name.
+        Returns: tuple (list, str) - (contacts, next_cursor or None)
+        """
+        fields = [field for field in (fields or self.FIELDS) if field in self.FIELDS] or list(self.FIELDS)
+        where = ["session = ?"]
+        params = [session]
+
+        if query:
+            query = query.strip().lower()
+            if mode == 'substring':
+                where.append("(instr(name_lc, ?) > 0 OR instr(number, ?) > 0)")
+                params += [query, query]
+            elif query.lstrip('+').isdigit():
+                # Range scan on the (session, number) index
+                query = query.lstrip('+')
+                where.append("number >= ? AND number < ?")
+                params += [query, query + '\uffff']
+            else:
+                # Range scan on the (session, name_lc) index
+                where.append("name_lc >= ? AND name_lc < ?")
+                params += [query, query + '\uffff']
+
+        if cursor:
+            last_name, last_id = decode_cursor(cursor)
+            where.append("(name_lc > ? OR (name_lc = ? AND id > ?))")
+            params += [last_name, last_name, last_id]
+
+        sql = (
+            f"SELECT {', '.join(fields)}, name_lc, id AS _id FROM contacts "
+            f"WHERE {' AND '.join(where)} ORDER BY name_lc, id LIMIT ?"
+        )
+        rows = self._connect().execute(sql, params + [limit + 1]).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1]['name_lc'], rows[-1]['_id']])
+
+        contacts = []
+        for row in rows:
+            contact = {field: row[field] for field in fields}
+            for flag in ('is_business', 'is_my_contact'):
+                if flag in contact:
+                    contact[flag] = bool(contact[flag])
+            contacts.append(contact)
+        return contacts, next_cursor
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_contact_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ContactIndex(os.path.join(current_app.config['DATA_DIR'], 'contacts.sqlite3'))
+        return _index
+
+
+def sync_contacts(app, session=None):
+    """Sync one session's contacts into the index, or every known session when none is given"""
+    from app.services.whatsapp_api import WhatsAppAPI
+
+    with app.app_context():
+        index = get_contact_index()
+        if session:
+            sessions = [session]
+        else:
+            sessions = {app.config['WAHA_DEFAULT_SESSION'], *index.known_sessions()} - {None}
+
+        for session_name in sessions:
+            def fetch_page(limit, offset):
+                response = WhatsAppAPI.get_contacts(session=session_name, limit=limit, offset=offset)
+                response.raise_for_status()
+                return response.json()
+
+            try:
+                if index.sync(session_name, fetch_page, app.config.get('CONTACT_SYNC_PAGE_SIZE', 1000)):
+                    state = index.sync_state(session_name)
+                    current_app.logger.info(
+                        f"Synced {state['total']} contacts for {session_name} "
+                        f"({state['changed']} changed) in {state['duration']}s"
+                    )
+            except Exception as e:
+                current_app.logger.error(f"Error syncing contacts for {session_name}: {str(e)}")
+
+
+def sync_contacts_in_background(app, session):
+    threading.Thread(target=sync_contacts, args=(app, session), daemon=True).start()
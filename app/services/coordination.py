@@ -0,0 +1,402 @@
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from apscheduler.executors.base import run_job
+from apscheduler.executors.pool import ThreadPoolExecutor
+from flask import current_app
+
+from app.services.catchup import catchup
+from app.services.metrics import EXECUTOR_QUEUE_WAIT, FIRE_DELAY, job_session
+
+
+class LockStore:
+    """
+    Leases shared by every node: a lease is held by one owner until it
+    expires or is released. Implementations must make acquire atomic.
+    PocketBase has no compare-and-set, so it cannot back this reliably;
+    use Redis when instances do not share a disk.
+    """
+
+    def acquire(self, name, owner, ttl):
+        """Take the lease, or extend it if `owner` already holds it. Returns True on success."""
+        raise NotImplementedError
+
+    def release(self, name, owner):
+        raise NotImplementedError
+
+    def holder(self, name):
+        """(owner, seconds left) of a live lease, or None"""
+        raise NotImplementedError
+
+    def members(self, prefix):
+        """Owners of every live lease whose name starts with `prefix`"""
+        raise NotImplementedError
+
+    def purge_expired(self):
+        pass
+
+
+class SQLiteLockStore(LockStore):
+    """Leases in a SQLite file: coordinates every process that shares the disk"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS leases_expiry ON leases (expires_at);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, name, owner, ttl):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            # One statement, so the check and the take are atomic across processes
+            taken = conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+                (name, owner, now + ttl, now)
+            ).rowcount
+        return taken == 1
+
+    def release(self, name, owner):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def holder(self, name):
+        row = self._connect().execute(
+            "SELECT owner, expires_at FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+        ).fetchone()
+        return (row[0], round(row[1] - time.time(), 3)) if row else None
+
+    def members(self, prefix):
+        rows = self._connect().execute(
+            "SELECT owner FROM leases WHERE name >= ? AND name < ? AND expires_at > ?",
+            (prefix, prefix + '\uffff', time.time())
+        )
+        return sorted(row[0] for row in rows)
+
+    def purge_expired(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (time.time(),))
+
+
+class RedisLockStore(LockStore):
+    """Leases in Redis (SET NX PX), for instances that do not share a disk"""
+
+    RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+    RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url, prefix='whatsappku:lease:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SCHEDULER_LOCK_STORE=redis needs the 'redis' package installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def acquire(self, name, owner, ttl):
+        key = self.prefix + name
+        ttl_ms = int(ttl * 1000)
+        if self.client.set(key, owner, nx=True, px=ttl_ms):
+            return True
+        return bool(self.client.eval(self.RENEW, 1, key, owner, ttl_ms))
+
+    def release(self, name, owner):
+        self.client.eval(self.RELEASE, 1, self.prefix + name, owner)
+
+    def holder(self, name):
+        key = self.prefix + name
+        owner = self.client.get(key)
+        if owner is None:
+            return None
+        return owner.decode('utf-8'), round(max(self.client.pttl(key), 0) / 1000, 3)
+
+    def members(self, prefix):
+        owners = [self.client.get(key) for key in self.client.scan_iter(match=self.prefix + prefix + '*')]
+        return sorted(owner.decode('utf-8') for owner in owners if owner is not None)
+
+
+class HashRing:
+    """Consistent hash ring: a node joining or leaving only moves about 1/N of the keys"""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.nodes = sorted(nodes)
+        self._ring = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def owner(self, key):
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._points, self._hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+
+class Coordinator:
+    """
+    Makes a group of nodes behave like one scheduler. Each scheduled firing
+    is claimed through a lease so exactly one node sends it; one node at a
+    time is leader and runs cluster-wide housekeeping. Unconfigured, every
+    claim succeeds and this node is always leader.
+    """
+
+    LEADER_LEASE = 'scheduler-leader'
+    NODE_LEASE = 'node:'
+
+    def __init__(self):
+        self.store = None
+        self.node_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.leader_ttl = 15
+        self.firing_ttl = 86400
+        self._leader = False
+        self._leader_since = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.claimed = 0
+        self.skipped = 0
+        # Sharding: sessions are spread over live nodes on a hash ring
+        self.sharding = False
+        self.shard_key = lambda job: None
+        self.on_rebalance = None
+        self._ring = HashRing()
+        self._previous_ring = None
+        self._ring_changed_at = None
+        self.not_owned = 0
+
+    def configure(self, store, node_id=None, leader_ttl=None, firing_ttl=None, sharding=False):
+        self.store = store
+        self.node_id = node_id or self.node_id
+        self.leader_ttl = leader_ttl or self.leader_ttl
+        self.firing_ttl = firing_ttl or self.firing_ttl
+        self.sharding = sharding and store is not None
+
+    def start(self):
+        """Start the leader heartbeat; safe to call more than once"""
+        if self.store is None or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._run, name='scheduler-heartbeat', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.store is not None and self._leader:
+            self.store.release(self.LEADER_LEASE, self.node_id)
+        if self.sharding:
+            # Leave the ring now rather than when the lease runs out
+            self.store.release(self.NODE_LEASE + self.node_id, self.node_id)
+        self._leader = False
+
+    def _heartbeat(self):
+        try:
+            leader = self.store.acquire(self.LEADER_LEASE, self.node_id, self.leader_ttl)
+        except Exception:
+            # Cannot reach the lock store: stop acting as leader until we can
+            leader = False
+        if leader and not self._leader:
+            self._leader_since = time.time()
+        self._leader = leader
+
+        if self.sharding:
+            try:
+                self.store.acquire(self.NODE_LEASE + self.node_id, self.node_id, self.leader_ttl)
+                nodes = self.store.members(self.NODE_LEASE)
+            except Exception:
+                return
+            if nodes != self._ring.nodes:
+                self._previous_ring = self._ring
+                self._ring = HashRing(nodes)
+                self._ring_changed_at = time.time()
+                if self.on_rebalance:
+                    self.on_rebalance()
+
+    def owns(self, session_id, grace=True):
+        """
+        Whether this node's shard includes `session_id`. Right after the ring
+        changes, the previous owner keeps firing too (leases stop doubles)
+        until the new owner has had time to load the session's jobs.
+        """
+        if not self.sharding:
+            return True
+        if self._ring.owner(session_id) in (self.node_id, None):
+            return True
+        in_handoff = self._ring_changed_at and time.time() - self._ring_changed_at < self.leader_ttl * 2
+        return bool(grace and in_handoff and self._previous_ring.owner(session_id) == self.node_id)
+
+    def _run(self):
+        beats = 0
+        # Renew well inside the TTL so a healthy leader never lapses
+        while not self._stop.wait(self.leader_ttl / 3):
+            self._heartbeat()
+            beats += 1
+            if self._leader and beats % 100 == 0:
+                try:
+                    self.store.purge_expired()
+                except Exception:
+                    pass
+
+    def is_leader(self):
+        return self.store is None or self._leader
+
+    def should_fire(self, job, run_time):
+        """Whether this node runs `job` for `run_time`: it must own the job's shard and win the lease"""
+        if self.sharding:
+            key = self.shard_key(job)
+            if key is not None and not self.owns(key):
+                self.not_owned += 1
+                return False
+        return self.claim_firing(job.id, run_time)
+
+    def claim_firing(self, job_id, run_time):
+        """Whether this node should run `job_id` for `run_time`"""
+        if self.store is None:
+            return True
+        claimed = self.store.acquire(f"firing:{job_id}:{run_time.isoformat()}", self.node_id, self.firing_ttl)
+        if claimed:
+            self.claimed += 1
+        else:
+            self.skipped += 1
+        return claimed
+
+    def to_dict(self):
+        leader = self.store.holder(self.LEADER_LEASE) if self.store is not None else None
+        return {
+            'node_id': self.node_id,
+            'store': type(self.store).__name__ if self.store is not None else None,
+            'is_leader': self.is_leader(),
+            'leader': leader[0] if leader else None,
+            'leader_lease_remaining': leader[1] if leader else None,
+            'leader_ttl': self.leader_ttl,
+            'firings_claimed': self.claimed,
+            'firings_skipped': self.skipped,
+            'sharding': self.sharding,
+            'nodes': self._ring.nodes if self.sharding else None,
+            'ring_changed_at': self._ring_changed_at,
+            'firings_not_owned': self.not_owned
+        }
+
+
+coordinator = Coordinator()
+
+_firing = threading.local()
+
+
+def current_firing():
+    """(job_id, scheduled run time) of the firing running on this thread, or None"""
+    return getattr(_firing, 'value', None)
+
+
+def _run_firings(job, jobstore_alias, run_times, logger_name, catch_up=True, submitted_at=None):
+    """
+    run_job, one run time at a time, skipping firings another node has claimed.
+    Missed firings of stored jobs go through the catch-up policy first, unless
+    this is the catch-up replaying them. `submitted_at` (time.monotonic()) is
+    when the firing was handed to the executor, for the queue wait metric.
+    """
+    stored = jobstore_alias == 'default'
+    if stored and submitted_at is not None:
+        EXECUTOR_QUEUE_WAIT.observe(time.monotonic() - submitted_at, session=job_session(job))
+    if catch_up and stored:
+        run_times = catchup.filter(job, jobstore_alias, run_times, logger_name)
+    events = []
+    for run_time in run_times:
+        # Housekeeping jobs live in the memory store and run on every node
+        if jobstore_alias == 'default':
+            try:
+                claimed = coordinator.should_fire(job, run_time)
+            except Exception:
+                # Never risk a double send: without a lease the firing is skipped
+                logging.getLogger(logger_name).exception(f"Could not claim {job.id} at {run_time}, skipping it")
+                claimed = False
+            if not claimed:
+                continue
+        if stored:
+            FIRE_DELAY.observe(max((datetime.now(run_time.tzinfo) - run_time).total_seconds(), 0),
+                               session=job_session(job))
+        _firing.value = (job.id, run_time)
+        try:
+            events += run_job(job, jobstore_alias, [run_time], logger_name)
+        finally:
+            _firing.value = None
+    return events
+
+
+class FiringExecutor(ThreadPoolExecutor):
+    """Thread pool executor that claims each firing before running it"""
+
+    def _do_submit_job(self, job, run_times):
+        def callback(f):
+            exc = f.exception()
+            if exc:
+                self._run_job_error(job.id, exc, getattr(exc, '__traceback__', None))
+            else:
+                self._run_job_success(job.id, f.result())
+
+        f = self._pool.submit(_run_firings, job, job._jobstore_alias, run_times, self._logger.name,
+                              submitted_at=time.monotonic())
+        f.add_done_callback(callback)
+
+
+def create_lock_store(config):
+    """The lock store selected by SCHEDULER_LOCK_STORE, or None to run uncoordinated"""
+    kind = config.get('SCHEDULER_LOCK_STORE', 'sqlite')
+    if kind == 'none':
+        return None
+    if kind == 'redis':
+        if not config.get('SCHEDULER_LOCK_URL'):
+            raise RuntimeError("SCHEDULER_LOCK_STORE=redis needs SCHEDULER_LOCK_URL")
+        return RedisLockStore(config['SCHEDULER_LOCK_URL'])
+    if config.get('SCHEDULER_INSTANCES', 1) > 1:
+        logging.getLogger('apscheduler.coordination').warning(
+            f"SCHEDULER_LOCK_STORE=sqlite with SCHEDULER_INSTANCES={config['SCHEDULER_INSTANCES']}: "
+            f"instances that do not share DATA_DIR can each fire the same job; use redis"
+        )
+    return SQLiteLockStore(config.get('SCHEDULER_LOCK_URL') or os.path.join(config['DATA_DIR'], 'locks.sqlite3'))
+
+
+def init_coordination(app=None):
+    """Configure the coordinator from app config and start its heartbeat"""
+    config = (app or current_app).config
+    if coordinator.store is None:
+        coordinator.configure(
+            create_lock_store(config),
+            node_id=config.get('NODE_ID'),
+            leader_ttl=config.get('SCHEDULER_LEADER_TTL', 15),
+            firing_ttl=config.get('SCHEDULER_FIRING_TTL', 86400),
+            sharding=config.get('SCHEDULER_SHARDING', False)
+        )
+    coordinator.start()
+    return coordinator
@@ -0,0 +1,270 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from app.services.circuit_breaker import CircuitOpenError, backoff_delay, breakers
+
+
+class PoolStats:
+    """Thread-safe counters describing how a transport's connection pool is used"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.pool_waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.request_time_total = 0.0
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.pool_waits += 1
+            self.wait_time_total += seconds
+            self.wait_time_max = max(self.wait_time_max, seconds)
+
+    def begin_request(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end_request(self, seconds, failed=False):
+        with self._lock:
+            self.in_flight -= 1
+            self.request_time_total += seconds
+            if failed:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(self.pool_waits - self.new_connections, 0)
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'new_connections': self.new_connections,
+                'reused_connections': reused,
+                'reuse_ratio': round(reused / self.pool_waits, 4) if self.pool_waits else 0.0,
+                'avg_wait_ms': round(self.wait_time_total / self.pool_waits * 1000, 3) if self.pool_waits else 0.0,
+                'max_wait_ms': round(self.wait_time_max * 1000, 3),
+                'avg_request_ms': round(self.request_time_total / self.requests * 1000, 3) if self.requests else 0.0
+            }
+
+
+def _instrumented_pool(pool_cls, stats):
+    """Build a urllib3 pool class that reports connection creation and checkout wait"""
+
+    class InstrumentedPool(pool_cls):
+        def _new_conn(self):
+            stats.record_new_connection()
+            return super()._new_conn()
+
+        def _get_conn(self, timeout=None):
+            started = time.monotonic()
+            try:
+                return super()._get_conn(timeout=timeout)
+            finally:
+                stats.record_wait(time.monotonic() - started)
+
+    return InstrumentedPool
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools feed a PoolStats instance"""
+
+    def __init__(self, stats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _instrumented_pool(HTTPConnectionPool, self._stats),
+            'https': _instrumented_pool(HTTPSConnectionPool, self._stats)
+        }
+
+
+def retry_delay(attempt, response=None, base=0.5, cap=8.0):
+    """Seconds before retry `attempt`: the response's Retry-After if it gave one, else jittered backoff"""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), cap)
+    return backoff_delay(attempt, base, cap)
+
+
+class WahaTransport:
+    """
+    Shared keep-alive HTTP transport for a single WAHA host.
+    One instance is safe to use from every gunicorn and scheduler thread.
+    """
+
+    RETRYABLE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+    RETRYABLE_STATUS = {502, 503, 504}
+
+    def __init__(self, base_url, pool_size=16, pool_block=True, connect_timeout=5, read_timeout=30,
+                 retry_attempts=3, retry_backoff=0.5, retry_max_backoff=8.0):
+        parts = urlsplit(base_url)
+        self.base_url = base_url.rstrip('/')
+        self.host = f"{parts.scheme}://{parts.netloc}"
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats = PoolStats()
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+
+        self.session = requests.Session()
+        self.session.headers['Connection'] = 'keep-alive'
+        adapter = _PooledAdapter(
+            self.stats,
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=pool_block
+        )
+        self.session.mount(f"{self.host}/", adapter)
+
+    @staticmethod
+    def _session_of(kwargs):
+        """Best-effort WAHA session name of a call, used to pick its breaker"""
+        for key in ('json', 'params', 'headers', 'data'):
+            value = kwargs.get(key)
+            fields = getattr(value, 'fields', value)
+            if isinstance(fields, dict) and fields.get('session'):
+                return fields['session']
+        return None
+
+    def _send(self, method, url, **kwargs):
+        started = time.monotonic()
+        self.stats.begin_request()
+        failed = False
+        try:
+            return self.session.request(method, url, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.stats.end_request(time.monotonic() - started, failed)
+
+    def _retry_delay(self, attempt, response=None):
+        return retry_delay(attempt, response, self.retry_backoff, self.retry_max_backoff)
+
+    def request(self, method, url, bypass_breaker=False, **kwargs):
+        """
+        Send a request through the pool, applying the default timeouts.
+        Calls fail fast with CircuitOpenError while the host or session breaker
+        is open; idempotent calls are retried with jittered exponential backoff.
+        """
+        if not url.startswith(('http://', 'https://')):
+            url = f"{self.base_url}{url}"
+        kwargs.setdefault('timeout', self.timeout)
+
+        guards = breakers.for_call(self.host, self._session_of(kwargs))
+        attempts = self.retry_attempts if method.upper() in self.RETRYABLE_METHODS else 0
+        attempt = 0
+        while True:
+            if not bypass_breaker:
+                for breaker in guards:
+                    if not breaker.allow():
+                        raise CircuitOpenError(breaker)
+
+            try:
+                response = self._send(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                for breaker in guards:
+                    breaker.record_failure(e)
+                if attempt >= attempts:
+                    raise
+                delay = self._retry_delay(attempt)
+            else:
+                if response.status_code < 500:
+                    for breaker in guards:
+                        breaker.record_success()
+                    return response
+
+                # Gateway errors mean WAHA itself is down; other 5xx only blame the session
+                failing = guards if response.status_code in self.RETRYABLE_STATUS else guards[-1:]
+                for breaker in failing:
+                    breaker.record_failure(f"HTTP {response.status_code} from {url}")
+                if response.status_code not in self.RETRYABLE_STATUS or attempt >= attempts:
+                    return response
+                delay = self._retry_delay(attempt, response)
+
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def get_stats(self):
+        stats = self.stats.snapshot()
+        stats.update({
+            'host': self.host,
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1]
+        })
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(base_url=None):
+    """Get the shared transport for a WAHA base URL, creating it on first use"""
+    config = current_app.config
+    base_url = base_url or config['WAHA_API_URL']
+
+    transport = _transports.get(base_url)
+    if transport is not None:
+        return transport
+
+    with _transports_lock:
+        transport = _transports.get(base_url)
+        if transport is None:
+            transport = WahaTransport(
+                base_url,
+                pool_size=config.get('WAHA_POOL_SIZE', 16),
+                pool_block=config.get('WAHA_POOL_BLOCK', True),
+                connect_timeout=config.get('WAHA_CONNECT_TIMEOUT', 5),
+                read_timeout=config.get('WAHA_READ_TIMEOUT', 30),
+                retry_attempts=config.get('WAHA_RETRY_ATTEMPTS', 3),
+                retry_backoff=config.get('WAHA_RETRY_BACKOFF', 0.5),
+                retry_max_backoff=config.get('WAHA_RETRY_MAX_BACKOFF', 8.0)
+            )
+            breakers.configure(
+                failure_threshold=config.get('WAHA_BREAKER_FAILURES', 5),
+                recovery_timeout=config.get('WAHA_BREAKER_RESET', 30)
+            )
+            _transports[base_url] = transport
+        return transport
+
+
+def get_transport_stats():
+    """Pool statistics for every transport created so far"""
+    with _transports_lock:
+        transports = list(_transports.values())
+    return [transport.get_stats() for transport in transports]
@@ -0,0 +1,311 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app.services.pocketbase import get_collection
+
+
+class JobReplicator:
+    """
+    Keeps the PocketBase copy of scheduled jobs in step with the local job store.
+    What was last written for each job is remembered locally, so a sync only
+    writes jobs that were added, changed or removed since.
+    """
+
+    # Fields that change on every run and are not worth a write on their own
+    VOLATILE_FIELDS = ('next_run', 'last_run', 'status')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS job_replica (
+            job_id TEXT PRIMARY KEY,
+            record_id TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            synced_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path, collection, concurrency=8, page_size=500):
+        self.db_path = db_path
+        self.collection = collection
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._dirty = {}
+        self._scanned = False
+        self.stats = {
+            'last_sync': None,
+            'last_full_sync': None,
+            'last_error': None,
+            'duration': None,
+            'lag_seconds': None,
+            'scanned': 0,
+            'created': 0,
+            'updated': 0,
+            'deleted': 0,
+            'failed': 0,
+            'total_written': 0
+        }
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @classmethod
+    def fingerprint(cls, data):
+        stable = {key: value for key, value in data.items() if key not in cls.VOLATILE_FIELDS}
+        return hashlib.sha1(json.dumps(stable, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def mark_dirty(self, job_id):
+        """Note that a job changed; the earliest unsynced change is what sync lag is measured from"""
+        with self._lock:
+            self._dirty.setdefault(job_id, time.time())
+
+    def pending(self):
+        with self._lock:
+            return len(self._dirty)
+
+    def seed(self, entries):
+        """Record jobs that already match PocketBase (e.g. just restored from it) as synced"""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_replica (job_id, record_id, fingerprint, synced_at) VALUES (?, ?, ?, ?)",
+                [(job_id, record_id, self.fingerprint(data), time.time()) for job_id, record_id, data in entries]
+            )
+
+    def is_synced(self, job_id, data):
+        """Whether PocketBase holds exactly `data` for this job, with no change pending"""
+        with self._lock:
+            if job_id in self._dirty:
+                return False
+        row = self._connect().execute("SELECT fingerprint FROM job_replica WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and data and row[0] == self.fingerprint(data))
+
+    def reconcile(self, local_records, remote_records):
+        """
+        What to pull from PocketBase into a local store that other instances
+        also write through PocketBase. Both arguments map job_id to record data;
+        a remote record that could not be read maps to None and is left alone.
+        Returns (remove, replace, load): jobs deleted in PocketBase since this
+        node last saw them there, jobs whose record differs from the local job,
+        and jobs missing here. Jobs with a local change still to replicate win.
+        """
+        state = self._state()
+        with self._lock:
+            dirty = set(self._dirty)
+        remove, replace = [], []
+        for job_id, data in local_records.items():
+            if job_id in dirty:
+                continue
+            if job_id not in remote_records:
+                # Never in PocketBase as far as we know: created here and not replicated yet
+                if job_id in state:
+                    remove.append(job_id)
+                continue
+            remote = remote_records[job_id]
+            if remote is not None and self.fingerprint(remote) != self.fingerprint(data):
+                replace.append(job_id)
+        load = [job_id for job_id, data in remote_records.items()
+                if data is not None and job_id not in local_records and job_id not in dirty]
+        return remove, replace, load
+
+    def delete_remote(self, job_id):
+        """Delete a job's records straight from PocketBase, for a job this node does not hold. Returns how many went."""
+        collection = get_collection(self.collection)
+        quoted = job_id.replace('\\', '\\\\').replace('"', '\\"')
+        records = collection.get_list(1, 50, {'filter': f'job_id = "{quoted}"', 'fields': 'id'}).items
+        for record in records:
+            collection.delete(record.id)
+        return len(records)
+
+    def forget(self, job_ids):
+        """Stop tracking jobs handed to another node, so no sync here deletes their records"""
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM job_replica WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+
+    def _state(self):
+        rows = self._connect().execute("SELECT job_id, record_id, fingerprint FROM job_replica")
+        return {job_id: (record_id, fingerprint) for job_id, record_id, fingerprint in rows}
+
+    def _scan(self):
+        """Every record id in the collection by job_id, in one paginated pass"""
+        collection = get_collection(self.collection)
+        remote = {}
+        page = 1
+        while True:
+            result = collection.get_list(page, self.page_size, {'fields': 'id,job_id', 'sort': 'created'})
+            for record in result.items:
+                remote.setdefault(getattr(record, 'job_id', None), []).append(record.id)
+            if page >= result.total_pages:
+                break
+            page += 1
+        remote.pop(None, None)
+        return remote
+
+    def _plan(self, local_records, state, dirty, full):
+        """Work out the writes needed. Returns a list of (action, job_id, record_id, data, fingerprint)."""
+        ops = []
+        if full:
+            remote = self._scan()
+            self.stats['scanned'] = sum(len(ids) for ids in remote.values())
+            for job_id, record_ids in remote.items():
+                # Duplicates left behind by older backups
+                ops += [('delete', job_id, record_id, None, None) for record_id in record_ids[1:]]
+                # Other nodes' jobs are theirs to remove; only drop ones this node wrote
+                if job_id not in local_records and job_id in state:
+                    ops.append(('delete', job_id, record_ids[0], None, None))
+            for job_id, data in local_records.items():
+                fingerprint = self.fingerprint(data)
+                record_ids = remote.get(job_id)
+                if not record_ids:
+                    ops.append(('create', job_id, None, data, fingerprint))
+                elif state.get(job_id) != (record_ids[0], fingerprint):
+                    ops.append(('update', job_id, record_ids[0], data, fingerprint))
+            return ops
+
+        for job_id in dirty:
+            data = local_records.get(job_id)
+            known = state.get(job_id)
+            if data is None:
+                if known:
+                    ops.append(('delete', job_id, known[0], None, None))
+                continue
+            fingerprint = self.fingerprint(data)
+            if known is None:
+                ops.append(('create', job_id, None, data, fingerprint))
+            elif known[1] != fingerprint:
+                ops.append(('update', job_id, known[0], data, fingerprint))
+        return ops
+
+    def _apply(self, op):
+        """Run one write against PocketBase. Returns (op, record_id, error)."""
+        action, job_id, record_id, data, fingerprint = op
+        collection = get_collection(self.collection)
+        try:
+            if action == 'create':
+                return op, collection.create(data).id, None
+            if action == 'update':
+                try:
+                    return op, collection.update(record_id, data).id, None
+                except Exception as e:
+                    # Deleted on the PocketBase side since we last wrote it
+                    if getattr(e, 'status', None) != 404:
+                        raise
+                    return op, collection.create(data).id, None
+            try:
+                collection.delete(record_id)
+            except Exception as e:
+                if getattr(e, 'status', None) != 404:
+                    raise
+            return op, None, None
+        except Exception as e:
+            return op, record_id, e
+
+    def sync(self, local_records, full=False):
+        """
+        Replicate `local_records` ({job_id: record data}) to PocketBase. An
+        incremental sync only looks at jobs marked dirty; a full one (and the
+        first one in each process) scans the collection and reconciles everything.
+        Returns the stats of this cycle.
+        """
+        with self._sync_lock:
+            started = time.time()
+            full = full or not self._scanned
+            with self._lock:
+                dirty = dict(self._dirty)
+                self._dirty.clear()
+
+            try:
+                ops = self._plan(local_records, self._state(), dirty, full)
+            except Exception as e:
+                with self._lock:
+                    for job_id, marked_at in dirty.items():
+                        self._dirty.setdefault(job_id, marked_at)
+                self.stats['last_error'] = str(e)
+                raise
+            if full:
+                self._scanned = True
+
+            results = []
+            if ops:
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(ops))) as pool:
+                    results = list(pool.map(self._apply, ops))
+
+            counts = {'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}
+            conn = self._connect()
+            with conn:
+                for (action, job_id, _, _, fingerprint), record_id, error in results:
+                    if error is not None:
+                        counts['failed'] += 1
+                        self.stats['last_error'] = f"{action} {job_id}: {error}"
+                        with self._lock:
+                            self._dirty.setdefault(job_id, dirty.get(job_id, started))
+                        continue
+                    counts[f"{action}d"] += 1
+                    if action == 'delete':
+                        conn.execute("DELETE FROM job_replica WHERE job_id = ?", (job_id,))
+                    else:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO job_replica (job_id, record_id, fingerprint, synced_at) "
+                            "VALUES (?, ?, ?, ?)",
+                            (job_id, record_id, fingerprint, time.time())
+                        )
+                if full:
+                    # Forget jobs that exist on neither side any more
+                    gone = [(job_id,) for job_id in self._state() if job_id not in local_records]
+                    conn.executemany("DELETE FROM job_replica WHERE job_id = ?", gone)
+
+            finished = time.time()
+            oldest_change = min(dirty.values()) if dirty else None
+            self.stats.update(counts)
+            self.stats.update({
+                'last_sync': datetime.fromtimestamp(finished).isoformat(),
+                'duration': round(finished - started, 3),
+                'lag_seconds': round(finished - oldest_change, 3) if oldest_change else 0.0,
+                'total_written': self.stats['total_written'] + counts['created'] + counts['updated'] + counts['deleted']
+            })
+            if full:
+                self.stats['last_full_sync'] = self.stats['last_sync']
+            if not counts['failed']:
+                self.stats['last_error'] = None
+            return self.get_stats()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['pending'] = self.pending()
+        return stats
+
+
+_replicator = None
+_replicator_lock = threading.Lock()
+
+
+def get_job_replicator():
+    global _replicator
+    with _replicator_lock:
+        if _replicator is None:
+            config = current_app.config
+            _replicator = JobReplicator(
+                os.path.join(config['DATA_DIR'], 'scheduler.sqlite3'),
+                'whatsappku_scheduled_messages',
+                concurrency=config.get('JOB_REPLICATION_CONCURRENCY', 8),
+                page_size=config.get('JOB_REPLICATION_PAGE_SIZE', 500)
+            )
+        return _replicator
@@ -0,0 +1,195 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+
+class SQLiteJobStore(BaseJobStore):
+    """
+    APScheduler job store backed by a local SQLite file in WAL mode.
+    Jobs are pickled like APScheduler's own SQLAlchemy store, so callables
+    must be module-level functions and arguments must be picklable.
+
+    Jobs assigned to `batch_executor` are kept out of the scheduler's own
+    wakeups: their next run time goes in the dispatch_at column instead,
+    where a batch dispatcher picks them up a minute at a time.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS apscheduler_jobs (
+            id TEXT PRIMARY KEY,
+            next_run_time REAL,
+            job_state BLOB NOT NULL,
+            dispatch_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS apscheduler_jobs_next_run ON apscheduler_jobs (next_run_time);
+    """
+
+    def __init__(self, db_path, pickle_protocol=pickle.HIGHEST_PROTOCOL, batch_executor='batch'):
+        super().__init__()
+        self.db_path = db_path
+        self.pickle_protocol = pickle_protocol
+        self.batch_executor = batch_executor
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _connect(self):
+        """One connection per thread; the scheduler thread and request threads both use the store"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        # Stores created before batch dispatch have no dispatch_at column
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(apscheduler_jobs)")]
+        if 'dispatch_at' not in columns:
+            conn.execute("ALTER TABLE apscheduler_jobs ADD COLUMN dispatch_at REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS apscheduler_jobs_dispatch ON apscheduler_jobs (dispatch_at)")
+
+    def _row(self, job):
+        """(id, next_run_time, dispatch_at, job_state) for writing a job"""
+        timestamp = datetime_to_utc_timestamp(job.next_run_time)
+        state = pickle.dumps(job.__getstate__(), self.pickle_protocol)
+        if job.executor == self.batch_executor:
+            return job.id, None, timestamp, state
+        return job.id, timestamp, None, state
+
+    def lookup_job(self, job_id):
+        row = self._connect().execute(
+            "SELECT job_state FROM apscheduler_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._reconstitute_job(row[0]) if row else None
+
+    def get_due_jobs(self, now):
+        timestamp = datetime_to_utc_timestamp(now)
+        return self._get_jobs("next_run_time <= ?", (timestamp,))
+
+    def get_due_batch(self, now):
+        """Batch-dispatched jobs due at `now`"""
+        timestamp = datetime_to_utc_timestamp(now)
+        return self._get_jobs("dispatch_at <= ?", (timestamp,))
+
+    def get_next_run_time(self):
+        # Batch-dispatched jobs are woken by the dispatcher, not the scheduler
+        row = self._connect().execute(
+            "SELECT MIN(next_run_time) FROM apscheduler_jobs WHERE next_run_time IS NOT NULL"
+        ).fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row and row[0] is not None else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def count_jobs(self):
+        return self._connect().execute("SELECT COUNT(*) FROM apscheduler_jobs").fetchone()[0]
+
+    def add_job(self, job):
+        conn = self._connect()
+        try:
+            with self._write_lock, conn:
+                conn.execute(
+                    "INSERT INTO apscheduler_jobs (id, next_run_time, dispatch_at, job_state) VALUES (?, ?, ?, ?)",
+                    self._row(job)
+                )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def add_jobs(self, jobs):
+        """
+        Insert or replace many jobs in one transaction. Bypasses the scheduler,
+        so callers must call scheduler.wakeup() afterwards.
+        """
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO apscheduler_jobs (id, next_run_time, dispatch_at, job_state) VALUES (?, ?, ?, ?)",
+                [self._row(job) for job in jobs]
+            )
+        for job in jobs:
+            job._jobstore_alias = self._alias
+
+    def update_job(self, job):
+        job_id, next_run_time, dispatch_at, job_state = self._row(job)
+        conn = self._connect()
+        with self._write_lock, conn:
+            updated = conn.execute(
+                "UPDATE apscheduler_jobs SET next_run_time = ?, dispatch_at = ?, job_state = ? WHERE id = ?",
+                (next_run_time, dispatch_at, job_state, job_id)
+            ).rowcount
+        if not updated:
+            raise JobLookupError(job.id)
+
+    def update_jobs(self, jobs):
+        """Write back many existing jobs in one transaction, without events"""
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.executemany(
+                "UPDATE apscheduler_jobs SET next_run_time = ?, dispatch_at = ?, job_state = ? WHERE id = ?",
+                [(next_run_time, dispatch_at, job_state, job_id)
+                 for job_id, next_run_time, dispatch_at, job_state in map(self._row, jobs)]
+            )
+
+    def remove_job(self, job_id):
+        conn = self._connect()
+        with self._write_lock, conn:
+            removed = conn.execute("DELETE FROM apscheduler_jobs WHERE id = ?", (job_id,)).rowcount
+        if not removed:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute("DELETE FROM apscheduler_jobs")
+
+    def shutdown(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _reconstitute_job(self, job_state):
+        job = Job.__new__(Job)
+        job.__setstate__(pickle.loads(job_state))
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, where=None, params=()):
+        sql = "SELECT id, job_state FROM apscheduler_jobs"
+        if where:
+            sql += f" WHERE {where}"
+        # Paused jobs (no next run time) sort last
+        sql += (" ORDER BY COALESCE(next_run_time, dispatch_at) IS NULL,"
+                " COALESCE(next_run_time, dispatch_at)")
+
+        jobs = []
+        failed = []
+        for job_id, job_state in self._connect().execute(sql, params).fetchall():
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except Exception:
+                self._logger.exception(f"Unable to restore job {job_id} -- removing it")
+                failed.append(job_id)
+
+        if failed:
+            conn = self._connect()
+            with self._write_lock, conn:
+                conn.executemany("DELETE FROM apscheduler_jobs WHERE id = ?", [(job_id,) for job_id in failed])
+        return jobs
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (path={self.db_path})>"
+
@@ -0,0 +1,185 @@
+import hashlib
+import hmac
+import mimetypes
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class MediaHandleCache:
+    """
+    Maps local media files, by SHA-256 of their content, to a reusable remote
+    reference that WAHA can fetch itself. Repeat sends of the same bytes then
+    carry a URL instead of the file payload.
+
+    Files outside the static folder are kept in a private cache directory and
+    only served through /media/cache/<name> with a signature that expires
+    after `url_ttl` seconds, so a cached file is not public for good.
+    """
+
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, public_base_url, static_root, cache_dir, secret, max_entries=1024, url_ttl=600):
+        self.public_base_url = public_base_url.rstrip('/')
+        self.static_root = os.path.realpath(static_root)
+        self.cache_dir = cache_dir
+        self.secret = secret.encode('utf-8')
+        self.url_ttl = url_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_hashed = 0
+
+    def digest(self, path):
+        """SHA-256 of a file, memoised on (path, size, mtime) so unchanged files are hashed once"""
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest:
+                self._digests.move_to_end(key)
+                return digest
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as media_file:
+            for chunk in iter(lambda: media_file.read(self.HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        with self._lock:
+            self.bytes_hashed += stat.st_size
+            self._digests[key] = digest
+            while len(self._digests) > self.max_entries * 4:
+                self._digests.popitem(last=False)
+        return digest
+
+    def lookup(self, path):
+        """
+        Return a WAHA file reference ({'url', 'mimetype', 'filename'}) if these
+        bytes were sent before. On a miss None is returned so the caller uploads
+        the file normally, and calls uploaded() once WAHA has accepted it.
+        """
+        digest = self.digest(path)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                if entry['published_path']:
+                    # Each send gets a fresh signature; the one handed out last time may have expired
+                    return dict(entry['handle'], url=self.signed_url(os.path.basename(entry['published_path'])))
+                return entry['handle']
+            self.misses += 1
+        return None
+
+    def uploaded(self, path):
+        """Publish a file WAHA just accepted and remember it, so the next send of these bytes is a URL"""
+        digest = self.digest(path)
+        published_path, url = self._publish(path, digest)
+        handle = {
+            'url': url,
+            'mimetype': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'filename': os.path.basename(path)
+        }
+        self.remember(digest, handle, published_path)
+
+    def remember(self, digest, handle, published_path=None):
+        """Store a handle for a digest, e.g. a media id returned by WAHA"""
+        evicted = []
+        with self._lock:
+            self._entries[digest] = {'handle': handle, 'published_path': published_path}
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+                self.evictions += 1
+
+        for entry in evicted:
+            if entry['published_path']:
+                try:
+                    os.remove(entry['published_path'])
+                except OSError:
+                    pass
+
+    def _publish(self, path, digest):
+        """Expose the file to WAHA: static files by URL, others by a signed cache URL. Returns (copy_path or None, url)."""
+        real_path = os.path.realpath(path)
+        if real_path.startswith(self.static_root + os.sep):
+            relative = os.path.relpath(real_path, self.static_root).replace(os.sep, '/')
+            return None, f"{self.public_base_url}/static/{relative}"
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        ext = os.path.splitext(path)[1].lower()
+        published_path = os.path.join(self.cache_dir, f"{digest}{ext}")
+        if not os.path.exists(published_path):
+            try:
+                os.link(real_path, published_path)
+            except OSError:
+                shutil.copyfile(real_path, published_path)
+
+        return published_path, self.signed_url(os.path.basename(published_path))
+
+    def _signature(self, name, expires):
+        return hmac.new(self.secret, f"{name}:{expires}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def signed_url(self, name):
+        """URL of a cached file that stops working after url_ttl seconds"""
+        expires = int(time.time() + self.url_ttl)
+        return f"{self.public_base_url}/media/cache/{name}?expires={expires}&signature={self._signature(name, expires)}"
+
+    def verify(self, name, expires, signature):
+        """Whether a /media/cache request carries a valid, unexpired signature"""
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time() or not signature:
+            return False
+        return hmac.compare_digest(self._signature(name, expires), signature)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes_hashed': self.bytes_hashed
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_media_cache():
+    """Get the shared media cache, or None when it is disabled or MEDIA_URL is not set"""
+    global _cache
+    config = current_app.config
+    if not config.get('MEDIA_CACHE_ENABLED', True) or not config.get('MEDIA_URL'):
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            static_root = os.path.join(current_app.root_path, 'static')
+            # Copies published by older versions sat in the public static folder
+            shutil.rmtree(os.path.join(static_root, 'media', 'cache'), ignore_errors=True)
+            _cache = MediaHandleCache(
+                config['MEDIA_URL'],
+                static_root,
+                os.path.join(config['DATA_DIR'], 'media-cache'),
+                config['SECRET_KEY'],
+                max_entries=config.get('MEDIA_CACHE_SIZE', 1024),
+                url_ttl=config.get('MEDIA_CACHE_URL_TTL', 600)
+            )
+        return _cache
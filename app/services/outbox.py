@@ -0,0 +1,491 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+from app.services.metrics import OUTBOX_QUEUE_WAIT, registry
+
+
+class RetryLater(Exception):
+    """Raised by a handler to put a message back without spending one of its attempts"""
+
+    def __init__(self, retry_after, reason=None):
+        self.retry_after = retry_after
+        super().__init__(reason or f"Retry in {retry_after:.1f}s")
+
+
+class Outbox:
+    """
+    Durable queue between firing a send and delivering it to WAHA. Senders
+    append a row and return; a pool of workers claims rows under a lease,
+    runs the handler registered for their kind and acknowledges them. A
+    failed delivery goes back with exponential backoff (or the breaker's
+    retry_after) until it runs out of attempts. A row whose worker died
+    mid-send is picked up again once its lease runs out.
+
+    Each WAHA session is its own queue. Workers take turns across sessions
+    with due work, and a session gets at most `session_workers` of them
+    while others are waiting. Past that it may borrow idle workers, but only
+    while its last send was fast and never the last idle one, so a session
+    that just started hanging cannot take the whole pool before its slow
+    sends come back and someone else's work arrives meanwhile. A session
+    whose sends keep taking longer than `slow_after` seconds (a hung WAHA
+    browser holding requests until they time out) is isolated for
+    `isolate_for` seconds: one worker and no borrowing, so it only slows its
+    own messages down. Fast failures are left to the circuit breakers.
+    """
+
+    PENDING = 'pending'
+    INFLIGHT = 'inflight'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    # Inflight rows keep their lease expiry in available_at, so one index
+    # finds both new work and work abandoned by a dead worker
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            session TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            job_id TEXT,
+            fire_time TEXT,
+            last_error TEXT,
+            result TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, available_at);
+        CREATE INDEX IF NOT EXISTS outbox_session_due ON outbox (session, status, available_at);
+    """
+
+    def __init__(self, db_path, app=None, workers=8, max_attempts=5, backoff=5, backoff_max=900,
+                 lease=300, poll_interval=5, session_workers=4, slow_after=10, isolate_after=3, isolate_for=60):
+        self.db_path = db_path
+        self.app = app
+        self.workers = max(int(workers), 1)
+        self.max_attempts = max(int(max_attempts), 1)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.session_workers = max(int(session_workers), 1)
+        self.slow_after = slow_after
+        self.isolate_after = isolate_after
+        self.isolate_for = isolate_for
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._last_served = None
+        self._synced_at = 0.0
+        self._handlers = {}
+        self._failure_handlers = {}
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._logger = logging.getLogger('whatsappku.outbox')
+        self.stats = {
+            'enqueued': 0,
+            'delivered': 0,
+            'retried': 0,
+            'failed': 0,
+            'last_error': None
+        }
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+        self._sync_sessions()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def register(self, kind, handler, on_failed=None):
+        """
+        Deliver messages of `kind` with handler(payload), which returns WAHA's
+        response. on_failed(payload, error) runs once a message is given up on.
+        """
+        self._handlers[kind] = handler
+        if on_failed is not None:
+            self._failure_handlers[kind] = on_failed
+
+    def enqueue(self, kind, payload, session=None, job_id=None, fire_time=None, delay=0):
+        """Append a message for delivery. Returns its outbox id."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO outbox (kind, session, payload, status, available_at, job_id, fire_time, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, session, json.dumps(payload, default=str), self.PENDING, now + delay, job_id,
+             fire_time.isoformat() if isinstance(fire_time, datetime) else fire_time, now, now)
+        )
+        self.stats['enqueued'] += 1
+        self._due(session, now + delay)
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def _session(self, session):
+        state = self._sessions.get(session)
+        if state is None:
+            state = self._sessions[session] = {
+                'inflight': 0,
+                'next_due': None,
+                'strikes': 0,
+                'isolated_until': 0.0,
+                'delivered': 0,
+                'failed': 0,
+                'last_duration': None
+            }
+        return state
+
+    def _due(self, session, available_at):
+        """Note that `session` has a message due at `available_at`"""
+        with self._sessions_lock:
+            state = self._session(session)
+            if state['next_due'] is None or available_at < state['next_due']:
+                state['next_due'] = available_at
+
+    def _sync_sessions(self):
+        """Reload when each session next has work, picking up rows other processes enqueued or claimed"""
+        rows = self._connect().execute(
+            "SELECT session, MIN(available_at) FROM outbox WHERE status IN (?, ?) GROUP BY session",
+            (self.PENDING, self.INFLIGHT)
+        ).fetchall()
+        with self._sessions_lock:
+            for state in self._sessions.values():
+                state['next_due'] = None
+            for session, next_due in rows:
+                self._session(session)['next_due'] = next_due
+            self._synced_at = time.time()
+
+    def _isolated(self, state, now):
+        return state['isolated_until'] > now
+
+    def _proven(self, state, now):
+        """Whether a session's last send came back fast, so it is trusted with borrowed workers"""
+        return (not self._isolated(state, now) and state['strikes'] == 0
+                and state['last_duration'] is not None and state['last_duration'] <= self.slow_after)
+
+    def _claimable(self, now):
+        """
+        Sessions to try, in turn order: due ones under their share first, starting
+        after the last session served, then healthy ones that may borrow idle workers.
+        Borrowing needs a fast last send and always leaves one worker unclaimed.
+        """
+        due = sorted((session for session, state in self._sessions.items()
+                      if state['next_due'] is not None and state['next_due'] <= now),
+                     key=lambda session: session or '')
+        last = self._last_served or ''
+        due = [session for session in due if (session or '') > last] + \
+              [session for session in due if (session or '') <= last]
+        can_borrow = sum(state['inflight'] for state in self._sessions.values()) < self.workers - 1
+        under, borrowing = [], []
+        for session in due:
+            state = self._sessions[session]
+            share = 1 if self._isolated(state, now) else self.session_workers
+            if state['inflight'] < share:
+                under.append(session)
+            elif can_borrow and self._proven(state, now):
+                borrowing.append(session)
+        return under + borrowing
+
+    def _claim(self):
+        """Lease the oldest due message of the next session in turn, or return None if nothing can go now"""
+        now = time.time()
+        if now - self._synced_at >= self.poll_interval:
+            self._sync_sessions()
+        conn = self._connect()
+        with self._sessions_lock:
+            for session in self._claimable(now):
+                row = conn.execute(
+                    "UPDATE outbox SET status = ?, available_at = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE id = (SELECT id FROM outbox WHERE session IS ? AND status IN (?, ?) "
+                    "AND available_at <= ? ORDER BY available_at LIMIT 1) "
+                    "RETURNING id, kind, payload, attempts, created_at",
+                    (self.INFLIGHT, now + self.lease, now, session, self.PENDING, self.INFLIGHT, now)
+                ).fetchone()
+                state = self._sessions[session]
+                state['next_due'] = conn.execute(
+                    "SELECT MIN(available_at) FROM outbox WHERE session IS ? AND status IN (?, ?)",
+                    (session, self.PENDING, self.INFLIGHT)
+                ).fetchone()[0]
+                if row is None:
+                    continue
+                state['inflight'] += 1
+                self._last_served = session or ''
+                message_id, kind, payload, attempts, created_at = row
+                if attempts == 1:
+                    OUTBOX_QUEUE_WAIT.observe(max(now - created_at, 0), session=session or 'none')
+                return message_id, kind, session, payload, attempts
+        return None
+
+    def _wait_time(self):
+        """How long an idle worker can sleep before a session it could serve has work due"""
+        now = time.time()
+        with self._sessions_lock:
+            due = [state['next_due'] for state in self._sessions.values()
+                   if state['next_due'] is not None
+                   and not (self._isolated(state, now) and state['inflight'] >= 1)]
+        if not due:
+            return self.poll_interval
+        return min(max(min(due) - now, 0.05), self.poll_interval)
+
+    def _finished(self, session, duration, error):
+        """
+        Release a session's worker and update its health: sends that held a
+        worker longer than slow_after are strikes, and enough in a row isolate the session
+        """
+        now = time.time()
+        with self._sessions_lock:
+            state = self._session(session)
+            state['inflight'] = max(state['inflight'] - 1, 0)
+            state['last_duration'] = round(duration, 3)
+            if isinstance(error, RetryLater):
+                pass
+            elif duration > self.slow_after:
+                state['strikes'] += 1
+                if state['strikes'] >= self.isolate_after:
+                    if not self._isolated(state, now):
+                        self._logger.warning(
+                            f"Isolating outbox session {session} for {self.isolate_for}s after "
+                            f"{state['strikes']} sends slower than {self.slow_after}s"
+                        )
+                    state['isolated_until'] = now + self.isolate_for
+            else:
+                state['strikes'] = 0
+            if not isinstance(error, RetryLater):
+                state['failed' if error is not None else 'delivered'] += 1
+        # A worker slot opened up for sessions that were at their share
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _ack(self, message_id, result):
+        self._connect().execute(
+            "UPDATE outbox SET status = ?, result = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+            (self.DONE, json.dumps(result, default=str), time.time(), message_id)
+        )
+        self.stats['delivered'] += 1
+
+    @staticmethod
+    def _is_permanent(error):
+        """A 4xx from WAHA (other than timeouts and rate limits) will fail the same way again"""
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+    def _nack(self, message_id, session, attempts, error):
+        """Put a message back for another try, or mark it failed once out of attempts. Returns the new status."""
+        retry_after = getattr(error, 'retry_after', None)
+        if isinstance(error, RetryLater):
+            # Not the message's fault: hand the attempt back
+            attempts -= 1
+        now = time.time()
+        if attempts >= self.max_attempts or self._is_permanent(error):
+            status, available_at = self.FAILED, now
+            self.stats['failed'] += 1
+        else:
+            if retry_after is None:
+                retry_after = min(self.backoff * 2 ** max(attempts - 1, 0), self.backoff_max)
+            status, available_at = self.PENDING, now + max(retry_after, 1)
+            self.stats['retried'] += 1
+            self._due(session, available_at)
+        self.stats['last_error'] = f"{message_id}: {error}"
+        self._connect().execute(
+            "UPDATE outbox SET status = ?, attempts = ?, available_at = ?, last_error = ?, updated_at = ? "
+            "WHERE id = ?",
+            (status, attempts, available_at, str(error), now, message_id)
+        )
+        return status
+
+    def _deliver(self, message_id, kind, session, payload, attempts):
+        handler = self._handlers.get(kind)
+        started = time.monotonic()
+        try:
+            if handler is None:
+                raise LookupError(f"No outbox handler for '{kind}'")
+            if self.app is not None:
+                with self.app.app_context():
+                    result = handler(json.loads(payload))
+            else:
+                result = handler(json.loads(payload))
+        except Exception as e:
+            if not isinstance(e, RetryLater):
+                self._logger.warning(f"Delivery of outbox message {message_id} failed (attempt {attempts}): {e}")
+            self._finished(session, time.monotonic() - started, e)
+            if self._nack(message_id, session, attempts, e) == self.FAILED:
+                self._give_up(message_id, kind, payload, e)
+            return
+        self._finished(session, time.monotonic() - started, None)
+        self._ack(message_id, result)
+
+    def _give_up(self, message_id, kind, payload, error):
+        on_failed = self._failure_handlers.get(kind)
+        if on_failed is None:
+            return
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    on_failed(json.loads(payload), error)
+            else:
+                on_failed(json.loads(payload), error)
+        except Exception as e:
+            self._logger.error(f"Failure handler for outbox message {message_id} raised: {e}")
+
+    def _work(self):
+        while not self._stopping:
+            try:
+                row = self._claim()
+            except sqlite3.OperationalError as e:
+                self._logger.warning(f"Could not claim from outbox: {e}")
+                row = None
+            if row is not None:
+                self._deliver(*row)
+                continue
+            timeout = self._wait_time()
+            with self._wakeup:
+                self._wakeup.wait(timeout)
+
+    def start(self):
+        """Start the delivery workers, once"""
+        if self._threads:
+            return
+        self._stopping = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'outbox-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def compact(self, retention):
+        """Drop delivered messages older than `retention` seconds. Returns how many went."""
+        cursor = self._connect().execute(
+            "DELETE FROM outbox WHERE status = ? AND updated_at < ?", (self.DONE, time.time() - retention)
+        )
+        return cursor.rowcount
+
+    def get(self, message_id):
+        row = self._connect().execute(
+            "SELECT id, kind, session, status, attempts, available_at, job_id, fire_time, last_error, result, "
+            "created_at, updated_at FROM outbox WHERE id = ?", (message_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        (message_id, kind, session, status, attempts, available_at, job_id, fire_time, last_error, result,
+         created_at, updated_at) = row
+        return {
+            'id': message_id,
+            'kind': kind,
+            'session': session,
+            'status': status,
+            'attempts': attempts,
+            'next_attempt': datetime.fromtimestamp(available_at).isoformat() if status == self.PENDING else None,
+            'job_id': job_id,
+            'fire_time': fire_time,
+            'last_error': last_error,
+            'result': json.loads(result) if result else None,
+            'created_at': datetime.fromtimestamp(created_at).isoformat(),
+            'updated_at': datetime.fromtimestamp(updated_at).isoformat()
+        }
+
+    def get_stats(self):
+        conn = self._connect()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        oldest = conn.execute(
+            "SELECT MIN(created_at) FROM outbox WHERE status IN (?, ?)", (self.PENDING, self.INFLIGHT)
+        ).fetchone()[0]
+        stats = dict(self.stats)
+        stats.update({
+            'workers': len(self._threads),
+            'queued': {status: counts.get(status, 0) for status in (self.PENDING, self.INFLIGHT, self.DONE, self.FAILED)},
+            'oldest_pending_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'sessions': self.session_stats()
+        })
+        return stats
+
+    def session_stats(self):
+        now = time.time()
+        with self._sessions_lock:
+            return {session or 'none': {
+                'inflight': state['inflight'],
+                'share': 1 if self._isolated(state, now) else self.session_workers,
+                'isolated': self._isolated(state, now),
+                'isolated_for_seconds': round(max(state['isolated_until'] - now, 0), 1),
+                'strikes': state['strikes'],
+                'delivered': state['delivered'],
+                'failed': state['failed'],
+                'last_duration': state['last_duration'],
+                'next_due_in_seconds': round(state['next_due'] - now, 3) if state['next_due'] is not None else None
+            } for session, state in self._sessions.items()}
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """The outbox, or None when OUTBOX_ENABLED is off and sends go straight to WAHA"""
+    global _outbox
+    with _outbox_lock:
+        config = current_app.config
+        if _outbox is None and config.get('OUTBOX_ENABLED', True):
+            _outbox = Outbox(
+                os.path.join(config['DATA_DIR'], 'outbox.sqlite3'),
+                app=current_app._get_current_object(),
+                workers=config.get('OUTBOX_WORKERS', 8),
+                max_attempts=config.get('OUTBOX_MAX_ATTEMPTS', 5),
+                backoff=config.get('OUTBOX_BACKOFF', 5),
+                backoff_max=config.get('OUTBOX_BACKOFF_MAX', 900),
+                lease=config.get('OUTBOX_LEASE', 300),
+                session_workers=config.get('OUTBOX_SESSION_WORKERS', 4),
+                slow_after=config.get('OUTBOX_SLOW_AFTER', 10),
+                isolate_after=config.get('OUTBOX_ISOLATE_AFTER', 3),
+                isolate_for=config.get('OUTBOX_ISOLATE_FOR', 60)
+            )
+        return _outbox
+
+
+registry.gauge(
+    'whatsappku_outbox_messages',
+    'Messages in the outbox by status',
+    ('status',),
+    collect=lambda: [((status,), count) for status, count in _outbox.get_stats()['queued'].items()] if _outbox else []
+)
+registry.gauge(
+    'whatsappku_outbox_session_isolated',
+    'Whether a session is isolated to one delivery worker after slow sends',
+    ('session',),
+    collect=lambda: [((session,), int(state['isolated'])) for session, state in _outbox.session_stats().items()]
+    if _outbox else []
+)
+
+
+def init_outbox(app, handlers, on_failed=None):
+    """
+    Create the outbox for `app`, register delivery handlers (and optional
+    failure handlers) by kind and start its workers
+    """
+    with app.app_context():
+        outbox = get_outbox()
+    if outbox is not None:
+        for kind, handler in handlers.items():
+            outbox.register(kind, handler, (on_failed or {}).get(kind))
+        outbox.start()
+    return outbox
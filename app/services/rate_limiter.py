@@ -0,0 +1,106 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` operations per second with bursts up to `burst`"""
+
+    def __init__(self, rate, burst=1):
+        self.rate, self.burst = self.validate(rate, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def validate(rate, burst):
+        """(rate, burst) as floats, raising ValueError unless rate > 0 and burst >= 1"""
+        try:
+            rate, burst = float(rate), float(burst)
+        except (TypeError, ValueError):
+            raise ValueError("rate and burst must be numbers")
+        if not rate > 0:
+            raise ValueError("rate must be greater than 0")
+        if not burst >= 1:
+            raise ValueError("burst must be at least 1")
+        return rate, burst
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now, without waiting"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until tokens are available. Returns False if the timeout expires first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def time_until(self, tokens=1):
+        """Seconds until `tokens` could be taken, 0 if they are available now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max((tokens - self._tokens) / self.rate, 0.0)
+
+    def configure(self, rate=None, burst=None):
+        """Change the pace; raises ValueError for a rate <= 0 or a burst < 1 and leaves the bucket as it was"""
+        with self._lock:
+            rate, burst = self.validate(self.rate if rate is None else rate,
+                                        self.burst if burst is None else burst)
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = burst
+            self._tokens = min(self._tokens, self.burst)
+
+    def to_dict(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'available': round(self._tokens, 3)
+            }
+
+
+class TokenBucketRegistry:
+    """One token bucket per key (e.g. per WAHA session), created on first use"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[key] = bucket
+            return bucket
+
+    def to_dict(self):
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {key: bucket.to_dict() for key, bucket in buckets.items()}
@@ -0,0 +1,249 @@
+import bisect
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
+
+import pytz
+from apscheduler.triggers.base import BaseTrigger
+from dateutil.parser import isoparse
+from dateutil.rrule import rruleset, rrulestr
+
+
+def _local_naive(value, tz, default_time=None, value_tz=None):
+    """
+    Parse an RFC 5545 DATE or DATE-TIME into naive wall-clock time in `tz`.
+    UTC ("Z") and TZID values are converted; floating values are taken as local.
+    """
+    if isinstance(value, str):
+        date_only = len(value) == 8
+        value = isoparse(value)
+        if date_only and default_time is not None:
+            value = datetime.combine(value.date(), default_time)
+    if value.tzinfo is None and value_tz is not None:
+        value = value_tz.localize(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(tz).replace(tzinfo=None)
+    return value
+
+
+@lru_cache(maxsize=1024)
+def _ruleset(rule, dtstart, timezone):
+    """Parse a normalized rule into an rruleset over naive wall-clock times in `timezone`"""
+    rules = rruleset()
+    for line in rule.split('\n'):
+        name, sep, value = line.partition(':')
+        if not sep:
+            parts = []
+            for part in line.split(';'):
+                key, _, val = part.partition('=')
+                if key.upper() == 'UNTIL' and val.upper().endswith('Z'):
+                    # dateutil wants UNTIL in the same (naive) terms as DTSTART
+                    val = _local_naive(val, timezone).strftime('%Y%m%dT%H%M%S')
+                parts.append(f"{key.upper()}={val}")
+            rules.rrule(rrulestr(';'.join(parts), dtstart=dtstart))
+            continue
+
+        name, *params = name.upper().split(';')
+        value_tz = None
+        for param in params:
+            key, _, val = param.partition('=')
+            if key == 'TZID':
+                value_tz = pytz.timezone(val)
+        dates = [_local_naive(item, timezone, dtstart.time(), value_tz)
+                 for item in value.split(',') if item.strip()]
+        if name == 'EXDATE':
+            for date in dates:
+                rules.exdate(date)
+        elif name == 'RDATE':
+            for date in dates:
+                rules.rdate(date)
+        elif name == 'RRULE':
+            rules.rrule(rrulestr(value, dtstart=dtstart))
+        else:
+            raise ValueError(f"Unsupported recurrence property: {name}")
+    return rules
+
+
+class RRuleTrigger(BaseTrigger):
+    """
+    Fires on the occurrences of an RFC 5545 recurrence (RRULE, with optional
+    EXDATE/RDATE lines), e.g. ``FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE;COUNT=10``.
+
+    Rules are evaluated on wall-clock time in `timezone`, so occurrences stay
+    at the same local time across DST changes. The next `window` occurrences
+    are cached, so finding the next fire time is a bisect into a list rather
+    than a fresh walk of the rule. Only the rule text is pickled.
+    """
+
+    def __init__(self, rule, dtstart, timezone, window=64):
+        self.timezone = pytz.timezone(timezone) if isinstance(timezone, str) else timezone
+        if dtstart.tzinfo is not None:
+            dtstart = dtstart.astimezone(self.timezone).replace(tzinfo=None)
+        self.dtstart = dtstart.replace(microsecond=0)
+        self.rule = self.normalize(rule)
+        self.window = max(int(window), 1)
+        self._reset()
+        # Fail on bad rules when the job is created, not when it first fires
+        self._build()
+
+    @staticmethod
+    def normalize(rule):
+        """Strip a rule down to its lines, dropping empty ';' parts and a leading 'RRULE:'"""
+        lines = []
+        for line in str(rule).replace('\\n', '\n').splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep or name.upper() == 'RRULE':
+                value = value if sep else name
+                line = ';'.join(part for part in value.split(';') if part.strip())
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def _reset(self):
+        self._rules = None
+        self._iter = None
+        self._cache = []
+        self._cache_from = None
+        self._exhausted = False
+        self._end_date = None
+        self._end_known = False
+        self._lock = threading.Lock()
+
+    def _build(self):
+        """The rruleset for this rule, shared by every trigger with the same rule and start"""
+        if self._rules is None:
+            self._rules = _ruleset(self.rule, self.dtstart, self.timezone)
+        return self._rules
+
+    def _localize(self, value):
+        return self.timezone.normalize(self.timezone.localize(value))
+
+    def _first_from(self, start):
+        """
+        First naive occurrence at or after naive `start`. The cache holds every
+        occurrence from _cache_from up to its last entry; fire times only move
+        forward, so it is refilled by carrying on with the same iterator
+        instead of walking the rule again from DTSTART.
+        """
+        with self._lock:
+            if self._cache_from is None or start < self._cache_from:
+                self._iter = self._build().xafter(start, inc=True)
+                self._cache = []
+                self._cache_from = start
+                self._exhausted = False
+            while not self._exhausted and (not self._cache or self._cache[-1] < start):
+                if self._cache:
+                    self._cache_from = self._cache[-1] + timedelta(microseconds=1)
+                self._cache = list(islice(self._iter, self.window))
+                self._exhausted = len(self._cache) < self.window
+            index = bisect.bisect_left(self._cache, start)
+            return self._cache[index] if index < len(self._cache) else None
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        if previous_fire_time:
+            start = min(now, previous_fire_time + timedelta(microseconds=1))
+            if start == previous_fire_time:
+                start += timedelta(microseconds=1)
+        else:
+            start = now
+        # Occurrences are whole seconds, so round up rather than miss one
+        start = start.astimezone(self.timezone).replace(tzinfo=None)
+        if start.microsecond:
+            start = start.replace(microsecond=0) + timedelta(seconds=1)
+        occurrence = self._first_from(start)
+        return self._localize(occurrence) if occurrence else None
+
+    def between(self, start, end, limit=None):
+        """Aware occurrences in [start, end), at most `limit` of them"""
+        naive_start = start.astimezone(self.timezone).replace(tzinfo=None)
+        naive_end = end.astimezone(self.timezone).replace(tzinfo=None)
+        occurrences = []
+        for occurrence in self._build().xafter(naive_start, inc=True):
+            if occurrence >= naive_end or (limit is not None and len(occurrences) >= limit):
+                break
+            occurrences.append(self._localize(occurrence))
+        return occurrences
+
+    @property
+    def start_date(self):
+        return self._localize(self.dtstart)
+
+    @property
+    def end_date(self):
+        """Last occurrence of a rule bounded by COUNT or UNTIL, None if it repeats forever"""
+        if not self._end_known:
+            rules = self._build()
+            last = None
+            if all(rule._count or rule._until for rule in rules._rrule):
+                for last in rules:
+                    pass
+            self._end_date = self._localize(last) if last else None
+            self._end_known = True
+        return self._end_date
+
+    def __getstate__(self):
+        return {
+            'version': 1,
+            'rule': self.rule,
+            'dtstart': self.dtstart,
+            'timezone': self.timezone,
+            'window': self.window
+        }
+
+    def __setstate__(self, state):
+        if state.get('version', 1) > 1:
+            raise ValueError(
+                f"Got serialized data for version {state['version']} of {self.__class__.__name__}, "
+                f"but only version 1 can be handled")
+        self.rule = state['rule']
+        self.dtstart = state['dtstart']
+        self.timezone = state['timezone']
+        self.window = state['window']
+        self._reset()
+
+    def __str__(self):
+        return f"rrule[{self.rule.replace(chr(10), ' ')}]"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} ({self.rule!r}, dtstart='{self.dtstart}', timezone='{self.timezone}')>"
+
+
+def expand_occurrences(trigger, start, end, limit=None):
+    """
+    Concrete fire times of any APScheduler trigger in [start, end), at most
+    `limit` of them. RRule triggers expand directly; others are stepped through.
+    """
+    if isinstance(trigger, RRuleTrigger):
+        return trigger.between(start, end, limit)
+
+    occurrences = []
+    previous = None
+    now = start
+    while limit is None or len(occurrences) < limit:
+        fire_time = trigger.get_next_fire_time(previous, now)
+        if fire_time is None or fire_time >= end:
+            break
+        if fire_time >= start:
+            occurrences.append(fire_time)
+        previous = now = fire_time
+    return occurrences
+
+
+def first_time_of_day(trigger):
+    """(hour, minute) a daily-style trigger fires at, or (None, None) if it has no fixed time"""
+    if isinstance(trigger, RRuleTrigger):
+        first = next(iter(trigger._build()), None) or trigger.dtstart
+        return first.hour, first.minute
+    fields = getattr(trigger, 'fields', None)
+    if fields:
+        hour = fields[5].expressions[0]
+        minute = fields[6].expressions[0]
+        return getattr(hour, 'first', None), getattr(minute, 'first', None)
+    run_date = getattr(trigger, 'run_date', None)
+    if run_date:
+        return run_date.hour, run_date.minute
+    return None, None
+
@@ -0,0 +1,272 @@
+import bisect
+import heapq
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+from apscheduler.util import datetime_to_utc_timestamp
+
+from app.services.recurrence import expand_occurrences, first_time_of_day
+from app.utils.cursor import decode_cursor, encode_cursor
+
+
+class ScheduleIndex:
+    """
+    In-memory index over the scheduled message jobs, answering "what fires
+    between A and B" without unpickling or stepping through every job.
+
+    Each job is an interval [first fire, last fire] kept sorted by start, in
+    blocks that remember their latest end, so a range query skips jobs that
+    ended before it or start after it. Jobs with the same trigger fire at the
+    same times, so occurrences are expanded once per distinct schedule and
+    cached by window.
+
+    Secondary indexes on session, target, type and status serve the
+    scheduled message list, which is ordered by each schedule's next run.
+    """
+
+    BLOCK = 64
+    FILTERS = ('session_id', 'target', 'type', 'status')
+
+    def __init__(self, cache_size=256):
+        self.cache_size = cache_size
+        self._entries = {}
+        self._groups = {}
+        self._by = {field: {} for field in self.FILTERS}
+        self._loader = None
+        self._built = False
+        self._sorted = None
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _signature(trigger):
+        """Key shared by triggers that fire at exactly the same times"""
+        return f"{trigger.__class__.__name__}:{sorted(trigger.__getstate__().items())!r}"
+
+    @staticmethod
+    def _bounds(trigger):
+        start = getattr(trigger, 'start_date', None) or getattr(trigger, 'run_date', None)
+        end = getattr(trigger, 'end_date', None) or getattr(trigger, 'run_date', None)
+        return (datetime_to_utc_timestamp(start) if start else float('-inf'),
+                datetime_to_utc_timestamp(end) if end else float('inf'))
+
+    def attach(self, loader):
+        """Build from `loader()` (an iterable of jobs) on first use instead of now"""
+        with self._lock:
+            self._loader = loader
+            self._built = False
+
+    @property
+    def built(self):
+        return self._built
+
+    def build_in_background(self):
+        """Load the index off the request path; unpickling every job takes a while with tens of thousands"""
+        threading.Thread(target=self._ensure_built, name='schedule-index', daemon=True).start()
+
+    def _ensure_built(self):
+        if self._built:
+            return
+        with self._lock:
+            if self._built or self._loader is None:
+                return
+            self._entries.clear()
+            self._groups.clear()
+            for values in self._by.values():
+                values.clear()
+            for job in self._loader():
+                self._put(job)
+            self._sorted = None
+            self._built = True
+
+    def _put(self, job):
+        self._drop(job.id)
+        signature = self._signature(job.trigger)
+        start, end = self._bounds(job.trigger)
+        phone, message = job.args if len(job.args) >= 2 else ('none', 'none')
+        hour, minute = first_time_of_day(job.trigger)
+        entry = self._entries[job.id] = {
+            'id': job.id,
+            'session_id': job.kwargs.get('session_id'),
+            'phone': phone,
+            'message': message,
+            'type': job.kwargs.get('type', 'text'),
+            'target': job.kwargs.get('target', 'Chat'),
+            'recurrence': job.kwargs.get('recurrence') or 'none',
+            'hour': hour,
+            'minute': minute,
+            'status': 'paused' if job.next_run_time is None else 'scheduled',
+            'signature': signature,
+            'start': start,
+            'end': end
+        }
+        group = self._groups.get(signature)
+        if group is None:
+            group = self._groups[signature] = {'trigger': job.trigger, 'jobs': set()}
+        group['jobs'].add(job.id)
+        for field in self.FILTERS:
+            self._by[field].setdefault(entry[field], set()).add(job.id)
+
+    def _drop(self, job_id):
+        entry = self._entries.pop(job_id, None)
+        if entry:
+            group = self._groups[entry['signature']]
+            group['jobs'].discard(job_id)
+            if not group['jobs']:
+                del self._groups[entry['signature']]
+            for field in self.FILTERS:
+                ids = self._by[field][entry[field]]
+                ids.discard(job_id)
+                if not ids:
+                    del self._by[field][entry[field]]
+
+    def upsert(self, job):
+        """Add or replace a job once the index is in use; before that the first build reads it"""
+        with self._lock:
+            if self._built:
+                self._put(job)
+                self._sorted = None
+
+    def remove(self, job_id):
+        with self._lock:
+            if self._built:
+                self._drop(job_id)
+                self._sorted = None
+
+    def _intervals(self):
+        """(starts, entries, block max ends), rebuilt after changes"""
+        if self._sorted is None:
+            entries = sorted(self._entries.values(), key=lambda entry: entry['start'])
+            block_ends = [max(entry['end'] for entry in entries[i:i + self.BLOCK])
+                          for i in range(0, len(entries), self.BLOCK)]
+            self._sorted = ([entry['start'] for entry in entries], entries, block_ends)
+        return self._sorted
+
+    def overlapping(self, start, end, session_id=None):
+        """Entries of jobs that may fire in [start, end)"""
+        self._ensure_built()
+        start_ts, end_ts = datetime_to_utc_timestamp(start), datetime_to_utc_timestamp(end)
+        with self._lock:
+            starts, entries, block_ends = self._intervals()
+            last = bisect.bisect_left(starts, end_ts)
+            found = []
+            for block, block_end in enumerate(block_ends):
+                first = block * self.BLOCK
+                if first >= last:
+                    break
+                if block_end < start_ts:
+                    continue
+                for entry in entries[first:min(first + self.BLOCK, last)]:
+                    if entry['end'] >= start_ts and (session_id is None or entry['session_id'] == session_id):
+                        found.append(entry)
+            return found
+
+    def _expand(self, signature, trigger, start, end, limit):
+        """(timestamp, ISO time) of a schedule's occurrences in the window, cached"""
+        key = (signature, start, end, limit)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        occurrences = [(datetime_to_utc_timestamp(fire_time), fire_time.isoformat())
+                       for fire_time in expand_occurrences(trigger, start, end, limit)]
+        with self._lock:
+            self._cache[key] = occurrences
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return occurrences
+
+    def occurrences(self, start, end, session_id=None, limit=None):
+        """
+        Every concrete firing in [start, end) as (ISO fire time, entry), in
+        time order, with at most `limit` of them. Returns (occurrences, truncated).
+        """
+        by_signature = {}
+        for entry in self.overlapping(start, end, session_id):
+            by_signature.setdefault(entry['signature'], []).append(entry)
+
+        # One past the limit, to tell whether anything was cut off
+        per_schedule = limit + 1 if limit is not None else None
+        streams = []
+        for signature, entries in by_signature.items():
+            with self._lock:
+                group = self._groups.get(signature)
+            if group is None:
+                continue
+            entries.sort(key=lambda entry: entry['id'])
+            fire_times = self._expand(signature, group['trigger'], start, end, per_schedule)
+            # Each schedule's stream is already in (time, id) order, so they only need merging
+            streams.append(((timestamp, entry['id'], iso, entry)
+                            for timestamp, iso in fire_times for entry in entries))
+
+        merged = heapq.merge(*streams, key=lambda item: (item[0], item[1]))
+        found = [(iso, entry) for _, _, iso, entry in islice(merged, per_schedule)]
+        truncated = limit is not None and len(found) > limit
+        return (found[:limit] if truncated else found), truncated
+
+    def query(self, filters=None, descending=False, cursor=None, limit=None, now=None):
+        """
+        Entries matching `filters` ({field: value}, fields from FILTERS), ordered
+        by next run time then id, with paused jobs after the rest. The next run
+        is worked out once per distinct schedule, not per job.
+        Returns: tuple (list, str) - ([(next run or None, entry)], next_cursor or None)
+        """
+        self._ensure_built()
+        with self._lock:
+            matches = []
+            for field, value in (filters or {}).items():
+                if value is None:
+                    continue
+                if field not in self.FILTERS:
+                    raise ValueError(f"Cannot filter on {field}")
+                matches.append(self._by[field].get(value, set()))
+            if matches:
+                matches.sort(key=len)
+                ids = matches[0].intersection(*matches[1:])
+            else:
+                ids = list(self._entries)
+
+            next_runs = {}
+            rows = []
+            for job_id in ids:
+                entry = self._entries[job_id]
+                signature = entry['signature']
+                if signature not in next_runs:
+                    next_run = self._groups[signature]['trigger'].get_next_fire_time(None, now)
+                    next_runs[signature] = (next_run, datetime_to_utc_timestamp(next_run) if next_run else None)
+                next_run, timestamp = next_runs[signature]
+                if next_run is None or entry['status'] == 'paused':
+                    rows.append(((1, 0.0, job_id), None, entry))
+                else:
+                    rows.append(((0, timestamp, job_id), next_run, entry))
+
+        if cursor:
+            after = tuple(decode_cursor(cursor))
+            rows = [row for row in rows if (row[0] < after if descending else row[0] > after)]
+
+        if limit is None:
+            rows.sort(key=lambda row: row[0], reverse=descending)
+        else:
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            rows = pick(limit + 1, rows, key=lambda row: row[0])
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(list(rows[-1][0]))
+        return [(next_run, entry) for _, next_run, entry in rows], next_cursor
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'built': self._built,
+                'jobs': len(self._entries),
+                'schedules': len(self._groups),
+                'cached_windows': len(self._cache)
+            }
+
+
+schedule_index = ScheduleIndex()
+
@@ -0,0 +1,222 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+
+class SendLedger:
+    """
+    Record of every scheduled send, keyed by (job_id, scheduled fire time,
+    recipient), so a firing that runs twice (a retry, a restore that re-fires
+    a run, a failover) only reaches each recipient once.
+
+    A send is claimed before the WAHA call and marked sent with WAHA's
+    message id after it. Keys are stored as 16-byte digests in a WITHOUT ROWID
+    table, and entries older than the TTL are compacted away.
+    """
+
+    CLAIMED = 'claimed'      # this caller may send now
+    SENT = 'sent'            # already delivered; skip it
+    BUSY = 'busy'            # another worker is sending it right now
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS send_ledger (
+            key BLOB PRIMARY KEY,
+            sent INTEGER NOT NULL DEFAULT 0,
+            message_id TEXT,
+            claimed_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS send_ledger_claimed ON send_ledger (claimed_at);
+    """
+
+    def __init__(self, db_path, stale_after=300):
+        self.db_path = db_path
+        self.stale_after = stale_after
+        self._local = threading.local()
+        self.stats = {
+            'claimed': 0,
+            'duplicates_skipped': 0,
+            'busy': 0,
+            'compacted': 0
+        }
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(job_id, fire_time, recipient):
+        """Digest of one logical send; fire times compare as instants whatever their timezone"""
+        if isinstance(fire_time, str):
+            fire_time = datetime.fromisoformat(fire_time)
+        if isinstance(fire_time, datetime):
+            fire_time = fire_time.timestamp()
+        return hashlib.blake2b(f"{job_id}|{fire_time}|{recipient}".encode('utf-8'), digest_size=16).digest()
+
+    def claim(self, key):
+        """
+        Atomically take a send before calling WAHA. Returns CLAIMED, SENT or
+        BUSY. A claim left unfinished for stale_after seconds (its worker died
+        mid-send) can be taken over.
+        """
+        now = time.time()
+        conn = self._connect()
+        if conn.execute(
+            "INSERT OR IGNORE INTO send_ledger (key, claimed_at) VALUES (?, ?)", (key, now)
+        ).rowcount:
+            self.stats['claimed'] += 1
+            return self.CLAIMED
+        if conn.execute(
+            "UPDATE send_ledger SET claimed_at = ? WHERE key = ? AND sent = 0 AND claimed_at < ?",
+            (now, key, now - self.stale_after)
+        ).rowcount:
+            self.stats['claimed'] += 1
+            return self.CLAIMED
+        row = conn.execute("SELECT sent FROM send_ledger WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            # Released between our insert and this read; let the caller try again later
+            self.stats['busy'] += 1
+            return self.BUSY
+        if row[0]:
+            self.stats['duplicates_skipped'] += 1
+            return self.SENT
+        self.stats['busy'] += 1
+        return self.BUSY
+
+    def mark_sent(self, key, message_id=None):
+        self._connect().execute(
+            "UPDATE send_ledger SET sent = 1, message_id = ? WHERE key = ?",
+            (str(message_id) if message_id is not None else None, key)
+        )
+
+    def release(self, key):
+        """Give a claim back after a failed send, so a retry can make it"""
+        self._connect().execute("DELETE FROM send_ledger WHERE key = ? AND sent = 0", (key,))
+
+    def lookup(self, key):
+        """(sent, WAHA message id) recorded for a send, or None"""
+        row = self._connect().execute("SELECT sent, message_id FROM send_ledger WHERE key = ?", (key,)).fetchone()
+        return (bool(row[0]), row[1]) if row else None
+
+    def compact(self, ttl):
+        """Forget sends claimed more than `ttl` seconds ago. Returns how many went."""
+        removed = self._connect().execute(
+            "DELETE FROM send_ledger WHERE claimed_at < ?", (time.time() - ttl,)
+        ).rowcount
+        self.stats['compacted'] += removed
+        return removed
+
+    def get_stats(self):
+        entries = self._connect().execute("SELECT COUNT(*) FROM send_ledger").fetchone()[0]
+        stats = dict(self.stats)
+        stats['entries'] = entries
+        return stats
+
+
+class RedisSendLedger(SendLedger):
+    """
+    The same ledger in Redis, for instances that do not share DATA_DIR: a
+    fresh Cloud Run instance restoring jobs, or one taking over after a
+    failover, sees what the others already sent. A claim is a key that
+    expires after stale_after by itself; a sent entry expires after `ttl`.
+    """
+
+    RELEASE = "if redis.call('get', KEYS[1]) == 'claimed' then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url, stale_after=300, ttl=604800, prefix='whatsappku:sent:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("A Redis send ledger needs the 'redis' package installed")
+        self.client = redis.Redis.from_url(url)
+        self.stale_after = stale_after
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = {
+            'claimed': 0,
+            'duplicates_skipped': 0,
+            'busy': 0,
+            'compacted': 0
+        }
+
+    def _name(self, key):
+        return self.prefix + key.hex()
+
+    def claim(self, key):
+        name = self._name(key)
+        if self.client.set(name, 'claimed', nx=True, px=int(self.stale_after * 1000)):
+            self.stats['claimed'] += 1
+            return self.CLAIMED
+        value = self.client.get(name)
+        if value is not None and value.startswith(b'sent:'):
+            self.stats['duplicates_skipped'] += 1
+            return self.SENT
+        # Claimed elsewhere, or released since our SET; let the caller try again later
+        self.stats['busy'] += 1
+        return self.BUSY
+
+    def mark_sent(self, key, message_id=None):
+        self.client.set(self._name(key), f"sent:{message_id if message_id is not None else ''}", ex=int(self.ttl))
+
+    def release(self, key):
+        self.client.eval(self.RELEASE, 1, self._name(key))
+
+    def lookup(self, key):
+        value = self.client.get(self._name(key))
+        if value is None:
+            return None
+        if not value.startswith(b'sent:'):
+            return False, None
+        return True, value[len(b'sent:'):].decode('utf-8') or None
+
+    def compact(self, ttl):
+        """Entries expire in Redis by themselves"""
+        return 0
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['store'] = 'redis'
+        return stats
+
+
+def waha_message_id(response):
+    """The message id in a WAHA send response, which is a string or {'_serialized': ...}"""
+    message_id = response.get('id') if isinstance(response, dict) else None
+    if isinstance(message_id, dict):
+        message_id = message_id.get('_serialized') or message_id.get('id')
+    return message_id
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_send_ledger():
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            config = current_app.config
+            if config.get('SCHEDULER_LOCK_STORE') == 'redis':
+                # Shared like the scheduler's leases, so every instance sees every send
+                _ledger = RedisSendLedger(
+                    config['SCHEDULER_LOCK_URL'],
+                    stale_after=config.get('SEND_LEDGER_STALE_AFTER', 300),
+                    ttl=config.get('SEND_LEDGER_TTL', 604800)
+                )
+            else:
+                _ledger = SendLedger(
+                    os.path.join(config['DATA_DIR'], 'send_ledger.sqlite3'),
+                    stale_after=config.get('SEND_LEDGER_STALE_AFTER', 300)
+                )
+        return _ledger
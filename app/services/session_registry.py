@@ -0,0 +1,124 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+
+class SessionRegistry:
+    """
+    Last known state of every WAHA session, kept in memory. Webhooks update
+    entries as they arrive; WAHA is only asked again once an entry goes stale.
+    """
+
+    ALL = '__all__'
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _etag(data):
+        encoded = json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha1(encoded).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, data):
+        entry = {
+            'data': data,
+            'etag': self._etag(data),
+            'updated_at': time.monotonic(),
+            'timestamp': datetime.now().isoformat()
+        }
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, key=None):
+        """Drop one session (and the list), or everything when key is None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+                self._entries.pop(self.ALL, None)
+
+    def is_stale(self, entry):
+        return time.monotonic() - entry['updated_at'] > self.ttl
+
+    def update_status(self, name, status, payload=None):
+        """
+        Apply a session.status webhook to the cached session and list. A session
+        not cached yet (or missing from the list) is only invalidated, so the
+        next read fetches its full state instead of serving a stub.
+        """
+        entry = self.get(name)
+        listing = self.get(self.ALL)
+        listed = bool(listing) and isinstance(listing['data'], list) and \
+            any(item.get('name') == name for item in listing['data'])
+        if entry is None or not isinstance(entry['data'], dict) or (listing and not listed):
+            self.invalidate(name)
+            return
+
+        session = dict(entry['data'])
+        session.update(payload or {})
+        session['status'] = status
+        self.set(name, session)
+        if listed:
+            self.set(self.ALL, [dict(item, status=status) if item.get('name') == name else item
+                                for item in listing['data']])
+
+    def fetch(self, app, key, loader, background=False):
+        """
+        Load `key` with `loader()` and cache the result. Loader errors come back
+        as (False, {...}) tuples; they are returned as-is and not cached. In the
+        background, at most one refresh per key runs at a time.
+        """
+        if background:
+            with self._lock:
+                if key in self._refreshing:
+                    return None
+                self._refreshing.add(key)
+            threading.Thread(target=self._refresh, args=(app, key, loader), daemon=True).start()
+            return None
+
+        data = loader()
+        if isinstance(data, tuple):
+            return data
+        return self.set(key, data)
+
+    def _refresh(self, app, key, loader):
+        try:
+            with app.app_context():
+                self.fetch(app, key, loader)
+        except Exception as e:
+            with app.app_context():
+                current_app.logger.error(f"Error refreshing session state for {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def lookup(self, key, loader):
+        """
+        Serve `key` from memory. Loads synchronously only on first use;
+        a stale entry is returned as-is while a background refresh runs.
+        Returns the cache entry, or the loader's error tuple if WAHA could not be reached.
+        """
+        app = current_app._get_current_object()
+        self.ttl = app.config.get('SESSION_STATE_TTL', self.ttl)
+        entry = self.get(key)
+        if entry is None:
+            return self.fetch(app, key, loader)
+        if self.is_stale(entry):
+            self.fetch(app, key, loader, background=True)
+        return entry
+
+
+session_registry = SessionRegistry()
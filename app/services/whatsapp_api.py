@@ -3,6 +3,11 @@ import requests
 from flask import current_app, request
 import base64
 import os
+from app.services.circuit_breaker import breakers
+from app.services.http_transport import get_transport
+from app.services.media_cache import get_media_cache
+from app.utils.cursor import decode_cursor, encode_cursor
+from app.utils.multipart import MultipartStream
 
 class WhatsAppAPI:
     """
@@ -14,6 +19,25 @@ class WhatsAppAPI:
     def _get_base_url():
         return current_app.config['WAHA_API_URL']
     
+    @staticmethod
+    def _get_transport():
+        return get_transport(current_app.config['WAHA_API_URL'])
+    
+    @staticmethod
+    def get_breaker(session=None):
+        """Circuit breaker for the WAHA host, or for one session on it"""
+        return breakers.get(WhatsAppAPI._get_transport().host, session)
+
+    @staticmethod
+    def is_available(session=None):
+        """
+        Whether calls for a session would currently be let through.
+        Returns: tuple (bool, float) - (available, seconds until retry)
+        """
+        guards = breakers.for_call(WhatsAppAPI._get_transport().host, session)
+        retry_after = max(breaker.retry_after() for breaker in guards)
+        return retry_after == 0, retry_after
+
     @staticmethod
     def _get_media_url():
         return current_app.config['MEDIA_URL']
@@ -33,86 +57,97 @@ class WhatsAppAPI:
             "reply_to": reply_to,
             "linkPreview": link_preview
         }
-        return requests.post(url, json=payload)
+        return cls._get_transport().post(url, json=payload)
 
     @classmethod
-    def send_image(cls, chat_id, image_path=None, image_url=None, caption=None):
-        """Send an image message"""
-        url = f"{cls._get_base_url()}/api/sendImage"
+    def _get_upload_mode(cls, upload_mode=None):
+        return upload_mode or current_app.config.get('WAHA_UPLOAD_MODE', 'multipart')
+
+    @classmethod
+    def _send_media(cls, endpoint, chat_id, file_path=None, file_url=None, upload_mode=None, **fields):
+        """
+        Send a media message. Local files are streamed as multipart/form-data
+        by default; upload_mode='base64' embeds them in the JSON body instead
+        for WAHA versions that only accept that.
+        """
+        url = f"{cls._get_base_url()}{endpoint}"
         payload = {
             "session": cls._get_session(),
             "chatId": chat_id,
-            "caption": caption
+            **fields
         }
-        
-        if image_path:
-            with open(image_path, 'rb') as image_file:
-                payload["file"] = {
-                    "data": base64.b64encode(image_file.read()).decode('utf-8')
-                }
-        elif image_url:
-            payload["file"] = {"url": image_url}
-            
-        return requests.post(url, json=payload)
+
+        cache = None
+        if file_path and not hasattr(file_path, 'read'):
+            # Bytes WAHA has already fetched once are sent as a URL reference
+            cache = get_media_cache()
+            handle = None
+            if cache:
+                try:
+                    handle = cache.lookup(file_path)
+                except OSError as e:
+                    current_app.logger.warning(f"Media cache unavailable for {file_path}: {str(e)}")
+                    cache = None
+            if handle:
+                payload["file"] = handle
+                return cls._get_transport().post(url, json=payload)
+
+        response = cls._upload_media(url, payload, file_path, file_url, upload_mode, fields)
+        if cache and response.ok:
+            # Only bytes WAHA accepted are published and reused
+            try:
+                cache.uploaded(file_path)
+            except OSError as e:
+                current_app.logger.warning(f"Could not cache media {file_path}: {str(e)}")
+        return response
+
+    @classmethod
+    def _upload_media(cls, url, payload, file_path, file_url, upload_mode, fields):
+        """Send the media itself: a multipart or base64 upload of a local file, or a URL WAHA fetches"""
+        if file_path and cls._get_upload_mode(upload_mode) == 'multipart':
+            # File objects such as BytesIO have no name, and a real file's may be a descriptor
+            name = getattr(file_path, 'name', file_path)
+            filename = fields.get('filename') or \
+                (os.path.basename(name) if isinstance(name, (str, os.PathLike)) else None) or 'file'
+            with MultipartStream(payload, {'file': (filename, file_path, None)}) as body:
+                return cls._get_transport().post(
+                    url,
+                    data=body,
+                    headers={'Content-Type': body.content_type}
+                )
+
+        if file_path:
+            if hasattr(file_path, 'read'):
+                payload["file"] = {"data": base64.b64encode(file_path.read()).decode('utf-8')}
+            else:
+                with open(file_path, 'rb') as media_file:
+                    payload["file"] = {
+                        "data": base64.b64encode(media_file.read()).decode('utf-8')
+                    }
+        elif file_url:
+            payload["file"] = {"url": file_url}
+
+        return cls._get_transport().post(url, json=payload)
 
     @classmethod
-    def send_video(cls, chat_id, video_path=None, video_url=None, caption=None):
+    def send_image(cls, chat_id, image_path=None, image_url=None, caption=None, upload_mode=None):
+        """Send an image message"""
+        return cls._send_media('/api/sendImage', chat_id, image_path, image_url, upload_mode, caption=caption)
+
+    @classmethod
+    def send_video(cls, chat_id, video_path=None, video_url=None, caption=None, upload_mode=None):
         """Send a video message"""
-        url = f"{cls._get_base_url()}/api/sendVideo"
-        payload = {
-            "session": cls._get_session(),
-            "chatId": chat_id,
-            "caption": caption
-        }
-        
-        if video_path:
-            with open(video_path, 'rb') as video_file:
-                payload["file"] = {
-                    "data": base64.b64encode(video_file.read()).decode('utf-8')
-                }
-        elif video_url:
-            payload["file"] = {"url": video_url}
-            
-        return requests.post(url, json=payload)
+        return cls._send_media('/api/sendVideo', chat_id, video_path, video_url, upload_mode, caption=caption)
 
     @classmethod
-    def send_audio(cls, chat_id, audio_path=None, audio_url=None):
+    def send_audio(cls, chat_id, audio_path=None, audio_url=None, upload_mode=None):
         """Send an audio message"""
-        url = f"{cls._get_base_url()}/api/sendAudio"
-        payload = {
-            "session": cls._get_session(),
-            "chatId": chat_id
-        }
-        
-        if audio_path:
-            with open(audio_path, 'rb') as audio_file:
-                payload["file"] = {
-                    "data": base64.b64encode(audio_file.read()).decode('utf-8')
-                }
-        elif audio_url:
-            payload["file"] = {"url": audio_url}
-            
-        return requests.post(url, json=payload)
+        return cls._send_media('/api/sendAudio', chat_id, audio_path, audio_url, upload_mode)
 
     @classmethod
-    def send_document(cls, chat_id, document_path=None, document_url=None, filename=None):
+    def send_document(cls, chat_id, document_path=None, document_url=None, filename=None, upload_mode=None):
         """Send a document"""
-        url = f"{cls._get_base_url()}/api/sendDocument"
-        payload = {
-            "session": cls._get_session(),
-            "chatId": chat_id,
-            "filename": filename
-        }
-        
-        if document_path:
-            with open(document_path, 'rb') as doc_file:
-                payload["file"] = {
-                    "data": base64.b64encode(doc_file.read()).decode('utf-8')
-                }
-        elif document_url:
-            payload["file"] = {"url": document_url}
-            
-        return requests.post(url, json=payload)
+        return cls._send_media('/api/sendDocument', chat_id, document_path, document_url, upload_mode, filename=filename)
 
     @classmethod
     def send_location(cls, chat_id, latitude, longitude, title=None, address=None):
@@ -126,7 +161,7 @@ class WhatsAppAPI:
             "title": title,
             "address": address
         }
-        return requests.post(url, json=payload)
+        return cls._get_transport().post(url, json=payload)
 
     @classmethod
     def send_status(cls, session, image_path, caption=""):
@@ -136,27 +171,18 @@ class WhatsAppAPI:
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"Image file not found: {image_path}")
             
-            # Read the image file in binary mode
-            with open(image_path, 'rb') as image_file:
-                files = {
-                    'file': ('status.png', image_file, 'image/png')
-                }
-            
-            data = {
-                'caption': caption
-            }
-            
             url = f"{current_app.config['WAHA_API_URL']}/api/sendStatus"
-            headers = {
-                'session': session
-            }
             
-            response = requests.post(
-                url,
-                headers=headers,
-                data=data,
-                files=files
-            )
+            # Stream the image from disk instead of loading it into memory
+            with MultipartStream({'caption': caption}, {'file': ('status.png', image_path, 'image/png')}) as body:
+                response = cls._get_transport().post(
+                    url,
+                    headers={
+                        'session': session,
+                        'Content-Type': body.content_type
+                    },
+                    data=body
+                )
             
             response.raise_for_status()
             return response.json()
@@ -166,21 +192,24 @@ class WhatsAppAPI:
             raise
 
     @classmethod
-    def get_contacts(cls, contact_id=None):
-        """Get all contacts or a specific contact"""
+    def get_contacts(cls, contact_id=None, session=None, limit=None, offset=None):
+        """Get all contacts (optionally one page of them) or a specific contact"""
         if contact_id and contact_id != 'all':
             url = f"{cls._get_base_url()}/api/contacts"
             params = {
                 "contactId": contact_id,
-                "session": cls._get_session()
+                "session": session or cls._get_session()
             }
         else:
             url = f"{cls._get_base_url()}/api/contacts/all"
             params = {
-                "session": cls._get_session()
+                "session": session or cls._get_session()
             }
+            if limit is not None:
+                params["limit"] = limit
+                params["offset"] = offset or 0
         
-        return requests.get(url, params=params)
+        return cls._get_transport().get(url, params=params)
 
     @classmethod
     def get_chats(cls):
@@ -189,19 +218,55 @@ class WhatsAppAPI:
         params = {
             "session": cls._get_session()
         }
-        return requests.get(url, params=params)
+        return cls._get_transport().get(url, params=params)
 
     @classmethod
-    def get_messages(cls, chat_id, limit=100):
-        """Get messages from a specific chat"""
-        url = f"{cls._get_base_url()}/api/messages"
+    def get_messages(cls, chat_id, limit=100, offset=0, session=None, before=None):
+        """
+        Get one page of messages from a specific chat, newest first.
+        `before` (unix timestamp) pins the page window so offsets stay stable as new messages arrive.
+        """
+        session = session or cls._get_session()
+        url = f"{cls._get_base_url()}/api/{session}/chats/{chat_id}/messages"
         params = {
-            "session": cls._get_session(),
-            "chatId": chat_id,
-            "limit": limit
+            "limit": limit,
+            "offset": offset,
+            "downloadMedia": "false"
         }
-        return requests.get(url, params=params) 
-    
+        if before is not None:
+            params["filter.timestamp.lte"] = before
+        return cls._get_transport().get(url, params=params)
+
+    @classmethod
+    def iter_messages(cls, chat_id, session=None, page_size=100, cursor=None):
+        """
+        Iterate over a chat's full history one page at a time, newest first.
+        Yields (message, cursor) pairs; passing a yielded cursor back resumes
+        right after that message. The cursor is checked before this returns,
+        so a bad one raises ValueError here rather than mid-stream.
+        """
+        if cursor:
+            position = decode_cursor(cursor)
+            if not isinstance(position, dict) or not all(
+                    type(position.get(field)) is int and position[field] >= 0 for field in ('before', 'offset')):
+                raise ValueError(f"Invalid cursor: {cursor}")
+            before, offset = position['before'], position['offset']
+        else:
+            before, offset = int(datetime.now().timestamp()), 0
+        return cls._iter_message_pages(chat_id, session, page_size, before, offset)
+
+    @classmethod
+    def _iter_message_pages(cls, chat_id, session, page_size, before, offset):
+        while True:
+            response = cls.get_messages(chat_id, limit=page_size, offset=offset, session=session, before=before)
+            response.raise_for_status()
+            page = response.json()
+            for message in page:
+                offset += 1
+                yield message, encode_cursor({'before': before, 'offset': offset})
+            if len(page) < page_size:
+                return
+
     @staticmethod
     def check_sessions_status():
         """
@@ -210,7 +275,7 @@ class WhatsAppAPI:
         """
         try:
             url = f"{current_app.config['WAHA_API_URL']}/api/sessions?all=true"
-            response = requests.get(url, timeout=10)
+            response = WhatsAppAPI._get_transport().get(url, timeout=10)
             
             if response.status_code == 200:
                 session_data = response.json()
@@ -231,7 +296,7 @@ class WhatsAppAPI:
         """
         try:
             url = f"{current_app.config['WAHA_API_URL']}/api/sessions/{session_name}"
-            response = requests.get(url, timeout=10)
+            response = WhatsAppAPI._get_transport().get(url, timeout=10)
             
             if response.status_code == 200:
                 session_data = response.json()
@@ -252,7 +317,7 @@ class WhatsAppAPI:
         """
         try:
             url = f"{current_app.config['WAHA_API_URL']}/api/sessions/session/me"
-            response = requests.get(url, timeout=10)
+            response = WhatsAppAPI._get_transport().get(url, timeout=10)
             
             if response.status_code == 200:
                 session_data = response.json()
@@ -281,7 +346,7 @@ class WhatsAppAPI:
                 "start": data.get('start'),
             }
             
-            response = requests.post(url, json=payload, timeout=30)
+            response = WhatsAppAPI._get_transport().post(url, json=payload, timeout=30)
             
             if response.status_code == 201:
                 return True, response.json()
@@ -299,14 +364,14 @@ class WhatsAppAPI:
         try:
             # First stop the session
             stop_url = f"{current_app.config['WAHA_API_URL']}/api/sessions/{session_name}/stop"
-            stop_response = requests.post(stop_url, timeout=10)
+            stop_response = WhatsAppAPI._get_transport().post(stop_url, timeout=10)
             
             if stop_response.status_code != 200:
                 current_app.logger.warning(f"Failed to stop session before deletion: {stop_response.text}")
             
             # Then delete the session
             delete_url = f"{current_app.config['WAHA_API_URL']}/api/sessions/{session_name}"
-            delete_response = requests.delete(delete_url, timeout=10)
+            delete_response = WhatsAppAPI._get_transport().delete(delete_url, timeout=10)
             
             # Handle empty response
             if delete_response.status_code == 200:
@@ -327,7 +392,7 @@ class WhatsAppAPI:
         """Start the session"""
         try:
             url = f"{current_app.config['WAHA_API_URL']}/api/sessions/{session_name}/start"
-            response = requests.post(url, timeout=10)
+            response = WhatsAppAPI._get_transport().post(url, timeout=10)
             return response.status == "SCAN_QR_CODE", response.json()
         except Exception as e:
             return False, {'error': str(e)}
@@ -337,7 +402,7 @@ class WhatsAppAPI:
         """Stop the session"""
         try:
             url = f"{current_app.config['WAHA_API_URL']}/api/sessions/{session_name}/stop"
-            response = requests.post(url, timeout=10)
+            response = WhatsAppAPI._get_transport().post(url, timeout=10)
             return response.status_code == 200, response.json()
         except Exception as e:
             return False, {'error': str(e)}
@@ -347,7 +412,7 @@ class WhatsAppAPI:
         """Restart the session using WAHA API"""
         try:
             url = f"{current_app.config['WAHA_API_URL']}/api/sessions/{session_name}/restart"
-            response = requests.post(url, timeout=90)
+            response = WhatsAppAPI._get_transport().post(url, timeout=90)
 
             # Handle HTTP errors
             if response.status_code != 200:
@@ -361,14 +426,14 @@ class WhatsAppAPI:
     def get_screenshot(session_name):
         """Get a screenshot of the current session"""
         url = f"{current_app.config['WAHA_API_URL']}/api/screenshot?session={session_name}"
-        response = requests.get(url, timeout=10)
+        response = WhatsAppAPI._get_transport().get(url, timeout=10)
         return response.status_code == 200, response.json()
 
     @staticmethod
     def get_qrcode(session_name):
         """Get a qrcpde of the current session"""
         url = f"{current_app.config['WAHA_API_URL']}/api/{session_name}/auth/qr?format=image"
-        response = requests.get(url, timeout=10)
+        response = WhatsAppAPI._get_transport().get(url, timeout=10)
         return response.status_code == 200, response.json()
     
     @staticmethod
@@ -379,7 +444,8 @@ class WhatsAppAPI:
         """
         try:
             url = f"{current_app.config['WAHA_API_URL']}/health"
-            response = requests.get(url, timeout=10)
+            # Health checks always go through so they can close an open breaker
+            response = WhatsAppAPI._get_transport().get(url, timeout=10, bypass_breaker=True)
             
             if response.status_code == 200:
                 health_data = response.json()
@@ -393,6 +459,7 @@ class WhatsAppAPI:
                 
                 if not all_services_up:
                     current_app.logger.warning(f"WAHA API services not all up: {health_data}")
+                    WhatsAppAPI.get_breaker().record_failure(f"WAHA services not all up: {health_data}")
                 
                 return all_services_up, health_data
             
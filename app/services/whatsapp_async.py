@@ -0,0 +1,310 @@
+import asyncio
+import atexit
+import base64
+import os
+import queue
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from app.services.circuit_breaker import CircuitOpenError, breakers
+from app.services.http_transport import WahaTransport, retry_delay
+
+
+class AsyncWhatsAppAPI:
+    """
+    Asyncio client for the WAHA API, mirroring the sending and listing
+    endpoints of WhatsAppAPI. Use send_many() for bounded fan-out sends.
+    Requests go through the same circuit breakers as WahaTransport and are
+    retried under the same policy.
+    """
+
+    def __init__(self, base_url, default_session=None, concurrency=20, pool_size=32,
+                 connect_timeout=5, read_timeout=30, upload_mode='multipart',
+                 retry_attempts=3, retry_backoff=0.5, retry_max_backoff=8.0):
+        parts = urlsplit(base_url)
+        self.base_url = base_url.rstrip('/')
+        self.host = f"{parts.scheme}://{parts.netloc}"
+        self.upload_mode = upload_mode
+        self.default_session = default_session
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+        # Longest one call should take with every retry, after which a caller stops waiting
+        self.call_timeout = (connect_timeout + read_timeout + retry_max_backoff) * (retry_attempts + 1)
+        self._http = None
+
+    @classmethod
+    def from_app(cls, app):
+        config = app.config
+        return cls(
+            config['WAHA_API_URL'],
+            default_session=config.get('WAHA_DEFAULT_SESSION'),
+            concurrency=config.get('WAHA_ASYNC_CONCURRENCY', 20),
+            pool_size=config.get('WAHA_POOL_SIZE', 16) * 2,
+            connect_timeout=config.get('WAHA_CONNECT_TIMEOUT', 5),
+            read_timeout=config.get('WAHA_READ_TIMEOUT', 30),
+            upload_mode=config.get('WAHA_UPLOAD_MODE', 'multipart'),
+            retry_attempts=config.get('WAHA_RETRY_ATTEMPTS', 3),
+            retry_backoff=config.get('WAHA_RETRY_BACKOFF', 0.5),
+            retry_max_backoff=config.get('WAHA_RETRY_MAX_BACKOFF', 8.0)
+        )
+
+    async def _get_http(self):
+        if self._http is None or self._http.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            self._http = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._http
+
+    async def close(self):
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+
+    async def _request(self, method, path, session=None, **kwargs):
+        """
+        Send a request, failing fast with CircuitOpenError while the host or
+        session breaker is open. Idempotent calls are retried like
+        WahaTransport.request retries them.
+        """
+        http = await self._get_http()
+        guards = breakers.for_call(self.host, session or WahaTransport._session_of(kwargs))
+        attempts = self.retry_attempts if method.upper() in WahaTransport.RETRYABLE_METHODS else 0
+        attempt = 0
+        while True:
+            for breaker in guards:
+                if not breaker.allow():
+                    raise CircuitOpenError(breaker)
+
+            try:
+                async with http.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                    if response.status < 500:
+                        for breaker in guards:
+                            breaker.record_success()
+                        response.raise_for_status()
+                        if response.content_type == 'application/json':
+                            return await response.json()
+                        return {'status': response.status, 'text': await response.text()}
+
+                    # Gateway errors mean WAHA itself is down; other 5xx only blame the session
+                    failing = guards if response.status in WahaTransport.RETRYABLE_STATUS else guards[-1:]
+                    for breaker in failing:
+                        breaker.record_failure(f"HTTP {response.status} from {path}")
+                    if response.status not in WahaTransport.RETRYABLE_STATUS or attempt >= attempts:
+                        response.raise_for_status()
+                    delay = retry_delay(attempt, response, self.retry_backoff, self.retry_max_backoff)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                for breaker in guards:
+                    breaker.record_failure(e)
+                if attempt >= attempts:
+                    raise
+                delay = retry_delay(attempt, None, self.retry_backoff, self.retry_max_backoff)
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _file_payload(path=None, url=None):
+        if path:
+            with open(path, 'rb') as media_file:
+                return {"data": base64.b64encode(media_file.read()).decode('utf-8')}
+        if url:
+            return {"url": url}
+        return None
+
+    async def send_text(self, session, chat_id, text, reply_to=None, link_preview=True):
+        """Send a text message to a specific chat"""
+        payload = {
+            "session": session or self.default_session,
+            "chatId": f"{chat_id}@c.us",
+            "text": text,
+            "reply_to": reply_to,
+            "linkPreview": link_preview
+        }
+        return await self._request('POST', '/api/sendText', json=payload)
+
+    async def _send_media(self, endpoint, chat_id, path, url, session, upload_mode=None, **fields):
+        payload = {"session": session or self.default_session, "chatId": chat_id, **fields}
+        if path and (upload_mode or self.upload_mode) == 'multipart':
+            # aiohttp streams file objects in chunks, so the file never sits in memory
+            with open(path, 'rb') as media_file:
+                form = aiohttp.FormData()
+                for name, value in payload.items():
+                    if value is not None:
+                        form.add_field(name, str(value))
+                form.add_field('file', media_file, filename=fields.get('filename') or os.path.basename(path))
+                return await self._request('POST', endpoint, session=payload['session'], data=form)
+
+        file_payload = await asyncio.to_thread(self._file_payload, path, url)
+        if file_payload:
+            payload["file"] = file_payload
+        return await self._request('POST', endpoint, json=payload)
+
+    async def send_image(self, chat_id, image_path=None, image_url=None, caption=None, session=None, upload_mode=None):
+        """Send an image message"""
+        return await self._send_media('/api/sendImage', chat_id, image_path, image_url, session, upload_mode, caption=caption)
+
+    async def send_video(self, chat_id, video_path=None, video_url=None, caption=None, session=None, upload_mode=None):
+        """Send a video message"""
+        return await self._send_media('/api/sendVideo', chat_id, video_path, video_url, session, upload_mode, caption=caption)
+
+    async def send_document(self, chat_id, document_path=None, document_url=None, filename=None, session=None, upload_mode=None):
+        """Send a document"""
+        return await self._send_media('/api/sendDocument', chat_id, document_path, document_url, session, upload_mode, filename=filename)
+
+    async def send_status(self, session, image_path, caption=""):
+        """Send an image to WhatsApp status"""
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(f"Image file not found: {image_path}")
+
+        with open(image_path, 'rb') as image_file:
+            form = aiohttp.FormData()
+            form.add_field('caption', caption)
+            form.add_field('file', image_file, filename='status.png', content_type='image/png')
+            return await self._request('POST', '/api/sendStatus', session=session, data=form, headers={'session': session})
+
+    async def get_contacts(self, contact_id=None, session=None):
+        """Get all contacts or a specific contact"""
+        params = {"session": session or self.default_session}
+        if contact_id and contact_id != 'all':
+            params["contactId"] = contact_id
+            return await self._request('GET', '/api/contacts', params=params)
+        return await self._request('GET', '/api/contacts/all', params=params)
+
+    async def get_chats(self, session=None):
+        """Get all chats"""
+        return await self._request('GET', '/api/chats', params={"session": session or self.default_session})
+
+    async def send_many(self, recipients, method='send_text', concurrency=None, **kwargs):
+        """
+        Send the same message to many recipients with at most `concurrency`
+        requests in flight. Yields one result dict per recipient as each completes.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        send = getattr(self, method)
+
+        async def send_one(recipient):
+            async with semaphore:
+                try:
+                    response = await send(chat_id=recipient, **kwargs)
+                    return {'recipient': recipient, 'success': True, 'response': response}
+                except Exception as e:
+                    return {'recipient': recipient, 'success': False, 'error': str(e)}
+
+        tasks = [asyncio.ensure_future(send_one(recipient)) for recipient in recipients]
+        try:
+            for completed in asyncio.as_completed(tasks):
+                yield await completed
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class SyncWhatsAppClient:
+    """
+    Blocking facade over AsyncWhatsAppAPI for threaded callers such as
+    APScheduler jobs. Coroutines run on one background event loop.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='whatsapp-async', daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not asyncio.iscoroutinefunction(method):
+            return method
+
+        def call(*args, **kwargs):
+            return self.run(method(*args, **kwargs))
+        return call
+
+    def send_many(self, recipients, method='send_text', concurrency=None, timeout=None, **kwargs):
+        """
+        Blocking generator yielding per-recipient results as they complete.
+        Raises TimeoutError if no result arrives for `timeout` seconds
+        (default: the client's call_timeout), cancelling the remaining sends.
+        """
+        timeout = timeout or self.client.call_timeout
+        results = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for result in self.client.send_many(recipients, method, concurrency, **kwargs):
+                    results.put(result)
+            finally:
+                results.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._loop)
+        finished = False
+        try:
+            while True:
+                try:
+                    result = results.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No response from WAHA for {timeout:.0f}s, abandoning the remaining sends")
+                if result is done:
+                    finished = True
+                    break
+                yield result
+        finally:
+            if not finished:
+                future.cancel()
+        future.result()
+
+    def close(self, timeout=5):
+        """Close the aiohttp session and stop the event loop; safe to call twice"""
+        if not self._thread.is_alive():
+            return
+        try:
+            self.run(self.client.close(), timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._loop.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_async_client(app):
+    """Get the shared blocking facade for the app's WAHA base URL"""
+    base_url = app.config['WAHA_API_URL']
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = SyncWhatsAppClient(AsyncWhatsAppAPI.from_app(app))
+            _clients[base_url] = client
+        return client
+
+
+def close_async_clients():
+    """Close every shared client, so exiting does not leave an unclosed aiohttp session behind"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_async_clients)
@@ -799,16 +799,50 @@ class SessionManager extends HTMLElement {
       const result = await response.json();
       console.log("result", result);
 
-      if (result.success) {
+      if (!result.success) {
+        showNotification("Failed to send test message", "error");
+        return;
+      }
+
+      // 202: queued in the outbox; only report success once WAHA has it
+      const delivery =
+        response.status === 202
+          ? await this.waitForDelivery(result.id)
+          : { status: "done" };
+      if (delivery.status === "done") {
         showNotification("Test message sent successfully", "success");
+      } else if (delivery.status === "failed") {
+        showNotification(
+          `Failed to send test message: ${delivery.last_error || "unknown error"}`,
+          "error"
+        );
       } else {
-        showNotification("Failed to send test message", "error");
+        showNotification(
+          "Test message not delivered yet, it will be retried",
+          "error"
+        );
       }
     } catch (error) {
       showNotification("Error sending test message", "error");
     }
   }
 
+  async waitForDelivery(messageId, timeoutMs = 30000) {
+    const deadline = Date.now() + timeoutMs;
+    let message = { status: "pending" };
+    while (Date.now() < deadline) {
+      const response = await fetch(`/api/outbox/${messageId}`);
+      if (response.ok) {
+        message = (await response.json()).data;
+        if (message.status === "done" || message.status === "failed") {
+          return message;
+        }
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+    return message;
+  }
+
   handleGrid(sessionName) {
     const sessionDetails = this.sessions.find((s) => s.name === sessionName);
 
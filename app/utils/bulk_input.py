@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+
+# Body types read row by row instead of being parsed whole
+CSV_TYPES = ('text/csv', 'application/csv')
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines')
+
+
+class PayloadTooLarge(ValueError):
+    """A bulk request over the row limit, as opposed to one that is malformed"""
+
+
+def is_streamed(content_type):
+    """Whether a request body of this type is read as a stream of rows"""
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    return mimetype in CSV_TYPES or mimetype in NDJSON_TYPES
+
+
+def iter_rows(stream, content_type):
+    """
+    Yield (row, error) for each record of a CSV (with a header line) or
+    NDJSON body, reading `stream` one line at a time. Blank lines are skipped;
+    a line that cannot be parsed yields (None, message) and reading carries on.
+    Raises ValueError if the body is not UTF-8 or not readable as CSV at all.
+    """
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        yield from (_iter_csv(text) if mimetype in CSV_TYPES else _iter_ndjson(text))
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Body is not valid UTF-8: {str(e)}") from e
+    except csv.Error as e:
+        raise ValueError(f"Malformed CSV: {str(e)}") from e
+
+
+def _iter_csv(text):
+    for row in csv.DictReader(text):
+        # Empty cells count as missing, like absent JSON keys
+        yield {key.strip(): value for key, value in row.items() if key and value not in (None, '')}, None
+
+
+def _iter_ndjson(text):
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield None, f"Invalid JSON: {str(e)}"
+            continue
+        if isinstance(row, dict):
+            yield row, None
+        else:
+            yield None, "Each line must be a JSON object"
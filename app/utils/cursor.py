@@ -0,0 +1,15 @@
+import base64
+import json
+
+
+def encode_cursor(value):
+    """Encode a JSON-serialisable position as an opaque, URL-safe pagination cursor"""
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor. Raises ValueError if it is malformed."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
@@ -0,0 +1,106 @@
+import mimetypes
+import os
+import uuid
+
+
+class MultipartStream:
+    """
+    File-like multipart/form-data body. File parts are read from disk in
+    chunks while the request is sent, so the upload never sits in memory.
+    Pass it as `data=` to requests together with `headers={'Content-Type': stream.content_type}`.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fields=None, files=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.fields = dict(fields or {})
+        self._parts = []
+        self._opened = []
+
+        for name, value in (fields or {}).items():
+            if value is None:
+                continue
+            self._parts.append(self._header(name) + str(value).encode('utf-8') + b'\r\n')
+
+        for name, (filename, source, content_type) in (files or {}).items():
+            handle = self._open(source)
+            content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            self._parts.append(self._header(name, filename, content_type))
+            self._parts.append([handle, self._remaining(handle)])
+            self._parts.append(b'\r\n')
+
+        self._parts.append(f"--{self.boundary}--\r\n".encode('utf-8'))
+        self.len = sum(part[1] if isinstance(part, list) else len(part) for part in self._parts)
+        self._index = 0
+        self._buffer = b''
+
+    def _header(self, name, filename=None, content_type=None):
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        header = f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+        if content_type:
+            header += f"Content-Type: {content_type}\r\n"
+        return (header + "\r\n").encode('utf-8')
+
+    def _open(self, source):
+        if hasattr(source, 'read'):
+            return source
+        handle = open(source, 'rb')
+        self._opened.append(handle)
+        return handle
+
+    @staticmethod
+    def _remaining(handle):
+        try:
+            return os.fstat(handle.fileno()).st_size - handle.tell()
+        except (AttributeError, OSError, ValueError):
+            position = handle.tell()
+            handle.seek(0, os.SEEK_END)
+            size = handle.tell() - position
+            handle.seek(position)
+            return size
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        while len(self._buffer) < size and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, list):
+                handle, remaining = part
+                chunk = handle.read(min(self.CHUNK_SIZE, size - len(self._buffer), remaining)) if remaining else b''
+                if chunk:
+                    part[1] -= len(chunk)
+                    self._buffer += chunk
+                    continue
+                if remaining:
+                    raise IOError("File ended before its declared size was sent")
+            else:
+                self._buffer += part
+            self._index += 1
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        for handle in self._opened:
+            handle.close()
+        self._opened = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
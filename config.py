@@ -15,7 +15,31 @@ class Config:
     # WhatsApp API Configuration
     WAHA_API_URL = os.getenv('WAHA_API_URL')
     WAHA_DEFAULT_SESSION = os.getenv('WAHA_DEFAULT_SESSION')
-    
+
+    # WAHA HTTP transport (shared keep-alive connection pool)
+    WAHA_POOL_SIZE = int(os.getenv('WAHA_POOL_SIZE', '16'))
+    WAHA_POOL_BLOCK = os.getenv('WAHA_POOL_BLOCK', 'True').lower() == 'true'
+    WAHA_CONNECT_TIMEOUT = float(os.getenv('WAHA_CONNECT_TIMEOUT', '5'))
+    WAHA_READ_TIMEOUT = float(os.getenv('WAHA_READ_TIMEOUT', '30'))
+    WAHA_RETRY_ATTEMPTS = int(os.getenv('WAHA_RETRY_ATTEMPTS', '3'))
+    WAHA_RETRY_BACKOFF = float(os.getenv('WAHA_RETRY_BACKOFF', '0.5'))
+    WAHA_RETRY_MAX_BACKOFF = float(os.getenv('WAHA_RETRY_MAX_BACKOFF', '8'))
+    WAHA_BREAKER_FAILURES = int(os.getenv('WAHA_BREAKER_FAILURES', '5'))
+    WAHA_BREAKER_RESET = float(os.getenv('WAHA_BREAKER_RESET', '30'))
+    WAHA_HEALTH_INTERVAL = int(os.getenv('WAHA_HEALTH_INTERVAL', '30'))
+    # Seconds before cached session state is refreshed from WAHA in the background
+    SESSION_STATE_TTL = int(os.getenv('SESSION_STATE_TTL', '60'))
+    WAHA_ASYNC_CONCURRENCY = int(os.getenv('WAHA_ASYNC_CONCURRENCY', '20'))
+    # 'multipart' streams media files from disk, 'base64' embeds them in JSON
+    WAHA_UPLOAD_MODE = os.getenv('WAHA_UPLOAD_MODE', 'multipart')
+
+    # Broadcast pacing (per WAHA session token bucket)
+    BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '1'))
+    BROADCAST_BURST = int(os.getenv('BROADCAST_BURST', '5'))
+    # Seconds a finished or cancelled broadcast stays visible under /api/broadcasts
+    BROADCAST_RETENTION = int(os.getenv('BROADCAST_RETENTION', '86400'))
+
     # Google Cloud Configuration
     PROJECT_ID = os.getenv('PROJECT_ID')
     REGION = os.getenv('REGION')
@@ -32,6 +56,86 @@ class Config:
     # Chrome driver path for Selenium
     CHROME_DRIVER_PATH = os.environ.get('CHROME_DRIVER_PATH', '/usr/local/bin/chromedriver')
     
+    # Local state (SQLite databases) kept next to the app
+    DATA_DIR = os.getenv('DATA_DIR', os.path.join(basedir, 'data'))
+
+    # Contact index sync with WAHA
+    CONTACT_SYNC_INTERVAL = int(os.getenv('CONTACT_SYNC_INTERVAL', '900'))
+    CONTACT_SYNC_PAGE_SIZE = int(os.getenv('CONTACT_SYNC_PAGE_SIZE', '1000'))
+
+    # Scheduler jobs live in DATA_DIR; PocketBase gets a copy this many seconds after a change
+    JOB_REPLICATION_DELAY = int(os.getenv('JOB_REPLICATION_DELAY', '30'))
+    JOB_REPLICATION_CONCURRENCY = int(os.getenv('JOB_REPLICATION_CONCURRENCY', '8'))
+    JOB_REPLICATION_PAGE_SIZE = int(os.getenv('JOB_REPLICATION_PAGE_SIZE', '500'))
+
+    # Restore from PocketBase when the local job store starts empty
+    RESTORE_PAGE_SIZE = int(os.getenv('RESTORE_PAGE_SIZE', '200'))
+    RESTORE_CONCURRENCY = int(os.getenv('RESTORE_CONCURRENCY', '4'))
+
+    # Coordination between instances: 'sqlite' (processes sharing DATA_DIR),
+    # 'redis' (SCHEDULER_LOCK_URL=redis://..., needed across Cloud Run instances) or 'none'.
+    # Unset, it is 'redis' when SCHEDULER_LOCK_URL is a redis:// URL and 'sqlite' otherwise
+    SCHEDULER_LOCK_URL = os.getenv('SCHEDULER_LOCK_URL') or None
+    SCHEDULER_LOCK_STORE = os.getenv('SCHEDULER_LOCK_STORE') or (
+        'redis' if (SCHEDULER_LOCK_URL or '').startswith(('redis://', 'rediss://')) else 'sqlite')
+    # How many instances may run at once (Cloud Run --max-instances); above 1 the store must be shared
+    SCHEDULER_INSTANCES = int(os.getenv('SCHEDULER_INSTANCES', '1'))
+    SCHEDULER_LEADER_TTL = float(os.getenv('SCHEDULER_LEADER_TTL', '15'))
+    SCHEDULER_FIRING_TTL = float(os.getenv('SCHEDULER_FIRING_TTL', '86400'))
+    NODE_ID = os.getenv('NODE_ID')
+
+    # Spread sessions over live nodes by consistent hashing; needs a lock store all nodes share
+    SCHEDULER_SHARDING = os.getenv('SCHEDULER_SHARDING', 'False').lower() == 'true'
+    # How often each instance pulls jobs created, changed or deleted elsewhere from
+    # PocketBase; runs when sharding is on or SCHEDULER_INSTANCES is above 1
+    SHARD_SYNC_INTERVAL = int(os.getenv('SHARD_SYNC_INTERVAL', '60'))
+
+    # 'jobs' gives every scheduled message its own scheduler wakeup; 'bucketed' fires
+    # them from one tick a minute, in per-session batches
+    SCHEDULER_DISPATCH_MODE = os.getenv('SCHEDULER_DISPATCH_MODE', 'jobs')
+    BATCH_DISPATCH_WORKERS = int(os.getenv('BATCH_DISPATCH_WORKERS', '8'))
+    BATCH_DISPATCH_CHUNK = int(os.getenv('BATCH_DISPATCH_CHUNK', '50'))
+
+    # Sends go through a durable queue in DATA_DIR and are delivered to WAHA by
+    # OUTBOX_WORKERS threads, retried with backoff up to OUTBOX_MAX_ATTEMPTS times
+    OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', 'True').lower() == 'true'
+    OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '8'))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+    OUTBOX_BACKOFF = float(os.getenv('OUTBOX_BACKOFF', '5'))
+    OUTBOX_BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', '900'))
+    OUTBOX_LEASE = float(os.getenv('OUTBOX_LEASE', '300'))
+    OUTBOX_RETENTION = int(os.getenv('OUTBOX_RETENTION', '604800'))
+
+    # Workers take turns across WAHA sessions, with at most OUTBOX_SESSION_WORKERS each
+    # while others wait; OUTBOX_ISOLATE_AFTER sends in a row slower than OUTBOX_SLOW_AFTER
+    # seconds confine a session to one worker for OUTBOX_ISOLATE_FOR seconds
+    OUTBOX_SESSION_WORKERS = int(os.getenv('OUTBOX_SESSION_WORKERS', '4'))
+    OUTBOX_SLOW_AFTER = float(os.getenv('OUTBOX_SLOW_AFTER', '10'))
+    OUTBOX_ISOLATE_AFTER = int(os.getenv('OUTBOX_ISOLATE_AFTER', '3'))
+    OUTBOX_ISOLATE_FOR = float(os.getenv('OUTBOX_ISOLATE_FOR', '60'))
+
+    # Each (job, fire time, recipient) is sent once; entries are kept for
+    # SEND_LEDGER_TTL, and an unfinished send is taken over after SEND_LEDGER_STALE_AFTER.
+    # The ledger sits in SCHEDULER_LOCK_URL's Redis when SCHEDULER_LOCK_STORE=redis,
+    # otherwise in DATA_DIR, where an instance with a fresh disk starts with it empty
+    SEND_LEDGER_TTL = int(os.getenv('SEND_LEDGER_TTL', '604800'))
+    SEND_LEDGER_STALE_AFTER = float(os.getenv('SEND_LEDGER_STALE_AFTER', '300'))
+
+    # Firings more than CATCHUP_AFTER seconds late (e.g. missed while down) are
+    # skipped, coalesced to one or replayed, per message target; replays are spread
+    # over CATCHUP_WINDOW seconds at no more than CATCHUP_RATE per second
+    CATCHUP_POLICIES = os.getenv('CATCHUP_POLICIES', 'status=coalesce,default=replay')
+    CATCHUP_AFTER = float(os.getenv('CATCHUP_AFTER', '60'))
+    CATCHUP_WINDOW = float(os.getenv('CATCHUP_WINDOW', '600'))
+    CATCHUP_RATE = float(os.getenv('CATCHUP_RATE', '2'))
+
+    # Largest window and number of occurrences /api/calendar will expand
+    CALENDAR_MAX_DAYS = int(os.getenv('CALENDAR_MAX_DAYS', '92'))
+    CALENDAR_MAX_OCCURRENCES = int(os.getenv('CALENDAR_MAX_OCCURRENCES', '20000'))
+
+    # Largest batch /api/scheduled-messages/bulk will validate and register in one go
+    BULK_SCHEDULE_MAX_ROWS = int(os.getenv('BULK_SCHEDULE_MAX_ROWS', '100000'))
+    
     # Static file serving
     STATIC_URL = os.getenv('STATIC_URL')
     
@@ -41,6 +145,13 @@ class Config:
     
     # Media URL
     MEDIA_URL = os.getenv('MEDIA_URL')
+
+    # Content-addressed cache of media already published under MEDIA_URL; cached
+    # copies live in DATA_DIR and are served by URLs signed with SECRET_KEY that
+    # expire after MEDIA_CACHE_URL_TTL seconds
+    MEDIA_CACHE_ENABLED = os.getenv('MEDIA_CACHE_ENABLED', 'True').lower() == 'true'
+    MEDIA_CACHE_SIZE = int(os.getenv('MEDIA_CACHE_SIZE', '1024'))
+    MEDIA_CACHE_URL_TTL = int(os.getenv('MEDIA_CACHE_URL_TTL', '600'))
     
     # NAS Configuration
     USE_NAS_STORAGE = os.getenv('USE_NAS_STORAGE', 'False').lower() == 'true'
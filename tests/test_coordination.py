@@ -0,0 +1,147 @@
+import shutil
+import tempfile
+import time
+import unittest
+from collections import Counter
+from datetime import datetime, timezone
+
+from app.services.coordination import Coordinator, HashRing, SQLiteLockStore
+
+
+class SQLiteLeaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # Two handles on one file, like two processes sharing the disk
+        self.a = SQLiteLockStore(f"{self.dir}/locks.sqlite3")
+        self.b = SQLiteLockStore(f"{self.dir}/locks.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_one_holder_at_a_time(self):
+        self.assertTrue(self.a.acquire('leader', 'node-a', 30))
+        self.assertFalse(self.b.acquire('leader', 'node-b', 30))
+        # The holder renews its own lease
+        self.assertTrue(self.a.acquire('leader', 'node-a', 30))
+        self.assertEqual(self.b.holder('leader')[0], 'node-a')
+
+    def test_release_only_by_holder(self):
+        self.a.acquire('leader', 'node-a', 30)
+        self.b.release('leader', 'node-b')
+        self.assertEqual(self.a.holder('leader')[0], 'node-a')
+
+        self.a.release('leader', 'node-a')
+        self.assertIsNone(self.a.holder('leader'))
+        self.assertTrue(self.b.acquire('leader', 'node-b', 30))
+
+    def test_expired_lease_is_taken_over(self):
+        self.a.acquire('leader', 'node-a', 0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.b.holder('leader'))
+        self.assertTrue(self.b.acquire('leader', 'node-b', 30))
+        self.assertFalse(self.a.acquire('leader', 'node-a', 30))
+
+    def test_members_are_live_leases_under_a_prefix(self):
+        self.a.acquire('node:a', 'a', 30)
+        self.b.acquire('node:b', 'b', 30)
+        self.b.acquire('node:gone', 'gone', 0.05)
+        self.a.acquire('leader', 'a', 30)
+        time.sleep(0.1)
+        self.assertEqual(self.a.members('node:'), ['a', 'b'])
+
+        self.a.purge_expired()
+        self.assertEqual(self.a._connect().execute("SELECT COUNT(*) FROM leases").fetchone()[0], 3)
+
+
+class HashRingTest(unittest.TestCase):
+
+    sessions = [f"session-{i}" for i in range(2000)]
+
+    def test_empty_ring_has_no_owner(self):
+        self.assertIsNone(HashRing().owner('session-1'))
+
+    def test_owner_is_stable_across_instances_and_node_order(self):
+        first = HashRing(['a', 'b', 'c'])
+        second = HashRing(['c', 'a', 'b'])
+        self.assertEqual([first.owner(s) for s in self.sessions], [second.owner(s) for s in self.sessions])
+
+    def test_keys_spread_over_nodes(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = Counter(ring.owner(s) for s in self.sessions)
+        self.assertEqual(set(counts), {'a', 'b', 'c', 'd'})
+        for node, count in counts.items():
+            self.assertTrue(0.15 < count / len(self.sessions) < 0.35, f"{node} owns {count}")
+
+    def test_joining_node_only_takes_keys(self):
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+        moved = [s for s in self.sessions if before.owner(s) != after.owner(s)]
+        self.assertTrue(all(after.owner(s) == 'd' for s in moved))
+        self.assertLess(len(moved) / len(self.sessions), 0.4)
+
+
+class CoordinatorTest(unittest.TestCase):
+
+    sessions = [f"session-{i}" for i in range(200)]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.nodes = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def node(self, node_id):
+        coordinator = Coordinator()
+        coordinator.configure(SQLiteLockStore(f"{self.dir}/locks.sqlite3"), node_id=node_id, leader_ttl=30,
+                              sharding=True)
+        self.nodes.append(coordinator)
+        return coordinator
+
+    def beat(self):
+        # Twice, so every node sees the members that joined after it
+        for _ in range(2):
+            for coordinator in self.nodes:
+                coordinator._heartbeat()
+
+    def test_single_leader(self):
+        a, b = self.node('a'), self.node('b')
+        self.beat()
+        self.assertEqual([a.is_leader(), b.is_leader()].count(True), 1)
+
+        leader, follower = (a, b) if a.is_leader() else (b, a)
+        leader.stop()
+        follower._heartbeat()
+        self.assertTrue(follower.is_leader())
+
+    def test_each_session_has_one_owner(self):
+        a, b = self.node('a'), self.node('b')
+        self.beat()
+        for session in self.sessions:
+            self.assertEqual([a.owns(session, grace=False), b.owns(session, grace=False)].count(True), 1)
+
+    def test_firing_is_claimed_once(self):
+        a, b = self.node('a'), self.node('b')
+        run_time = datetime(2026, 1, 1, 9, 0, tzinfo=timezone.utc)
+        self.assertTrue(a.claim_firing('job-1', run_time))
+        self.assertFalse(b.claim_firing('job-1', run_time))
+        self.assertTrue(b.claim_firing('job-2', run_time))
+
+    def test_previous_owner_keeps_sessions_during_handoff(self):
+        a = self.node('a')
+        self.beat()
+        self.assertTrue(all(a.owns(session, grace=False) for session in self.sessions))
+
+        self.node('b')
+        self.beat()
+        moved = [session for session in self.sessions if not a.owns(session, grace=False)]
+        self.assertTrue(moved)
+        self.assertTrue(all(a.owns(session) for session in moved))
+
+        a._ring_changed_at -= a.leader_ttl * 2
+        self.assertFalse(any(a.owns(session) for session in moved))
+
+
+if __name__ == '__main__':
+    unittest.main()
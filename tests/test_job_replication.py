@@ -0,0 +1,130 @@
+import itertools
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from app.services import job_replication
+from app.services.job_replication import JobReplicator
+
+
+class FakeCollection:
+    """The slice of the PocketBase collection API JobReplicator uses, kept in memory"""
+
+    def __init__(self):
+        self.records = {}
+        self._ids = itertools.count(1)
+
+    def create(self, data):
+        record_id = f"r{next(self._ids)}"
+        self.records[record_id] = dict(data, id=record_id)
+        return SimpleNamespace(id=record_id)
+
+    def update(self, record_id, data):
+        self.records[record_id].update(data)
+        return SimpleNamespace(id=record_id)
+
+    def delete(self, record_id):
+        del self.records[record_id]
+
+    def get_list(self, page, per_page, query=None):
+        items = [SimpleNamespace(**record) for record in self.records.values()]
+        job_filter = (query or {}).get('filter', '')
+        if job_filter.startswith('job_id = '):
+            items = [item for item in items if f'"{item.job_id}"' == job_filter[len('job_id = '):]]
+        return SimpleNamespace(items=items[(page - 1) * per_page:page * per_page],
+                               total_pages=max((len(items) + per_page - 1) // per_page, 1))
+
+
+class Node:
+    """An instance with its own job store, replicating to the shared collection"""
+
+    def __init__(self, path):
+        self.jobs = {}
+        self.replicator = JobReplicator(path, 'whatsappku_scheduled_messages', concurrency=1)
+
+    def change(self, job_id, data=None):
+        if data is None:
+            self.jobs.pop(job_id, None)
+        else:
+            self.jobs[job_id] = data
+        self.replicator.mark_dirty(job_id)
+        self.replicator.sync(self.jobs)
+
+    def pull(self, collection):
+        """What rebalance_shard does with the plan: drop, replace and load jobs"""
+        remote = {record['job_id']: {k: v for k, v in record.items() if k != 'id'}
+                  for record in collection.records.values()}
+        record_ids = {record['job_id']: record_id for record_id, record in collection.records.items()}
+        remove, replace, load = self.replicator.reconcile(self.jobs, remote)
+        for job_id in remove:
+            del self.jobs[job_id]
+        self.replicator.forget(remove)
+        for job_id in replace + load:
+            self.jobs[job_id] = remote[job_id]
+        self.replicator.seed([(job_id, record_ids[job_id], remote[job_id]) for job_id in replace + load])
+        return remove, replace, load
+
+    def due(self):
+        """Job ids this instance would fire"""
+        return set(self.jobs)
+
+
+def message(text):
+    return {'job_id': 'job-1', 'session': 's1', 'phone': '601', 'message': text, 'hour': 9, 'minute': 0}
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.collection = FakeCollection()
+        patcher = mock.patch.object(job_replication, 'get_collection', return_value=self.collection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.a = Node(f"{self.dir}/a.sqlite3")
+        self.b = Node(f"{self.dir}/b.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_job_deleted_on_one_node_stops_firing_on_the_other(self):
+        self.a.change('job-1', message('hello'))
+        self.b.pull(self.collection)
+        self.assertEqual(self.b.due(), {'job-1'})
+
+        self.a.change('job-1')
+        self.assertEqual(self.collection.records, {})
+        self.assertEqual(self.b.pull(self.collection), (['job-1'], [], []))
+        self.assertEqual(self.b.due(), set())
+
+    def test_job_changed_on_one_node_is_replaced_on_the_other(self):
+        self.a.change('job-1', message('hello'))
+        self.b.pull(self.collection)
+
+        self.a.change('job-1', message('changed'))
+        self.assertEqual(self.b.pull(self.collection), ([], ['job-1'], []))
+        self.assertEqual(self.b.jobs['job-1']['message'], 'changed')
+        self.assertEqual(self.b.pull(self.collection), ([], [], []))
+
+    def test_local_changes_not_yet_replicated_are_kept(self):
+        self.a.change('job-1', message('hello'))
+        self.b.pull(self.collection)
+
+        # Created on B and deleted on B, neither replicated yet
+        self.b.jobs['job-2'] = dict(message('new'), job_id='job-2')
+        self.b.jobs.pop('job-1')
+        self.b.replicator.mark_dirty('job-1')
+        self.assertEqual(self.b.pull(self.collection), ([], [], []))
+        self.assertEqual(self.b.due(), {'job-2'})
+
+    def test_delete_remote_removes_a_job_held_elsewhere(self):
+        self.a.change('job-1', message('hello'))
+        self.assertEqual(self.b.replicator.delete_remote('job-1'), 1)
+        self.assertEqual(self.a.pull(self.collection), (['job-1'], [], []))
+        self.assertEqual(self.b.replicator.delete_remote('job-1'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
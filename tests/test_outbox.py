@@ -0,0 +1,70 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from app.services.outbox import Outbox
+
+
+class OutboxFairnessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.release = threading.Event()
+        self.delivered = {}
+        self.lock = threading.Lock()
+        self.outbox = Outbox(f"{self.dir}/outbox.sqlite3", workers=4, session_workers=2,
+                             slow_after=1, isolate_after=2, isolate_for=30, poll_interval=1)
+        self.outbox.register('send', self.handler)
+
+    def tearDown(self):
+        self.release.set()
+        self.outbox.stop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def handler(self, payload):
+        if payload['hang']:
+            # A WAHA session whose browser holds requests until they time out
+            self.release.wait(3)
+        with self.lock:
+            self.delivered.setdefault(payload['session'], []).append(time.monotonic())
+        return {'id': 'true_1@c.us_x'}
+
+    def enqueue(self, session, count, hang=False):
+        for _ in range(count):
+            self.outbox.enqueue('send', {'session': session, 'hang': hang}, session=session)
+
+    def wait_for(self, session, count, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.delivered.get(session, [])) >= count:
+                    return True
+            time.sleep(0.02)
+        return False
+
+    def test_hung_session_leaves_workers_for_others(self):
+        self.enqueue('hung', 20, hang=True)
+        self.outbox.start()
+        time.sleep(0.3)
+        enqueued = time.monotonic()
+        self.enqueue('healthy', 5)
+
+        self.assertTrue(self.wait_for('healthy', 5, timeout=1))
+        self.assertLess(self.delivered['healthy'][-1] - enqueued, 1)
+        self.assertLessEqual(self.outbox.session_stats()['hung']['inflight'], 2)
+
+    def test_fast_session_borrows_idle_workers(self):
+        self.enqueue('warmup', 1)
+        self.outbox.start()
+        self.assertTrue(self.wait_for('warmup', 1, timeout=1))
+
+        self.outbox.register('send', lambda payload: time.sleep(0.2) or self.handler(payload))
+        self.enqueue('warmup', 30)
+        time.sleep(0.3)
+        self.assertGreater(self.outbox.session_stats()['warmup']['inflight'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
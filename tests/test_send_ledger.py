@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from app.services.send_ledger import SendLedger
+
+
+class SendLedgerTest(unittest.TestCase):
+
+    fire_time = datetime(2026, 1, 1, 9, 0, tzinfo=timezone.utc)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ledger = SendLedger(f"{self.dir}/ledger.sqlite3", stale_after=0.05)
+        # Another worker process sharing the file
+        self.other = SendLedger(f"{self.dir}/ledger.sqlite3", stale_after=0.05)
+        self.key = SendLedger.key('job-1', self.fire_time, '601')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_key_is_the_same_instant_in_any_form(self):
+        local = self.fire_time.astimezone(timezone(timedelta(hours=8)))
+        self.assertEqual(SendLedger.key('job-1', local, '601'), self.key)
+        self.assertEqual(SendLedger.key('job-1', self.fire_time.isoformat(), '601'), self.key)
+        self.assertNotEqual(SendLedger.key('job-1', self.fire_time, '602'), self.key)
+        self.assertNotEqual(SendLedger.key('job-1', self.fire_time + timedelta(days=1), '601'), self.key)
+
+    def test_claim_then_sent(self):
+        self.assertEqual(self.ledger.claim(self.key), SendLedger.CLAIMED)
+        self.assertEqual(self.other.claim(self.key), SendLedger.BUSY)
+
+        self.ledger.mark_sent(self.key, 'true_601@c.us_ABC')
+        self.assertEqual(self.other.claim(self.key), SendLedger.SENT)
+        self.assertEqual(self.other.lookup(self.key), (True, 'true_601@c.us_ABC'))
+
+    def test_release_lets_a_retry_send(self):
+        self.ledger.claim(self.key)
+        self.ledger.release(self.key)
+        self.assertIsNone(self.ledger.lookup(self.key))
+        self.assertEqual(self.other.claim(self.key), SendLedger.CLAIMED)
+
+    def test_release_keeps_a_completed_send(self):
+        self.ledger.claim(self.key)
+        self.ledger.mark_sent(self.key, 'id')
+        self.ledger.release(self.key)
+        self.assertEqual(self.other.claim(self.key), SendLedger.SENT)
+
+    def test_stale_claim_is_taken_over(self):
+        self.ledger.claim(self.key)
+        time.sleep(0.1)
+        self.assertEqual(self.other.claim(self.key), SendLedger.CLAIMED)
+        # The takeover is a fresh claim, so the first worker is now the one kept out
+        self.assertEqual(self.ledger.claim(self.key), SendLedger.BUSY)
+
+    def test_sent_is_never_taken_over(self):
+        self.ledger.claim(self.key)
+        self.ledger.mark_sent(self.key)
+        time.sleep(0.1)
+        self.assertEqual(self.other.claim(self.key), SendLedger.SENT)
+
+    def test_compact_forgets_old_sends(self):
+        self.ledger.claim(self.key)
+        self.ledger.mark_sent(self.key)
+        self.assertEqual(self.ledger.compact(60), 0)
+        time.sleep(0.1)
+        self.assertEqual(self.ledger.compact(0.05), 1)
+        self.assertEqual(self.ledger.claim(self.key), SendLedger.CLAIMED)
+
+
+if __name__ == '__main__':
+    unittest.main()
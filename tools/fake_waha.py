@@ -0,0 +1,343 @@
+"""
+Local stand-in for the WAHA API, for load tests and offline development.
+
+    python -m tools.fake_waha --port 3000 --latency lognormal:3.5,0.6 --error-rate 0.01 \
+        --webhook-url http://127.0.0.1:5000/webhook
+
+Latency specs are in milliseconds: fixed:50, uniform:20,200, normal:100,30,
+lognormal:MU,SIGMA (of ln ms) or exp:100.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import requests
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class LatencyModel:
+    """Samples a response delay in seconds from a distribution spec"""
+
+    def __init__(self, spec='fixed:0'):
+        self.spec = spec
+        kind, _, args = spec.partition(':')
+        self.kind = kind
+        self.args = [float(arg) for arg in args.split(',') if arg] or [0.0]
+
+    def sample(self):
+        a = self.args
+        if self.kind == 'fixed':
+            ms = a[0]
+        elif self.kind == 'uniform':
+            ms = random.uniform(a[0], a[1])
+        elif self.kind == 'normal':
+            ms = random.gauss(a[0], a[1])
+        elif self.kind == 'lognormal':
+            ms = random.lognormvariate(a[0], a[1])
+        elif self.kind == 'exp':
+            ms = random.expovariate(1.0 / a[0]) if a[0] else 0.0
+        else:
+            raise ValueError(f"Unknown latency distribution: {self.kind}")
+        return max(ms, 0.0) / 1000.0
+
+
+class FakeWaha:
+    """State and behaviour of the fake server, shared by all request threads"""
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, webhook_url=None, contacts=1000, messages=500):
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.webhook_url = webhook_url
+        self.sessions = {'default': 'WORKING', 'session': 'WORKING'}
+        self.contacts = [
+            {
+                'id': f"6010{i:07d}@c.us",
+                'number': f"6010{i:07d}",
+                'name': f"Contact {i}",
+                'pushname': f"contact{i}",
+                'isMyContact': True,
+                'isBusiness': i % 10 == 0
+            }
+            for i in range(contacts)
+        ]
+        self.message_count = messages
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.errors = Counter()
+        self.received = defaultdict(list)
+        self.records = defaultdict(dict)
+
+    def delay_or_fail(self, endpoint):
+        """Sleep for a sampled latency, then decide whether this call fails"""
+        time.sleep(self.latency.sample())
+        failed = random.random() < self.error_rate
+        with self.lock:
+            self.counts[endpoint] += 1
+            if failed:
+                self.errors[endpoint] += 1
+        return failed
+
+    def record_send(self, endpoint, chat_id):
+        with self.lock:
+            self.received[endpoint].append((time.time(), chat_id))
+
+    def emit(self, event, session, payload):
+        if not self.webhook_url:
+            return
+
+        def post():
+            try:
+                requests.post(self.webhook_url, json={
+                    'event': event,
+                    'session': session,
+                    'payload': payload
+                }, headers={'Authorization': 'fake-waha'}, timeout=5)
+            except requests.RequestException:
+                pass
+        threading.Thread(target=post, daemon=True).start()
+
+    def set_status(self, session, status):
+        self.sessions[session] = status
+        self.emit('session.status', session, {'status': status})
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': dict(self.counts),
+                'errors': dict(self.errors),
+                'sent': {endpoint: len(items) for endpoint, items in self.received.items()}
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.errors.clear()
+            self.received.clear()
+
+
+def create_fake_waha(waha):
+    app = Flask('fake_waha')
+
+    def failure():
+        return jsonify({'statusCode': 500, 'message': 'Injected failure'}), 500
+
+    def session_info(name):
+        return {'name': name, 'status': waha.sessions.get(name, 'STOPPED'), 'config': {}, 'me': None}
+
+    def request_fields():
+        if request.is_json:
+            return request.get_json()
+        return {**request.form, 'session': request.form.get('session') or request.headers.get('session')}
+
+    @app.route('/health')
+    def health():
+        if waha.delay_or_fail('health'):
+            return failure()
+        return jsonify({'status': 'ok', 'info': {'waha': {'status': 'up'}}, 'error': {}, 'details': {}})
+
+    @app.route('/api/<any(sendText, sendImage, sendVideo, sendAudio, sendDocument, sendLocation, sendStatus):endpoint>', methods=['POST'])
+    def send(endpoint):
+        fields = request_fields()
+        if waha.delay_or_fail(endpoint):
+            return failure()
+        if 'file' in request.files:
+            # Drain uploads the way WAHA would, without keeping them
+            while request.files['file'].stream.read(64 * 1024):
+                pass
+        chat_id = fields.get('chatId', 'status')
+        waha.record_send(endpoint, chat_id)
+        message_id = f"true_{chat_id}_{uuid.uuid4().hex[:16].upper()}"
+        waha.emit('message.ack', fields.get('session'), {'id': message_id, 'ack': 1})
+        return jsonify({'id': message_id, 'timestamp': int(time.time())}), 201
+
+    @app.route('/api/sessions', methods=['GET'])
+    def list_sessions():
+        if waha.delay_or_fail('sessions'):
+            return failure()
+        return jsonify([session_info(name) for name in waha.sessions])
+
+    @app.route('/api/sessions', methods=['POST'])
+    def create_session():
+        data = request.get_json() or {}
+        name = data.get('name') or 'default'
+        waha.set_status(name, 'SCAN_QR_CODE' if data.get('start') else 'STOPPED')
+        return jsonify(session_info(name)), 201
+
+    @app.route('/api/sessions/<name>', methods=['GET'])
+    def get_session(name):
+        if waha.delay_or_fail('session'):
+            return failure()
+        return jsonify(session_info(name))
+
+    @app.route('/api/sessions/<name>', methods=['DELETE'])
+    def delete_session(name):
+        waha.sessions.pop(name, None)
+        return jsonify({})
+
+    @app.route('/api/sessions/<name>/<any(start, stop, restart):action>', methods=['POST'])
+    def session_action(name, action):
+        if waha.delay_or_fail(f"session.{action}"):
+            return failure()
+        waha.set_status(name, 'STOPPED' if action == 'stop' else 'WORKING')
+        return jsonify(session_info(name))
+
+    @app.route('/api/sessions/<name>/me')
+    def session_me(name):
+        return jsonify({'id': '60184644305@c.us', 'pushName': 'Fake WAHA'})
+
+    @app.route('/api/contacts/all')
+    def all_contacts():
+        if waha.delay_or_fail('contacts'):
+            return failure()
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        contacts = waha.contacts[offset:offset + limit] if limit else waha.contacts
+        return jsonify(contacts)
+
+    @app.route('/api/contacts')
+    def one_contact():
+        contact_id = request.args.get('contactId')
+        for contact in waha.contacts:
+            if contact['id'] == contact_id or contact['number'] == contact_id:
+                return jsonify(contact)
+        return jsonify({'statusCode': 404, 'message': 'Contact not found'}), 404
+
+    @app.route('/api/chats')
+    def chats():
+        if waha.delay_or_fail('chats'):
+            return failure()
+        return jsonify([{'id': contact['id'], 'name': contact['name']} for contact in waha.contacts[:100]])
+
+    @app.route('/api/<session>/chats/<chat_id>/messages')
+    def messages(session, chat_id):
+        if waha.delay_or_fail('messages'):
+            return failure()
+        limit = request.args.get('limit', 100, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        newest = request.args.get('filter.timestamp.lte', int(time.time()), type=int)
+        indexes = range(offset, min(offset + limit, waha.message_count))
+        return jsonify([
+            {'id': f"msg_{chat_id}_{i}", 'timestamp': newest - i * 60, 'from': chat_id, 'body': f"Message {i}"}
+            for i in indexes
+        ])
+
+    # Minimal PocketBase record API so the app can boot and back up fully offline.
+    # Filters support `a = "x"`, `a = true` and `a != "x"` joined with && or ||.
+    def matches(record, filter_str):
+        if not filter_str:
+            return True
+        for clause in re.split(r'\s*\|\|\s*', filter_str.strip('() ')):
+            terms = re.findall(r'(\w+)\s*(!?=)\s*("[^"]*"|\w+)', clause)
+            ok = True
+            for field, op, value in terms:
+                value = value.strip('"') if value.startswith('"') else {'true': True, 'false': False}.get(value, value)
+                equal = record.get(field) == value
+                ok = ok and (equal if op == '=' else not equal)
+            if ok:
+                return True
+        return False
+
+    @app.route('/api/collections/<collection>/records', methods=['GET'])
+    def pocketbase_list(collection):
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('perPage', 30, type=int)
+        items = [record for record in waha.records[collection].values()
+                 if matches(record, request.args.get('filter'))]
+        if request.args.get('sort', '').lstrip('+-') == 'created' or request.args.get('sort') is None:
+            items.sort(key=lambda record: record['created'], reverse=request.args.get('sort', '').startswith('-'))
+        return jsonify({
+            'page': page,
+            'perPage': per_page,
+            'totalItems': len(items),
+            'totalPages': math.ceil(len(items) / per_page) if per_page else 0,
+            'items': items[(page - 1) * per_page:page * per_page]
+        })
+
+    @app.route('/api/collections/<collection>/records', methods=['POST'])
+    def pocketbase_create(collection):
+        with waha.lock:
+            record_id = uuid.uuid4().hex[:15]
+            record = {**(request.get_json() or request.form.to_dict()), 'id': record_id,
+                      'collectionName': collection,
+                      'created': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] + 'Z'}
+            waha.records[collection][record_id] = record
+        return jsonify(record)
+
+    @app.route('/api/collections/<collection>/records/<record_id>', methods=['GET', 'PATCH', 'DELETE'])
+    def pocketbase_record(collection, record_id):
+        with waha.lock:
+            record = waha.records[collection].get(record_id)
+            if record is None:
+                return jsonify({'code': 404, 'message': "The requested resource wasn't found.", 'data': {}}), 404
+            if request.method == 'PATCH':
+                record.update(request.get_json() or request.form.to_dict())
+            elif request.method == 'DELETE':
+                del waha.records[collection][record_id]
+                return '', 204
+        return jsonify(record)
+
+    @app.route('/_fake/stats')
+    def fake_stats():
+        return jsonify(waha.stats())
+
+    @app.route('/_fake/reset', methods=['POST'])
+    def fake_reset():
+        waha.reset()
+        return jsonify({'status': 'ok'})
+
+    return app
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class FakeWahaServer:
+    """Runs the fake WAHA app on a background thread (port 0 picks a free port)"""
+
+    def __init__(self, waha, host='127.0.0.1', port=0, quiet=True):
+        self.waha = waha
+        handler = _QuietRequestHandler if quiet else WSGIRequestHandler
+        self.server = make_server(host, port, create_fake_waha(waha), threaded=True, request_handler=handler)
+        self.url = f"http://{host}:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake WAHA server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--latency', default='fixed:0', help='latency distribution in ms, e.g. uniform:20,200')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with HTTP 500')
+    parser.add_argument('--webhook-url', help='where to POST session.status and message.ack events')
+    parser.add_argument('--contacts', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=500, help='messages per chat')
+    args = parser.parse_args()
+
+    waha = FakeWaha(args.latency, args.error_rate, args.webhook_url, args.contacts, args.messages)
+    server = FakeWahaServer(waha, args.host, args.port, quiet=False)
+    print(f"Fake WAHA listening on {server.url} (latency={args.latency}, error_rate={args.error_rate})")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(waha.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+"""
+End-to-end load test of the Flask app and scheduler against a fake WAHA.
+
+    python -m tools.loadtest --scenario api --requests 2000 --concurrency 32 --latency uniform:20,120
+    python -m tools.loadtest --scenario scheduled --requests 500 --error-rate 0.02
+    python -m tools.loadtest --scenario all --json results.json
+
+Unless --waha-url points at an already running server, a fake WAHA (see
+tools/fake_waha.py) is started in-process. It also stands in for PocketBase,
+so the app boots without any external service.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.fake_waha import FakeWaha, FakeWahaServer  # noqa: E402
+
+
+class Recorder:
+    """Collects per-operation latencies and failures for one scenario"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def stop(self):
+        self.finished = time.monotonic()
+
+    def record(self, seconds, ok=True):
+        with self._lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    @staticmethod
+    def percentile(values, pct):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+
+    def summary(self):
+        total = len(self.latencies)
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {
+            'scenario': self.name,
+            'operations': total,
+            'errors': self.errors,
+            'error_rate': round(self.errors / total, 4) if total else 0.0,
+            'duration_s': round(elapsed, 3),
+            'throughput_per_s': round(total / elapsed, 2) if elapsed > 0 else 0.0,
+            'p50_ms': round(self.percentile(self.latencies, 50) * 1000, 2),
+            'p95_ms': round(self.percentile(self.latencies, 95) * 1000, 2),
+            'p99_ms': round(self.percentile(self.latencies, 99) * 1000, 2),
+            'max_ms': round(max(self.latencies) * 1000, 2) if total else 0.0
+        }
+
+
+def phone_number(i):
+    return f"6019{i:07d}"
+
+
+def wait_for_outbox(client, message_ids, timeout, headers=None):
+    """
+    Poll /api/health/outbox until nothing is pending or in flight (or the
+    timeout passes), then return {id: outbox message} for `message_ids`.
+    """
+    deadline = time.monotonic() + timeout
+    while message_ids and time.monotonic() < deadline:
+        counts = client.get('/api/health/outbox', headers=headers).get_json()['stats']['queued']
+        if counts['pending'] + counts['inflight'] == 0:
+            break
+        time.sleep(0.2)
+    return {message_id: client.get(f"/api/outbox/{message_id}", headers=headers).get_json().get('data') or {}
+            for message_id in message_ids}
+
+
+def run_api(app, args):
+    """
+    POST /api/message/send from `concurrency` client threads. When the outbox
+    answers 202, wait for it to drain and time each message from enqueue to
+    delivered, so sends still queued do not spill into the next scenario.
+    """
+    recorder = Recorder('api')
+    enqueue = Recorder('api-enqueue')
+    client = app.test_client()
+    headers = {'Authorization': 'loadtest'}
+    queued = []
+
+    def send(i):
+        started = time.monotonic()
+        response = client.post('/api/message/send', json={
+            'phone': phone_number(i),
+            'message': f"Load test message {i}",
+            'session': args.session
+        }, headers=headers)
+        elapsed = time.monotonic() - started
+        enqueue.record(elapsed, response.status_code in (200, 202))
+        if response.status_code == 202:
+            queued.append(response.get_json()['id'])
+        else:
+            recorder.record(elapsed, response.status_code == 200)
+
+    recorder.start()
+    enqueue.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(send, range(args.requests)))
+    enqueue.stop()
+
+    messages = wait_for_outbox(client, queued, args.timeout, headers)
+    recorder.stop()
+
+    undelivered = 0
+    for message in messages.values():
+        if message.get('status') in ('done', 'failed'):
+            delivered = datetime.fromisoformat(message['updated_at']) - datetime.fromisoformat(message['created_at'])
+            recorder.record(delivered.total_seconds(), message['status'] == 'done')
+        else:
+            undelivered += 1
+
+    summary = recorder.summary()
+    enqueued = enqueue.summary()
+    summary.update({
+        'queued': len(queued),
+        'undelivered': undelivered,
+        'enqueue_p50_ms': enqueued['p50_ms'],
+        'enqueue_p95_ms': enqueued['p95_ms'],
+        'enqueue_errors': enqueued['errors'],
+        'note': 'latency runs from the request to WAHA accepting the message'
+    })
+    return summary
+
+
+def run_bulk(app, args):
+    """WhatsAppController.send_bulk_message, i.e. the async fan-out used by scheduled lists"""
+    from app.controllers.whatsapp import WhatsAppController
+
+    recorder = Recorder('bulk')
+    phones = [phone_number(i) for i in range(args.requests)]
+    recorder.start()
+    with app.app_context():
+        started = time.monotonic()
+        results = WhatsAppController.send_bulk_message(phones, 'Load test bulk message', args.session,
+                                                       concurrency=args.concurrency)
+        elapsed = time.monotonic() - started
+    recorder.stop()
+    # Per-recipient timings are not exposed, so spread the batch time evenly
+    for result in results:
+        recorder.record(elapsed / max(len(results), 1), result['success'])
+    summary = recorder.summary()
+    summary['note'] = 'latency percentiles are the batch average; see throughput'
+    return summary
+
+
+def run_scheduled(app, args):
+    """
+    Schedule one-off sends a few seconds ahead and measure, per job, the delay
+    from its scheduled fire time until the send returned. A firing the outbox
+    queued is only counted once its message is delivered or has failed.
+    """
+    from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+    from app.controllers.scheduler import create_message_sender, scheduler
+
+    recorder = Recorder('scheduled')
+    client = app.test_client()
+    queued = {}
+    prefix = f"loadtest-{int(time.time())}-"
+    done = threading.Event()
+    remaining = [args.requests]
+    lock = threading.Lock()
+
+    def listener(event):
+        if not event.job_id.startswith(prefix):
+            return
+        if event.code == EVENT_JOB_EXECUTED and isinstance(event.retval, dict) and 'queued' in event.retval:
+            queued[event.retval['queued']] = event.scheduled_run_time
+        else:
+            finished = datetime.now(event.scheduled_run_time.tzinfo)
+            ok = event.code == EVENT_JOB_EXECUTED and event.retval is not None
+            recorder.record((finished - event.scheduled_run_time).total_seconds(), ok)
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] <= 0:
+                done.set()
+
+    scheduler.add_listener(listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+    try:
+        with app.app_context():
+            sender = create_message_sender(app)
+            run_date = datetime.now(scheduler.timezone) + timedelta(seconds=args.lead)
+            for i in range(args.requests):
+                scheduler.add_job(
+                    sender,
+                    'date',
+                    run_date=run_date,
+                    id=f"{prefix}{i}",
+                    args=[phone_number(i), f"Scheduled load test {i}"],
+                    kwargs={'session_id': 'loadtest', 'session_name': args.session},
+                    misfire_grace_time=None
+                )
+        recorder.start()
+        time.sleep(args.lead)
+        done.wait(timeout=args.timeout)
+        messages = wait_for_outbox(client, list(queued), args.timeout, {'Authorization': 'loadtest'})
+        recorder.stop()
+    finally:
+        scheduler.remove_listener(listener)
+        for job in scheduler.get_jobs():
+            if job.id.startswith(prefix):
+                job.remove()
+
+    undelivered = 0
+    for message_id, scheduled_run_time in queued.items():
+        message = messages.get(message_id, {})
+        if message.get('status') in ('done', 'failed'):
+            # Outbox times are local and naive
+            fired = scheduled_run_time.astimezone().replace(tzinfo=None)
+            delivered = datetime.fromisoformat(message['updated_at']) - fired
+            recorder.record(delivered.total_seconds(), message['status'] == 'done')
+        else:
+            undelivered += 1
+
+    summary = recorder.summary()
+    summary['unfinished'] = max(remaining[0], 0)
+    summary['queued'] = len(queued)
+    summary['undelivered'] = undelivered
+    return summary
+
+
+def run_broadcast(app, args):
+    """Start a broadcast through the API and poll it to completion"""
+    recorder = Recorder('broadcast')
+    client = app.test_client()
+    headers = {'Authorization': 'loadtest'}
+
+    recorder.start()
+    response = client.post('/api/broadcasts', json={
+        'session': args.session,
+        'message': 'Load test broadcast',
+        'recipients': [phone_number(i) for i in range(args.requests)],
+        'rate': args.broadcast_rate,
+        'burst': args.concurrency
+    }, headers=headers)
+    broadcast = response.get_json()['data']
+
+    deadline = time.monotonic() + args.timeout
+    while broadcast['status'] not in ('completed', 'cancelled') and time.monotonic() < deadline:
+        time.sleep(0.2)
+        broadcast = client.get(f"/api/broadcasts/{broadcast['id']}", headers=headers).get_json()['data']
+    recorder.stop()
+
+    summary = recorder.summary()
+    elapsed = summary['duration_s']
+    done = broadcast['sent'] + broadcast['failed']
+    summary.update({
+        'operations': done,
+        'errors': broadcast['failed'],
+        'error_rate': round(broadcast['failed'] / done, 4) if done else 0.0,
+        'throughput_per_s': round(done / elapsed, 2) if elapsed > 0 else 0.0,
+        'status': broadcast['status'],
+        'note': 'per-message latency is governed by the rate limit; see throughput'
+    })
+    return summary
+
+
+SCENARIOS = {
+    'api': run_api,
+    'bulk': run_bulk,
+    'scheduled': run_scheduled,
+    'broadcast': run_broadcast
+}
+
+
+def build_app(waha_url, data_dir):
+    """Create the real app pointed at the fake WAHA. Must run before `app` is first imported."""
+    os.environ['WAHA_API_URL'] = waha_url
+    os.environ['POCKETBASE_URL'] = waha_url
+    os.environ.setdefault('WAHA_DEFAULT_SESSION', 'default')
+    os.environ['DATA_DIR'] = data_dir
+    os.environ['WAHA_HEALTH_INTERVAL'] = '3600'
+    os.environ['CONTACT_SYNC_INTERVAL'] = '3600'
+
+    from app import create_app
+    app = create_app()
+    app.logger.disabled = True
+    return app
+
+
+def print_table(results):
+    columns = ('scenario', 'operations', 'errors', 'error_rate', 'throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms')
+    print('  '.join(f"{column:>16}" for column in columns))
+    for result in results:
+        print('  '.join(f"{str(result.get(column, '')):>16}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the app against a fake WAHA')
+    parser.add_argument('--scenario', default='all', choices=['all', *SCENARIOS])
+    parser.add_argument('--requests', type=int, default=500, help='operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--session', default='default')
+    parser.add_argument('--latency', default='uniform:20,80', help='fake WAHA latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fake WAHA injected error rate')
+    parser.add_argument('--waha-url', help='use a running WAHA (or fake) instead of starting one')
+    parser.add_argument('--lead', type=float, default=3.0, help='seconds ahead to schedule jobs')
+    parser.add_argument('--broadcast-rate', type=float, default=200.0, help='broadcast sends per second')
+    parser.add_argument('--timeout', type=float, default=300.0, help='max seconds to wait per scenario')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    server = None
+    waha_url = args.waha_url
+    if not waha_url:
+        server = FakeWahaServer(FakeWaha(args.latency, args.error_rate)).start()
+        waha_url = server.url
+
+    app = build_app(waha_url, tempfile.mkdtemp(prefix='whatsappku-loadtest-'))
+    scenarios = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+
+    results = []
+    for name in scenarios:
+        print(f"Running {name} ({args.requests} operations, concurrency {args.concurrency})...", file=sys.stderr)
+        if server:
+            server.waha.reset()
+        result = SCENARIOS[name](app, args)
+        if server:
+            # What WAHA actually saw; the app may report success for calls WAHA rejected
+            result['waha'] = server.waha.stats()
+        results.append(result)
+
+    print_table(results)
+    for result in results:
+        if 'waha' in result:
+            print(f"{result['scenario']}: WAHA {json.dumps(result['waha'])}")
+    if server:
+        server.stop()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()